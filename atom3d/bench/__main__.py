@@ -0,0 +1,83 @@
+import logging
+import sys
+
+import click
+
+import atom3d.bench.parse as bp
+import atom3d.bench.read as br
+
+logger = logging.getLogger(__name__)
+
+
+@click.group(help='Benchmarks of ATOM3D datasets.')
+def main():
+    logging.basicConfig(stream=sys.stdout,
+                        format='%(asctime)s %(levelname)s %(process)d: ' +
+                        '%(message)s',
+                        level=logging.INFO)
+
+
+@main.command(help='Measure read throughput and latency of dataset at PATH.')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('-f', '--filetype',
+              type=click.Choice(['lmdb', 'sharded-lmdb', 'pdb', 'pdb.gz',
+                                 'mmcif', 'silent', 'sdf', 'xyz', 'xyz-gdb']),
+              default='lmdb')
+@click.option('-w', '--num_workers', type=int, multiple=True, default=[0],
+              help='number of DataLoader workers, can be repeated.')
+@click.option('-n', '--num_items', type=int,
+              help='number of items to read (default: all).')
+@click.option('-sf', '--serialization_format', multiple=True,
+              type=click.Choice(['msgpack', 'pkl', 'json', 'columnar']),
+              help='also measure an LMDB copy in this format, can be '
+              'repeated.')
+@click.option('-c', '--compression', multiple=True,
+              type=click.Choice(['gzip', 'zstd', 'lz4', 'none']),
+              help='also measure an LMDB copy with this compression, can be '
+              'repeated.')
+@click.option('--work_dir', type=click.Path(),
+              help='directory for LMDB copies (default: temporary).')
+@click.option('--stages', is_flag=True,
+              help='also report time per item of each stage of reading.')
+@click.option('-o', '--output', type=click.Path(),
+              help='write results to this .csv or .json file.')
+def read(path, filetype, num_workers, num_items, serialization_format,
+         compression, work_dir, stages, output):
+    results = br.benchmark_read(path, filetype, num_workers, num_items,
+                                serialization_format, compression, work_dir,
+                                stages)
+    print(results.to_string(index=False))
+    _write_results(results, output)
+
+
+@main.command(help='Compare how fast structure files at PATH are parsed into '
+              'dataframes.')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('-f', '--filetype', type=click.Choice(['pdb', 'pdb.gz', 'mmcif', 'xyz']),
+              default='pdb')
+@click.option('-r', '--reader', multiple=True,
+              type=click.Choice(list(bp.readers)),
+              help='reader to compare, can be repeated (default: all).')
+@click.option('--repeats', type=int, default=3,
+              help='number of times to parse all files.')
+@click.option('-o', '--output', type=click.Path(),
+              help='write results to this .csv or .json file.')
+def parse(path, filetype, reader, repeats, output):
+    results = bp.benchmark_parse(path, filetype, list(reader) or None,
+                                 repeats)
+    print(results.to_string(index=False))
+    _write_results(results, output)
+
+
+def _write_results(results, output):
+    if output is None:
+        return
+    if output.endswith('.json'):
+        results.to_json(output, orient='records', indent=2)
+    else:
+        results.to_csv(output, index=False)
+    logger.info(f'Wrote results to {output}')
+
+
+if __name__ == "__main__":
+    main()
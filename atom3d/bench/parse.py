@@ -0,0 +1,68 @@
+"""Throughput of parsing structure files into ATOM3D dataframes."""
+import logging
+from pathlib import Path
+import time
+
+import pandas as pd
+
+import atom3d.util.file as fi
+import atom3d.util.formats as fo
+
+logger = logging.getLogger(__name__)
+
+
+def _biopython_to_df(f):
+    return fo.bp_to_df(fo.read_any(f))
+
+
+# Ways to parse a file into a dataframe, by name.
+readers = {
+    'biopython': _biopython_to_df,
+    'direct': fo.read_any_to_df,
+}
+
+
+def benchmark_parse(path, filetype='pdb', reader_names=None, repeats=3):
+    """
+    Measure how fast each reader parses the files at `path` into ATOM3D dataframes.
+
+    :param path: file or directory of files to parse
+    :type path: Union[str, Path]
+    :param filetype: file type to look for in a directory, defaults to 'pdb'
+    :type filetype: str, optional
+    :param reader_names: names of the readers to compare, see `readers`, defaults to all
+    :type reader_names: list[str], optional
+    :param repeats: number of times to parse all files, the fastest counts, defaults to 3
+    :type repeats: int, optional
+
+    :return: one row per reader, with number of files and atoms, seconds, atoms per second and speedup over the first reader
+    :rtype: pandas.DataFrame
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(fi.find_files(path, fo.patterns[filetype]))
+    else:
+        files = [path]
+    if not files:
+        raise RuntimeError(f'No {filetype} files found at {path}')
+    if reader_names is None:
+        reader_names = list(readers)
+
+    rows = []
+    for reader_name in reader_names:
+        reader = readers[reader_name]
+        seconds = []
+        for _ in range(repeats):
+            num_atoms = 0
+            start = time.perf_counter()
+            for f in files:
+                num_atoms += len(reader(f))
+            seconds.append(time.perf_counter() - start)
+        logger.info(f'{reader_name}: {min(seconds):.3f} s for {len(files)} '
+                    f'files')
+        rows.append({'reader': reader_name, 'num_files': len(files),
+                     'num_atoms': num_atoms, 'seconds': min(seconds),
+                     'atoms_per_sec': num_atoms / min(seconds)})
+    results = pd.DataFrame(rows)
+    results['speedup'] = results['seconds'].iloc[0] / results['seconds']
+    return results
@@ -0,0 +1,199 @@
+"""Throughput of reading items from datasets."""
+import itertools
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from torch.utils.data import DataLoader, Dataset, Subset
+
+import atom3d.datasets.cache as ca
+import atom3d.datasets.datasets as da
+import atom3d.datasets.lmdb_ops as lo
+import atom3d.datasets.timing as ti
+
+logger = logging.getLogger(__name__)
+
+
+def record_nbytes(dataset, index):
+    """Get the size of the raw LMDB record of item `index` of an LMDB dataset (or a subset of one), as read before decompressing it, or None for other datasets."""
+    if isinstance(dataset, Subset):
+        return record_nbytes(dataset.dataset, dataset.indices[index])
+    if not isinstance(dataset, da.LMDBDataset):
+        return None
+    key = str(dataset._stored_index(index)).encode()
+    return len(dataset._get_txn().get(key))
+
+
+class _TimedDataset(Dataset):
+    """Items of a dataset, together with the time it took to get them, their size as read from LMDB and their size in memory."""
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self._dataset)
+
+    def __getitem__(self, index: int):
+        start = time.perf_counter()
+        x = self._dataset[index]
+        seconds = time.perf_counter() - start
+        return seconds, record_nbytes(self._dataset, index), \
+            ca.item_nbytes(x), x
+
+
+def _identity(x):
+    return x
+
+
+def disk_bytes(path):
+    """Get the total size of the files at `path`."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(x.stat().st_size for x in path.rglob('*') if x.is_file())
+
+
+def time_reads(dataset, num_workers=0, num_items=None):
+    """
+    Read the first `num_items` items of a dataset in order, through a :class:`torch.utils.data.DataLoader` with `num_workers` workers.
+
+    :param dataset: Dataset to read.
+    :type dataset: torch.utils.data.Dataset
+    :param num_workers: Number of DataLoader workers.
+    :type num_workers: int
+    :param num_items: Number of items to read, defaults to all.
+    :type num_items: int
+
+    :return: Number of items, wall time in seconds (including starting the workers), time it took to get each item in seconds, total size of the records read from LMDB in bytes (None for other datasets, see :func:`record_nbytes`), and total size of the items in memory in bytes.
+    :rtype: tuple
+    """
+    if num_items is not None and num_items < len(dataset):
+        dataset = Subset(dataset, range(num_items))
+    loader = DataLoader(_TimedDataset(dataset), batch_size=None,
+                        num_workers=num_workers, collate_fn=_identity)
+    latencies, read_bytes, nbytes = [], 0, 0
+    start = time.perf_counter()
+    for seconds, record_size, size, _ in loader:
+        latencies.append(seconds)
+        if record_size is None:
+            read_bytes = None
+        elif read_bytes is not None:
+            read_bytes += record_size
+        nbytes += size
+    return len(latencies), time.perf_counter() - start, \
+        np.array(latencies), read_bytes, nbytes
+
+
+def _stage_times(dump_dir, num_items):
+    """Get the milliseconds per item spent in each stage, by the calling process and the processes that dumped their times to `dump_dir`."""
+    stages = [x for x in (ti.summary(), ti.load(dump_dir)) if len(x)]
+    if not stages:
+        return {}
+    seconds = pd.concat(stages).groupby('stage', sort=False)['seconds'].sum()
+    return {f'{stage}_ms': 1000 * x / max(1, num_items)
+            for stage, x in seconds.items()}
+
+
+def benchmark_read(path, filetype='lmdb', num_workers=(0,), num_items=None,
+                   serialization_formats=(), compressions=(), work_dir=None,
+                   stages=False):
+    """
+    Measure the read throughput of a dataset for each number of workers in `num_workers`. To compare storage choices, the first `num_items` items are also written to LMDB datasets with each combination of `serialization_formats` and `compressions`, and these are measured too.
+
+    :param path: Path to the dataset, see :func:`load_dataset <atom3d.datasets.datasets.load_dataset>`.
+    :type path: Union[str, Path]
+    :param filetype: Type of the dataset, see :func:`load_dataset <atom3d.datasets.datasets.load_dataset>`.
+    :type filetype: str
+    :param num_workers: Numbers of DataLoader workers to measure.
+    :type num_workers: list[int]
+    :param num_items: Number of items to read, defaults to all.
+    :type num_items: int
+    :param serialization_formats: Serialization formats to write LMDB copies with, defaults to those of the input for LMDB datasets, or json.
+    :type serialization_formats: list[str]
+    :param compressions: Compressions to write LMDB copies with, defaults to those of the input for LMDB datasets, or gzip.
+    :type compressions: list[str]
+    :param work_dir: Directory to write the LMDB copies to, defaults to a temporary directory.
+    :type work_dir: Union[str, Path]
+    :param stages: Also report the milliseconds per item spent in each stage of getting items (see :mod:`atom3d.datasets.timing`), as columns `<stage>_ms`.
+    :type stages: bool
+
+    :return: One row per dataset and number of workers, with items per second, MB per second read from LMDB (records as stored, before decompressing) and decoded (items in memory), p50 and p99 latency of getting an item in milliseconds, and size on disk in MB.
+    :rtype: pandas.DataFrame
+    """
+    dataset = da.load_dataset(str(path), filetype)
+    variants = [(filetype, str(path), None, None)]
+    if isinstance(dataset, da.LMDBDataset):
+        variants = [(filetype, str(path), dataset._serialization_format,
+                     dataset._compression)]
+
+    temp_dir = None
+    output_dir = work_dir
+    if work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        output_dir = temp_dir.name
+    try:
+        if serialization_formats or compressions:
+            if isinstance(dataset, da.LMDBDataset):
+                source = lo._StoredItems(dataset)
+            else:
+                source = dataset
+            if num_items is not None and num_items < len(source):
+                source = Subset(source, range(num_items))
+            for serialization_format, compression in itertools.product(
+                    serialization_formats or [variants[0][2] or 'json'],
+                    compressions or [variants[0][3] or 'gzip']):
+                output_lmdb = Path(output_dir) / \
+                    f'{serialization_format}_{compression}.lmdb'
+                logger.info(f'Writing {output_lmdb}')
+                da.make_lmdb_dataset(source, output_lmdb,
+                                     serialization_format=serialization_format,
+                                     compression=compression)
+                variants.append(('lmdb', str(output_lmdb),
+                                 serialization_format, compression))
+
+        rows = []
+        for run, ((filetype, path, serialization_format, compression),
+                  workers) in enumerate(itertools.product(variants,
+                                                          num_workers)):
+            dataset = da.load_dataset(path, filetype)
+            logger.info(f'Reading {path} with {workers} workers')
+            if stages:
+                dump_dir = Path(output_dir) / f'timing_{run}'
+                ti.reset()
+                ti.enable(dump_dir)
+            try:
+                count, seconds, latencies, read_bytes, nbytes = time_reads(
+                    dataset, workers, num_items)
+            finally:
+                if stages:
+                    ti.disable()
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000 \
+                if count else (np.nan, np.nan)
+            rows.append({
+                'path': path,
+                'filetype': filetype,
+                'serialization_format': serialization_format,
+                'compression': compression,
+                'num_workers': workers,
+                'num_items': count,
+                'seconds': seconds,
+                'items_per_sec': count / seconds,
+                'read_mb_per_sec': np.nan if read_bytes is None else
+                read_bytes / 1e6 / seconds,
+                'decoded_mb_per_sec': nbytes / 1e6 / seconds,
+                'p50_ms': p50,
+                'p99_ms': p99,
+                'size_mb': disk_bytes(path) / 1e6,
+            })
+            if stages:
+                rows[-1].update(_stage_times(dump_dir, count))
+        for _, path, _, _ in variants[1:]:
+            # Release the copies before they are removed.
+            da._close_lmdb_env(Path(path).absolute())
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    return pd.DataFrame(rows)
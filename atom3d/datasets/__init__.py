@@ -1 +1,2 @@
-from .datasets import LMDBDataset, PDBDataset, SilentDataset, load_dataset, make_lmdb_dataset
+from .datasets import LMDBDataset, LMDBIterableDataset, PDBDataset, ShardedLMDBDataset, SilentDataset, export_lmdb_subset, load_dataset, make_lmdb_dataset, make_sharded_lmdb_dataset
+from .samplers import SizeBucketSampler, atom_counts
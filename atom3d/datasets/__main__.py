@@ -12,13 +12,29 @@ logger = logging.getLogger(__name__)
 @click.command()
 @click.argument('input_dir', type=click.Path(exists=True))
 @click.argument('output_lmdb', type=click.Path(exists=False))
-@click.option('-f', '--filetype', type=click.Choice(['pdb', 'silent', 'xyz', 'xyz-gdb']),
+@click.option('-f', '--filetype',
+              type=click.Choice(da.FILETYPES),
               default='pdb')
 @click.option('-sf', '--serialization_format',
-              type=click.Choice(['msgpack', 'pkl', 'json']),
+              type=click.Choice(['msgpack', 'pkl', 'json', 'columnar']),
               default='json')
+@click.option('-c', '--compression',
+              type=click.Choice(['gzip', 'zstd', 'lz4', 'none']),
+              default='gzip')
+@click.option('--zstd_dict_size', type=int, default=0,
+              help='train zstd dictionary of this many bytes (0: none).')
+@click.option('--num_workers', type=int, default=0,
+              help='number of processes preparing entries (0: serial).')
+@click.option('--layout', type=click.Choice(['item', 'fields']),
+              default='item',
+              help='store each item as one record, or each of its fields.')
+@click.option('--checksums', is_flag=True,
+              help='store record checksums, to verify the LMDB later.')
+@click.option('--resume', is_flag=True,
+              help='continue an unfinished build of OUTPUT_LMDB.')
 @click.option('--score_path', type=click.Path(exists=True))
-def main(input_dir, output_lmdb, filetype, score_path, serialization_format):
+def main(input_dir, output_lmdb, filetype, score_path, serialization_format,
+         compression, zstd_dict_size, num_workers, layout, checksums, resume):
     """Script wrapper to make_lmdb_dataset to create LMDB dataset."""
     logging.basicConfig(stream=sys.stdout,
                         format='%(asctime)s %(levelname)s %(process)d: ' +
@@ -36,8 +52,11 @@ def main(input_dir, output_lmdb, filetype, score_path, serialization_format):
 
     dataset = da.load_dataset(file_list, filetype)
     da.make_lmdb_dataset(
-        dataset, output_lmdb, filetype,
-        serialization_format=serialization_format)
+        dataset, output_lmdb,
+        serialization_format=serialization_format,
+        compression=compression, zstd_dict_size=zstd_dict_size,
+        num_workers=num_workers, layout=layout, checksums=checksums,
+        resume=resume)
 
 
 if __name__ == "__main__":
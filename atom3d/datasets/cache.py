@@ -0,0 +1,197 @@
+"""Caches of LMDB dataset items."""
+import collections
+import copy
+import multiprocessing as mp
+import os
+import sys
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+import atom3d.util.atoms as at
+
+
+def _array_nbytes(x):
+    """Get the memory held by array `x`, including the objects it points to."""
+    if x.dtype == object:
+        return x.nbytes + sum(sys.getsizeof(v) for v in x.ravel())
+    return x.nbytes
+
+
+def item_nbytes(x):
+    """Estimate the memory held by item `x`, from the sizes of its arrays and the strings in them."""
+    if isinstance(x, dict):
+        return sum(item_nbytes(v) for v in x.values())
+    if isinstance(x, (list, tuple)):
+        return sum(item_nbytes(v) for v in x)
+    if isinstance(x, pd.DataFrame):
+        return int(x.memory_usage(index=True, deep=True).sum())
+    if isinstance(x, at.AtomArray):
+        return sum(_array_nbytes(x[name]) for name in x.columns)
+    if isinstance(x, np.ndarray):
+        return _array_nbytes(x)
+    return sys.getsizeof(x)
+
+
+class ItemCache(object):
+    """
+    Least recently used cache of decoded items within a byte budget. Items
+    are copied when they are added and when they are returned, so that
+    changes made by the caller (e.g. by transforms) do not reach the cache.
+
+    :param max_bytes: budget for the items in the cache, see :func:`item_nbytes`
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Every process starts out with its own empty cache.
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def get(self, key):
+        """Get a copy of the item cached under `key`, or None."""
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            x, _ = self._items[key]
+        return copy.deepcopy(x)
+
+    def put(self, key, x):
+        """Cache a copy of item `x` under `key`, evicting the least recently used items to stay within budget."""
+        nbytes = item_nbytes(x)
+        if nbytes > self.max_bytes:
+            return
+        x = copy.deepcopy(x)
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key)[1]
+            self._items[key] = (x, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._nbytes -= evicted
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'items': len(self._items), 'bytes': self._nbytes}
+
+
+class SharedRecordCache(object):
+    """
+    Cache of records in shared memory, for all processes that use copies of
+    it, e.g. the workers of a DataLoader. Records are appended to one shared
+    block until it is full, after which only cached records are served.
+    Unlike :class:`ItemCache`, this cache is insert-only: nothing is ever
+    evicted, so it keeps the first records that fit rather than the most
+    recently used ones.
+
+    Requires Python 3.8 or later.
+
+    The process that creates the cache owns the shared memory, which is
+    released once the cache is garbage collected there.
+
+    :param max_bytes: size of the shared block for records
+    :type max_bytes: int
+    :param num_records: number of records that can be cached, keyed 0 to `num_records` - 1
+    :type num_records: int
+    """
+
+    def __init__(self, max_bytes, num_records):
+        # Needs Python 3.8, imported here so that the rest of the module
+        # works without it.
+        from multiprocessing import shared_memory
+
+        self.max_bytes = max_bytes
+        self.num_records = num_records
+        self._data = shared_memory.SharedMemory(create=True,
+                                                size=max(1, max_bytes))
+        # Offset and length of each record, and the end of the used block.
+        self._table = shared_memory.SharedMemory(
+            create=True, size=8 * (2 * num_records + 1))
+        # Locks of the fork context cannot be passed to spawned processes.
+        self._lock = mp.get_context('spawn').Lock()
+        self._attach()
+        self._offsets[:] = 0
+        self._lengths[:] = -1
+        self._end[0] = 0
+        self._finalizer = weakref.finalize(
+            self, SharedRecordCache._release, os.getpid(), self._data,
+            self._table)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _release(pid, *blocks):
+        # Forked processes inherit the finalizer, only the owner unlinks.
+        if os.getpid() != pid:
+            return
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # Records are still in use, they stay mapped until exit.
+                pass
+            block.unlink()
+
+    def _attach(self):
+        table = np.ndarray((2 * self.num_records + 1,), dtype=np.int64,
+                           buffer=self._table.buf)
+        self._offsets = table[:self.num_records]
+        self._lengths = table[self.num_records:-1]
+        self._end = table[-1:]
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes, 'num_records': self.num_records,
+                '_data': self._data, '_table': self._table,
+                '_lock': self._lock}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get a view of the record cached under `key`, or None."""
+        # Lengths are published after the data, see put.
+        length = int(self._lengths[key])
+        if length < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        offset = int(self._offsets[key])
+        return self._data.buf[offset:offset + length]
+
+    def put(self, key, record):
+        """Cache `record` under `key` if there is space left."""
+        length = len(record)
+        with self._lock:
+            if self._lengths[key] >= 0:
+                return
+            offset = int(self._end[0])
+            if offset + length > self.max_bytes:
+                return
+            self._data.buf[offset:offset + length] = record
+            self._offsets[key] = offset
+            self._end[0] = offset + length
+            self._lengths[key] = length
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'items': int((self._lengths >= 0).sum()),
+                'bytes': int(self._end[0])}
@@ -1,38 +1,133 @@
+import collections
+import concurrent.futures
 import contextlib
+import functools
 import gzip
 import importlib
+import itertools
 import json
 import io
 import logging
 import msgpack
+import multiprocessing as mp
+import os
 from pathlib import Path
 import pickle as pkl
 import tqdm
 import urllib.request
 import subprocess
+import threading
+import zlib
 
 import Bio.PDB
 import lmdb
 import numpy as np
 import pandas as pd
-from torch.utils.data import Dataset, IterableDataset
+import torch
+from torch.utils.data import Dataset, IterableDataset, Subset
 
+import atom3d.datasets.cache as ca
+import atom3d.datasets.timing as ti
 import atom3d.util.rosetta as ar
+import atom3d.util.atoms as at
 import atom3d.util.file as fi
 import atom3d.util.formats as fo
 
 logger = logging.getLogger(__name__)
 
 
+# Read-only LMDB environments opened by this process, keyed by path.  LMDB
+# refuses to open the same environment twice in one process, and a handle must
+# not be used across fork(), so all datasets of a process share one handle that
+# is reopened lazily once we find ourselves in a new (worker) process.
+# Environments that items may hold views into (see `buffers` of LMDBDataset)
+# are pinned: they are never closed here, only dropped, and stay mapped as
+# long as the datasets that read from them.
+_lmdb_envs = {}
+
+
+def _lmdb_file_id(path):
+    """Identify the data file of the LMDB at `path`, to notice re-created files."""
+    path = Path(path)
+    if path.is_dir():
+        path = path / 'data.mdb'
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino)
+
+
+def _lmdb_env_key(path):
+    """Key of the LMDB at `path` among the open environments, its absolute path."""
+    return str(Path(path).absolute())
+
+
+def _open_lmdb_env(path, pin=False):
+    """Get this process's read-only environment for the LMDB at `path`, pinned if `pin`."""
+    path = _lmdb_env_key(path)
+    pid = os.getpid()
+    file_id = _lmdb_file_id(path)
+    if path in _lmdb_envs:
+        env_pid, env_file_id, env, pinned = _lmdb_envs[path]
+        if env_pid == pid and env_file_id == file_id:
+            if pin and not pinned:
+                _lmdb_envs[path] = (pid, file_id, env, True)
+            return env
+        # Inherited from the parent process, or the file was re-created,
+        # release it before reopening.
+        if not pinned:
+            env.close()
+    # Without a lock file there is no reader table, so the number of readers
+    # is not limited.
+    env = lmdb.open(path, max_readers=1, readonly=True,
+                    lock=False, readahead=False, meminit=False)
+    _lmdb_envs[path] = (pid, file_id, env, pin)
+    return env
+
+
+def _close_lmdb_env(path):
+    """Close this process's read-only environment for the LMDB at `path`, if open, e.g. to write to it."""
+    path = _lmdb_env_key(path)
+    if path in _lmdb_envs:
+        env_pid, _, env, pinned = _lmdb_envs.pop(path)
+        if env_pid == os.getpid() and not pinned:
+            env.close()
+
+
 class LMDBDataset(Dataset):
     """
     Creates a dataset from an lmdb file. Adapted from `TAPE <https://github.com/songlab-cal/tape/blob/master/tape/datasets.py>`_.
 
+    The LMDB environment is opened lazily in each process that reads from the
+    dataset (e.g. every DataLoader worker), which then keeps a long-lived read
+    transaction for all of its reads. Ids are looked up by binary search in a
+    sorted array read in place from the memory-mapped LMDB, so that opening a
+    dataset does not depend on its size.
+
+    Items deleted from the LMDB (see :func:`delete_from_lmdb_dataset
+    <atom3d.datasets.lmdb_ops.delete_from_lmdb_dataset>`) are skipped, the
+    remaining items are numbered consecutively. A dataset reflects the LMDB
+    as it was when the dataset was created.
+
     :param data_file: path to LMDB file containing dataset
     :type data_file: Union[str, Path]
+    :param transform: transformation function for data augmentation, defaults to None
+    :type transform: function, optional
+    :param num_threads: number of threads used to decode the items of a batch in :meth:`get_many`, defaults to 1 (decode in the calling thread)
+    :type num_threads: int, optional
+    :param atom_arrays: return atoms as :class:`AtomArray <atom3d.util.atoms.AtomArray>` instead of dataframes, which skips building dataframes altogether, defaults to False
+    :type atom_arrays: bool, optional
+    :param buffers: read records in place from the memory-mapped LMDB instead of copying them out first, defaults to False. Only takes effect with `atom_arrays` for datasets in 'columnar' format, dataframes copy their columns anyway. Without compression, numeric columns of atom arrays are then read-only views into the map, which stays mapped as long as the dataset, even if the LMDB is modified. Use :func:`copy_item` on items that need to outlive the dataset, be modified in place, or see the LMDB as it was when read.
+    :type buffers: bool, optional
+    :param cache_bytes: budget in bytes of a cache of items as stored (before `transform`), 0 for no cache, defaults to 0. The cache of each process holds the most recently used decoded items, or see `shared_cache`. Use :meth:`cache_info` for its hit and miss counts.
+    :type cache_bytes: int, optional
+    :param shared_cache: keep one cache in shared memory for this process and all processes it starts (e.g. DataLoader workers) instead, defaults to False. The shared cache holds decompressed records, which are then deserialized on each use, and fills up on a first-come basis without eviction.
+    :type shared_cache: bool, optional
+    :param fields: only get these keys of each item, and its id, defaults to None (all). For LMDBs written with layout 'fields' (see :func:`make_lmdb_dataset`), other keys are not even read.
+    :type fields: list[str], optional
     """
 
-    def __init__(self, data_file, transform=None):
+    def __init__(self, data_file, transform=None, num_threads=1,
+                 atom_arrays=False, buffers=False, cache_bytes=0,
+                 shared_cache=False, fields=None):
         """constructor
 
         """
@@ -45,67 +140,535 @@ class LMDBDataset(Dataset):
         if not self.data_file.exists():
             raise FileNotFoundError(self.data_file)
 
-        env = lmdb.open(str(self.data_file), max_readers=1, readonly=True,
-                        lock=False, readahead=False, meminit=False)
-
+        self._num_threads = num_threads
+        self._atom_arrays = atom_arrays
+        self._buffers = buffers
+        self._fields = None
+        if fields is not None:
+            # Items always carry their stored id.
+            self._fields = list(fields) + (['id'] if 'id' not in fields else [])
+        self._pid = None
+        self._env = None
+        self._txn = None
+        self._executor = None
+        self._id_index = None
+        # Environments and transactions replaced while items may still hold
+        # views into them.
+        self._retired = []
+
+        # Metadata is always copied, it outlives any transaction.
+        env = _open_lmdb_env(self.data_file)
         with env.begin(write=False) as txn:
             self._num_examples = int(txn.get(b'num_examples'))
             self._serialization_format = \
                 txn.get(b'serialization_format').decode()
-            self._id_to_idx = deserialize(
-                txn.get(b'id_to_idx'), self._serialization_format)
+            # LMDBs written before codecs were configurable are gzipped.
+            self._compression = txn.get(b'compression', b'gzip').decode()
+            self._compression_dict = txn.get(b'compression_dict')
+            self._layout = txn.get(b'layout', b'item').decode()
+            tombstones = txn.get(b'tombstones')
+        # Only atom arrays of the columnar format are decoded in place.
+        self._in_place = buffers and atom_arrays and \
+            self._serialization_format == 'columnar'
+        # Stored index of each item, if items were deleted.
+        if tombstones is None:
+            self._live = None
+        else:
+            self._live = np.setdiff1d(np.arange(self._num_examples),
+                                      _deserialize_indices(tombstones))
+        self._metadata = None
+
+        if not cache_bytes:
+            self._cache = None
+        elif shared_cache:
+            self._cache = ca.SharedRecordCache(cache_bytes, self._num_examples)
+        else:
+            self._cache = ca.ItemCache(cache_bytes)
 
-        self._env = env
         self._transform = transform
 
+    def __getstate__(self):
+        # LMDB handles and thread pools cannot be pickled (e.g. for spawned
+        # DataLoader workers), they are recreated on first use instead.
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        state['_env'] = None
+        state['_txn'] = None
+        state['_executor'] = None
+        state['_id_index'] = None
+        state['_retired'] = []
+        return state
+
+    def _get_txn(self):
+        """Get the read transaction of the current process, opening the environment if needed."""
+        pid = os.getpid()
+        cached = _lmdb_envs.get(_lmdb_env_key(self.data_file))
+        if self._txn is None or self._pid != pid or \
+                cached is None or cached[2] is not self._env:
+            # First use in this process, or the environment was closed.
+            if self._in_place and self._pid == pid and self._txn is not None:
+                # Keep the map of items read so far.
+                self._retired.append((self._env, self._txn))
+            self._env = _open_lmdb_env(self.data_file, pin=self._in_place)
+            # Records are copied out of the map when decoded, unless asked to
+            # read in place (see buffers).
+            self._txn = self._env.begin(write=False, buffers=True)
+            self._executor = None
+            self._id_index = None
+            self._pid = pid
+        return self._txn
+
+    def _get_id_index(self):
+        """Get sorted ids, their indices and the order of the ids by index."""
+        txn = self._get_txn()
+        if self._id_index is None:
+            id_index = txn.get(b'id_index')
+            if id_index is not None:
+                self._id_index = _deserialize_id_index(id_index)
+            else:
+                # Written before the id index existed.
+                self._id_index = _make_id_index(deserialize(
+                    bytes(txn.get(b'id_to_idx')), self._serialization_format))
+        return self._id_index
+
     def __len__(self) -> int:
-        return self._num_examples
+        if self._live is None:
+            return self._num_examples
+        return len(self._live)
+
+    def _stored_index(self, index):
+        """Get the index under which item `index` is stored."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if self._live is None:
+            return index
+        return int(self._live[index])
+
+    def cache_info(self):
+        """
+        Get the hits and misses of the item cache in this process, and the number and bytes of items in the cache, or None without cache.
+
+        :rtype: dict
+        """
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    @property
+    def metadata(self):
+        """
+        Metadata index of the dataset, with one row per item (see
+        :func:`item_metadata`), or None for datasets made before it was
+        stored. Reading it does not touch the items themselves.
+
+        :rtype: pandas.DataFrame
+        """
+        if self._metadata is None:
+            compressed = self._get_txn().get(b'metadata')
+            if compressed is None:
+                return None
+            metadata = _deserialize_table(decompress(
+                compressed, self._compression, self._compression_dict))
+            if self._live is not None:
+                metadata = metadata.iloc[self._live].reset_index(drop=True)
+            self._metadata = metadata
+        return self._metadata
 
     def get(self, id: str):
         idx = self.id_to_idx(id)
         return self[idx]
 
     def id_to_idx(self, id: str):
-        if id not in self._id_to_idx:
-            raise IndexError(id)
-        idx = self._id_to_idx[id]
-        return idx
+        return self.ids_to_indices([id])[0]
 
     def ids_to_indices(self, ids):
-        return [self.id_to_idx(id) for id in ids]
+        sorted_ids, indices, _ = self._get_id_index()
+        keys = np.array([str(id).encode() for id in ids],
+                        dtype=sorted_ids.dtype if len(sorted_ids) else 'S')
+        positions = np.searchsorted(sorted_ids, keys)
+        for id, key, position in zip(ids, keys, positions):
+            # Longer keys were cut to the width of the array, they are
+            # never in it.
+            if position == len(sorted_ids) or \
+                    sorted_ids[position] != key or \
+                    len(str(id).encode()) > sorted_ids.itemsize:
+                raise IndexError(id)
+        indices = indices[positions]
+        if self._live is not None:
+            indices = np.searchsorted(self._live, indices)
+        return indices.tolist()
 
     def ids(self):
-        return list(self._id_to_idx.keys())
+        sorted_ids, _, by_index = self._get_id_index()
+        return [id.decode() for id in sorted_ids[by_index].tolist()]
 
     def __getitem__(self, index: int):
-        if not 0 <= index < self._num_examples:
-            raise IndexError(index)
+        index = self._stored_index(index)
+        started = ti.start()
+        compressed = self._get_txn().get(str(index).encode())
+        ti.stop(started, 'get', len(compressed))
+        return self._decode(index, compressed)
 
-        with self._env.begin(write=False) as txn:
+    def __getitems__(self, indices):
+        # Batched fetch protocol used by torch.utils.data.DataLoader.
+        return self.get_many(indices)
 
-            compressed = txn.get(str(index).encode())
-            buf = io.BytesIO(compressed)
-            with gzip.GzipFile(fileobj=buf, mode="rb") as f:
-                serialized = f.read()
-            item = deserialize(serialized, self._serialization_format)
+    def get_many(self, indices):
+        """
+        Get several items at once. All records are fetched in a single pass of
+        one cursor in key order, and decoded in a thread pool if the dataset
+        was created with `num_threads` > 1.
 
-        # Items that start with prefix atoms are assumed to be a dataframe.
-        for x in item.keys():
-            if x.startswith('atoms'):
-                item[x] = pd.DataFrame(**item[x])
+        :param indices: indices of the items to get
+        :type indices: list[int]
 
+        :return: items, in the same order as `indices`
+        :rtype: list[dict]
+        """
+        indices = [self._stored_index(int(index)) for index in indices]
+        keys = sorted(set(str(index).encode() for index in indices))
+        started = ti.start()
+        with self._get_txn().cursor() as cursor:
+            records = dict(cursor.getmulti(keys))
+        if started is not None:
+            ti.stop(started, 'get', sum(len(x) for x in records.values()))
+        compressed = [records[str(index).encode()] for index in indices]
+
+        if self._num_threads > 1 and len(indices) > 1:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self._num_threads)
+            return list(self._executor.map(self._decode, indices, compressed))
+        return [self._decode(index, x) for index, x in zip(indices, compressed)]
+
+    def _decode(self, index, compressed):
+        """Turn the raw LMDB record of the item stored as `index` into the item."""
+        item = self._load(index, compressed)
         if self._transform:
+            started = ti.start()
             item = self._transform(item)
+            ti.stop(started, 'transform')
         if 'file_path' not in item:
             item['file_path'] = str(self.data_file)
         if 'id' not in item:
             item['id'] = str(index)
         return item
 
+    def _load(self, index, compressed):
+        """Get the item stored as `index` as it was stored, from the cache if possible."""
+        if isinstance(self._cache, ca.ItemCache):
+            item = self._cache.get(index)
+            if item is None:
+                item = self._deserialize(compressed)
+                self._cache.put(index, item)
+            return item
+        if isinstance(self._cache, ca.SharedRecordCache):
+            serialized = self._cache.get(index)
+            if serialized is None:
+                serialized = self._decompress(compressed)
+                self._cache.put(index, serialized)
+            return self._unpack_record(serialized)
+        return self._deserialize(compressed)
+
+    def _deserialize(self, compressed):
+        """Get an item as it was stored from its raw LMDB record."""
+        if self._layout == 'fields':
+            item = {}
+            for field in _unpack_fields(compressed, self._fields).values():
+                started = ti.start()
+                serialized = decompress(field, self._compression,
+                                        self._compression_dict)
+                ti.stop(started, 'decompress', len(serialized))
+                item.update(self._unpack(serialized))
+            return item
+        return self._unpack_record(self._decompress(compressed))
+
+    def _decompress(self, compressed):
+        """Decompress a raw LMDB record, only the requested fields for the 'fields' layout."""
+        started = ti.start()
+        if self._layout == 'fields':
+            serialized = _pack_fields({
+                name: bytes(decompress(field, self._compression,
+                                       self._compression_dict))
+                for name, field in
+                _unpack_fields(compressed, self._fields).items()})
+        else:
+            serialized = decompress(compressed, self._compression,
+                                    self._compression_dict)
+        ti.stop(started, 'decompress', len(serialized))
+        return serialized
+
+    def _unpack_record(self, serialized):
+        """Get an item as it was stored from its decompressed record."""
+        if self._layout == 'fields':
+            item = {}
+            for field in _unpack_fields(serialized).values():
+                item.update(self._unpack(field))
+            return item
+        item = self._unpack(serialized)
+        if self._fields is not None:
+            item = {key: item[key] for key in self._fields if key in item}
+        return item
+
+    def _unpack(self, serialized):
+        """Get an item, or some of its fields, from one serialized dictionary."""
+        if isinstance(serialized, memoryview) and not self._in_place:
+            # Only atom arrays are decoded in place, and only if asked to.
+            serialized = bytes(serialized)
+        started = ti.start()
+        item = deserialize(serialized, self._serialization_format)
+        started = ti.stop(started, 'deserialize', len(serialized))
+
+        # Items that start with prefix atoms are assumed to be a dataframe.
+        for x in item.keys():
+            if x.startswith('atoms'):
+                if self._atom_arrays:
+                    item[x] = at.AtomArray.from_split(**item[x])
+                else:
+                    item[x] = pd.DataFrame(**item[x])
+        ti.stop(started, 'dataframe')
+        return item
+
+
+class ShardedLMDBDataset(Dataset):
+    """
+    Creates one dataset from several LMDB files (shards), e.g. as written by
+    :func:`make_sharded_lmdb_dataset`. Items are numbered across shards in
+    order of the files.
+
+    :param data_files: paths to LMDB files of the shards, or a directory containing them as `*.lmdb`
+    :type data_files: Union[list[Union[str, Path]], str, Path]
+    :param transform: transformation function for data augmentation, defaults to None
+    :type transform: function, optional
+    :param kwargs: other arguments of :class:`LMDBDataset`, applied to each shard
+    """
+
+    def __init__(self, data_files, transform=None, **kwargs):
+        if type(data_files) is not list:
+            data_files = get_file_list(data_files, 'sharded-lmdb')
+        if len(data_files) == 0:
+            raise RuntimeError('Need at least one LMDB shard')
+
+        self._shards = [LMDBDataset(f, transform=transform, **kwargs)
+                        for f in data_files]
+        self.data_files = [shard.data_file for shard in self._shards]
+        # Global index of the first item of each shard, and the total.
+        self._offsets = np.cumsum([0] + [len(s) for s in self._shards])
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    @property
+    def shards(self):
+        return list(self._shards)
+
+    @property
+    def metadata(self):
+        """Metadata index of all shards (see :attr:`LMDBDataset.metadata`), or None if a shard has none."""
+        metadata = [shard.metadata for shard in self._shards]
+        if any(x is None for x in metadata):
+            return None
+        return pd.concat(metadata, ignore_index=True)
+
+    def _locate(self, index):
+        """Get shard number and index within that shard of item `index`."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        shard = int(np.searchsorted(self._offsets, index, side='right')) - 1
+        return shard, int(index - self._offsets[shard])
+
+    def get(self, id: str):
+        idx = self.id_to_idx(id)
+        return self[idx]
+
+    def id_to_idx(self, id: str):
+        for shard, offset in zip(self._shards, self._offsets):
+            try:
+                return int(offset) + shard.id_to_idx(id)
+            except IndexError:
+                pass
+        raise IndexError(id)
+
+    def ids_to_indices(self, ids):
+        return [self.id_to_idx(id) for id in ids]
+
+    def ids(self):
+        return [id for shard in self._shards for id in shard.ids()]
+
+    def __getitem__(self, index: int):
+        shard, index = self._locate(index)
+        return self._shards[shard][index]
+
+    def __getitems__(self, indices):
+        return self.get_many(indices)
+
+    def get_many(self, indices):
+        """
+        Get several items at once, fetching those of each shard with :meth:`LMDBDataset.get_many`.
+
+        :param indices: indices of the items to get
+        :type indices: list[int]
+
+        :return: items, in the same order as `indices`
+        :rtype: list[dict]
+        """
+        by_shard = {}
+        for i, index in enumerate(indices):
+            shard, index = self._locate(int(index))
+            by_shard.setdefault(shard, []).append((i, index))
+        items = [None] * len(indices)
+        for shard, positions in by_shard.items():
+            shard_items = self._shards[shard].get_many(
+                [index for _, index in positions])
+            for (i, _), item in zip(positions, shard_items):
+                items[i] = item
+        return items
+
+
+def _key_order(num_examples):
+    """Get the indices of the items of an LMDB in the order of their keys."""
+    keys = np.arange(num_examples).astype(bytes)
+    return keys[np.argsort(keys, kind='stable')].astype(np.int64)
+
+
+class LMDBIterableDataset(IterableDataset):
+    """
+    Creates an iterable dataset from an lmdb file, which reads items with a
+    sequential cursor instead of looking them up one by one.
+
+    Items are read in blocks of consecutive keys. The blocks are split among
+    distributed ranks and DataLoader workers, and, when shuffling, visited in
+    random order, with items further mixed in a shuffle buffer. This only
+    approximates a random order of items, in exchange for sequential reads.
+
+    :param data_file: path to LMDB file containing dataset
+    :type data_file: Union[str, Path]
+    :param transform: transformation function for data augmentation, defaults to None
+    :type transform: function, optional
+    :param shuffle: shuffle blocks and items, defaults to False
+    :type shuffle: bool, optional
+    :param block_size: number of items per block, defaults to 1000
+    :type block_size: int, optional
+    :param buffer_size: number of items in the shuffle buffer, defaults to 1000
+    :type buffer_size: int, optional
+    :param seed: random seed for shuffling, defaults to 0
+    :type seed: int, optional
+    :param num_replicas: number of distributed ranks, defaults to the world size if torch.distributed is initialized, otherwise 1
+    :type num_replicas: int, optional
+    :param rank: rank of this process, defaults to the rank in torch.distributed if initialized, otherwise 0
+    :type rank: int, optional
+    :param kwargs: other arguments of :class:`LMDBDataset`
+    """
+
+    def __init__(self, data_file, transform=None, shuffle=False,
+                 block_size=1000, buffer_size=1000, seed=0,
+                 num_replicas=None, rank=None, **kwargs):
+        self._dataset = LMDBDataset(data_file, transform=transform, **kwargs)
+        self.data_file = self._dataset.data_file
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.seed = seed
+        distributed = torch.distributed.is_available() and \
+            torch.distributed.is_initialized()
+        if num_replicas is None:
+            num_replicas = \
+                torch.distributed.get_world_size() if distributed else 1
+        if rank is None:
+            rank = torch.distributed.get_rank() if distributed else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._order = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _blocks(self):
+        """Get first and last key of the blocks of this worker, in order."""
+        if self._order is None:
+            self._order = _key_order(self._dataset._num_examples)
+            if self._dataset._live is not None:
+                self._order = self._order[
+                    np.isin(self._order, self._dataset._live)]
+        starts = list(range(0, len(self._order), self.block_size))
+        rng = np.random.default_rng((self.seed, self.epoch))
+        if self.shuffle:
+            starts = [starts[i] for i in rng.permutation(len(starts))]
+
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        worker = 0 if worker_info is None else worker_info.id
+        starts = starts[self.rank * num_workers + worker::
+                        self.num_replicas * num_workers]
+        for start in starts:
+            stop = min(start + self.block_size, len(self._order))
+            yield (str(self._order[start]).encode(),
+                   str(self._order[stop - 1]).encode())
+
+    def _records(self):
+        """Read the records of the blocks of this worker."""
+        with self._dataset._get_txn().cursor() as cursor:
+            for first, last in self._blocks():
+                if not cursor.set_key(first):
+                    raise RuntimeError(f'LMDB entry {first.decode()} in '
+                                       f'{self.data_file} is missing')
+                for key, value in cursor:
+                    # Skip leftovers of interrupted appends.
+                    if int(key) < self._dataset._num_examples:
+                        yield int(key), value
+                    if key == last:
+                        break
+
+    def _shuffled(self, records):
+        rng = np.random.default_rng(
+            (self.seed, self.epoch, self.rank,
+             getattr(torch.utils.data.get_worker_info(), 'id', 0)))
+        buffer = []
+        for record in records:
+            if len(buffer) < self.buffer_size:
+                buffer.append(record)
+                continue
+            i = rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = record
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
+
+    def __iter__(self):
+        records = self._records()
+        if self.shuffle and self.buffer_size > 1:
+            records = self._shuffled(records)
+        for index, value in records:
+            yield self._dataset._decode(index, value)
+
+
+def copy_item(item):
+    """
+    Copy all arrays of an item that are views into memory it does not own,
+    e.g. into the memory-mapped LMDB when reading with `buffers=True`, so that
+    the item can be kept around and modified freely.
+
+    :param item: item as returned by a dataset
+    :type item: dict
+
+    :return: item that owns all of its arrays
+    :rtype: dict
+    """
+    if isinstance(item, dict):
+        return {k: copy_item(v) for k, v in item.items()}
+    if isinstance(item, list):
+        return [copy_item(x) for x in item]
+    if isinstance(item, at.AtomArray):
+        return item.copy()
+    if isinstance(item, np.ndarray) and item.base is not None:
+        return item.copy()
+    return item
+
 
 class PDBDataset(Dataset):
     """
-    Creates a dataset from a list of PDB files.
+    Creates a dataset from a list of PDB, PDB.gz or mmCIF files.
 
     :param file_list: path to LMDB file containing dataset
     :type file_list: list[Union[str, Path]]
@@ -130,13 +693,17 @@ class PDBDataset(Dataset):
 
         file_path = self._file_list[index]
 
+        started = ti.start()
         item = {
-            'atoms': fo.bp_to_df(fo.read_any(file_path)),
+            'atoms': fo.read_any_to_df(file_path),
             'id': file_path.name,
             'file_path': str(file_path),
         }
+        ti.stop(started, 'read')
         if self._transform:
+            started = ti.start()
             item = self._transform(item)
+            ti.stop(started, 'transform')
         return item
 
 
@@ -180,8 +747,10 @@ class SilentDataset(IterableDataset):
         for silent_file in self._file_list:
             pis = self.pyrps.SilentFilePoseInputStream(str(silent_file))
             while pis.has_another_pose():
+                started = ti.start()
                 pose = self.pyrosetta.Pose()
                 pis.fill_pose(pose)
+                started = ti.stop(started, 'read')
 
                 item = {
                     'atoms': self._pose_to_df(pose),
@@ -189,9 +758,12 @@ class SilentDataset(IterableDataset):
                     'file_path': str(silent_file),
                 }
                 item['scores'] = self._scores(item)
+                ti.stop(started, 'dataframe')
 
                 if self._transform:
+                    started = ti.start()
                     item = self._transform(item)
+                    ti.stop(started, 'transform')
 
                 yield item
 
@@ -237,21 +809,24 @@ class XYZDataset(Dataset):
             raise IndexError(index)
 
         file_path = self._file_list[index]
-        bp = fo.read_xyz(file_path, gdb=self._gdb)
+        started = ti.start()
+        df = fo.read_xyz_atoms(file_path, gdb=self._gdb)
         if self._gdb:
-            bp, data, freq, smiles, inchi = bp
-        df = fo.bp_to_df(bp)
+            df, data, freq, smiles, inchi = df
+        ti.stop(started, 'read')
 
         item = {
             'atoms': df,
-            'id': bp.id,
+            'id': df['structure'].iloc[0],
             'file_path': str(file_path),
         }
         if self._gdb:
             item['labels'] = data
             item['freq'] = freq
         if self._transform:
+            started = ti.start()
             item = self._transform(item)
+            ti.stop(started, 'transform')
         return item
 
 
@@ -284,14 +859,17 @@ class SDFDataset(Dataset):
             raise IndexError(index)
         # Read biopython structure
         file_path = self._file_list[index]
+        started = ti.start()
         structure = fo.read_sdf(str(file_path), sanitize=False,
                                 add_hs=False, remove_hs=False)
+        started = ti.stop(started, 'read')
         # assemble the item (no bonds)
         item = {
             'atoms': fo.bp_to_df(structure),
             'id': structure.id,
             'file_path': str(file_path),
         }
+        ti.stop(started, 'dataframe')
         # Add bonds if included
         if self._read_bonds:
             mol = fo.read_sdf_to_mol(str(file_path), sanitize=False,
@@ -299,13 +877,15 @@ class SDFDataset(Dataset):
             bonds_df = fo.get_bonds_list_from_mol(mol[0])
             item['bonds'] = bonds_df
         if self._transform:
+            started = ti.start()
             item = self._transform(item)
+            ti.stop(started, 'transform')
         return item
 
 
 def serialize(x, serialization_format):
     """
-    Serializes dataset `x` in format given by `serialization_format` (pkl, json, msgpack).
+    Serializes dataset `x` in format given by `serialization_format` (pkl, json, msgpack, columnar).
     """
     if serialization_format == 'pkl':
         # Pickle
@@ -322,6 +902,11 @@ def serialize(x, serialization_format):
         # A bit more memory efficient than json, a bit less supported.
         serialized = msgpack.packb(
             x, default=lambda df: df.to_dict(orient='split'))
+    elif serialization_format == 'columnar':
+        # Columnar
+        # Atoms dataframes as typed binary columns that decode without
+        # parsing, everything else as in msgpack.
+        serialized = _serialize_columnar(x)
     else:
         raise RuntimeError('Invalid serialization format')
     return serialized
@@ -329,7 +914,7 @@ def serialize(x, serialization_format):
 
 def deserialize(x, serialization_format):
     """
-    Deserializes dataset `x` assuming format given by `serialization_format` (pkl, json, msgpack).
+    Deserializes dataset `x` assuming format given by `serialization_format` (pkl, json, msgpack, columnar).
     """
     if serialization_format == 'pkl':
         return pkl.loads(x)
@@ -337,26 +922,341 @@ def deserialize(x, serialization_format):
         serialized = json.loads(x)
     elif serialization_format == 'msgpack':
         serialized = msgpack.unpackb(x)
+    elif serialization_format == 'columnar':
+        serialized = _deserialize_columnar(x)
     else:
         raise RuntimeError('Invalid serialization format')
     return serialized
 
 
+# -- Columnar serialization --
+#
+# A columnar record is a little-endian uint32 header length, a msgpack header
+# and a block of 8-byte aligned column buffers.  The header is the item itself,
+# with every atoms dataframe replaced by a description of its columns: float
+# columns are stored as float32, integer columns as int32 (int64 if needed),
+# string columns as a list of categories and integer codes into it.  Columns of
+# any other kind are kept in the header as plain lists.
+
+_COLUMNAR_KEY = '__columnar__'
+_COLUMNAR_ALIGN = 8
+
+
+def _encode_column(values, buffers, offset, float_dtype='<f4'):
+    """Describe one column in the header, adding its binary data to `buffers`."""
+    values = np.asarray(values)
+    spec = {}
+    if values.dtype.kind == 'f':
+        data = values.astype(float_dtype)
+    elif values.dtype.kind in 'iu':
+        if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and
+                                values.max() <= np.iinfo(np.int32).max):
+            data = values.astype('<i4')
+        else:
+            data = values.astype('<i8')
+    elif values.dtype.kind == 'b':
+        data = values.astype('|b1')
+    elif values.dtype.kind == 'S':
+        data = values
+    else:
+        codes, categories = pd.factorize(values)
+        if (codes < 0).any() or \
+                not all(isinstance(c, str) for c in categories):
+            return {'values': values.tolist()}, offset
+        if len(categories) <= np.iinfo(np.uint8).max:
+            data = codes.astype('|u1')
+        elif len(categories) <= np.iinfo(np.uint16).max:
+            data = codes.astype('<u2')
+        else:
+            data = codes.astype('<i4')
+        spec['categories'] = list(categories)
+    spec.update(dtype=data.dtype.str, offset=offset, count=len(data))
+    buffers.append(data.tobytes())
+    padding = -len(buffers[-1]) % _COLUMNAR_ALIGN
+    buffers.append(b'\0' * padding)
+    return spec, offset + len(buffers[-2]) + padding
+
+
+def _decode_column(spec, buf, base):
+    """Get column described by `spec` from the column buffers starting at `base` in `buf`."""
+    if 'values' in spec:
+        return np.array(spec['values'])
+    data = np.frombuffer(buf, dtype=spec['dtype'], count=spec['count'],
+                         offset=base + spec['offset'])
+    if 'categories' in spec:
+        return np.array(spec['categories'], dtype=object)[data]
+    return data
+
+
+def _serialize_columnar(x):
+    buffers = []
+    offset = 0
+    header = {}
+    for key, value in x.items():
+        if key.startswith('atoms') and isinstance(value, pd.DataFrame):
+            columns = []
+            for name in value.columns:
+                spec, offset = _encode_column(
+                    value[name].to_numpy(), buffers, offset)
+                columns.append(spec)
+            index = value.index
+            if index.equals(pd.RangeIndex(len(index))):
+                index = {'start': 0, 'stop': len(index), 'step': 1}
+            elif isinstance(index, pd.RangeIndex):
+                index = {'start': index.start, 'stop': index.stop,
+                         'step': index.step}
+            else:
+                index, offset = _encode_column(
+                    index.to_numpy(), buffers, offset)
+            value = {_COLUMNAR_KEY: {'columns': list(value.columns),
+                                     'data': columns,
+                                     'index': index}}
+        header[key] = value
+    return _join_columnar(header, buffers)
+
+
+def _join_columnar(header, buffers):
+    """Prefix column `buffers` with their (padded) msgpack `header`."""
+    header = msgpack.packb(header, default=lambda df: df.to_dict(orient='split'))
+    prefix = len(header).to_bytes(4, 'little') + header
+    prefix += b'\0' * (-len(prefix) % _COLUMNAR_ALIGN)
+    return b''.join([prefix] + buffers)
+
+
+def _split_columnar(x):
+    """Get header and offset of the column buffers of columnar record `x`."""
+    header_size = int.from_bytes(x[:4], 'little')
+    header = msgpack.unpackb(x[4:4 + header_size])
+    base = 4 + header_size
+    base += -base % _COLUMNAR_ALIGN
+    return header, base
+
+
+def _deserialize_columnar(x):
+    header, base = _split_columnar(x)
+    for key, value in header.items():
+        if isinstance(value, dict) and _COLUMNAR_KEY in value:
+            frame = value[_COLUMNAR_KEY]
+            index = frame['index']
+            if 'start' in index:
+                index = pd.RangeIndex(index['start'], index['stop'],
+                                      index['step'])
+            else:
+                index = _decode_column(index, x, base)
+            # Keyword arguments of pd.DataFrame, like the other formats.
+            header[key] = {
+                'data': {name: _decode_column(spec, x, base)
+                         for name, spec in zip(frame['columns'],
+                                               frame['data'])},
+                'columns': frame['columns'],
+                'index': index,
+            }
+    return header
+
+
+def _serialize_table(df):
+    """Serialize dataframe `df` with columnar layout, keeping full float precision."""
+    buffers = []
+    offset = 0
+    columns = []
+    for name in df.columns:
+        spec, offset = _encode_column(df[name].to_numpy(), buffers, offset,
+                                      float_dtype='<f8')
+        columns.append(spec)
+    return _join_columnar({'columns': [str(name) for name in df.columns],
+                           'data': columns, 'length': len(df)}, buffers)
+
+
+def _deserialize_table(x):
+    header, base = _split_columnar(x)
+    return pd.DataFrame({name: _decode_column(spec, x, base)
+                         for name, spec in zip(header['columns'],
+                                               header['data'])},
+                        index=pd.RangeIndex(header['length']))
+
+
+def _make_id_index(id_to_idx):
+    """Get sorted ids, their indices and the order of the ids by index from the map `id_to_idx`."""
+    ids = np.array([str(id).encode() for id in id_to_idx], dtype='S')
+    indices = np.fromiter(id_to_idx.values(), dtype=np.int64,
+                          count=len(id_to_idx))
+    order = np.argsort(ids, kind='stable')
+    return ids[order], indices[order], np.argsort(indices[order],
+                                                  kind='stable')
+
+
+def _serialize_id_index(id_to_idx):
+    """Serialize the id index of `id_to_idx` as columnar arrays that can be searched in place."""
+    buffers = []
+    offset = 0
+    header = {}
+    for name, values in zip(['ids', 'indices', 'by_index'],
+                            _make_id_index(id_to_idx)):
+        header[name], offset = _encode_column(values, buffers, offset)
+    return _join_columnar(header, buffers)
+
+
+def _deserialize_id_index(x):
+    header, base = _split_columnar(x)
+    return tuple(_decode_column(header[name], x, base)
+                 for name in ['ids', 'indices', 'by_index'])
+
+
+def _pack_fields(fields):
+    """Join the records of the fields of an item, each 8-byte aligned, behind a msgpack header with their names and positions."""
+    names = list(fields)
+    header = msgpack.packb({'fields': names,
+                            'lengths': [len(fields[n]) for n in names]})
+    parts = [len(header).to_bytes(4, 'little'), header]
+    for name in names:
+        parts.append(b'\0' * (-sum(len(x) for x in parts) % _COLUMNAR_ALIGN))
+        parts.append(fields[name])
+    return b''.join(parts)
+
+
+def _unpack_fields(x, fields=None):
+    """Get the records of the `fields` (default: all) of an item packed with :func:`_pack_fields`, as slices of `x`."""
+    header_size = int.from_bytes(x[:4], 'little')
+    header = msgpack.unpackb(x[4:4 + header_size])
+    offset = 4 + header_size
+    records = {}
+    for name, length in zip(header['fields'], header['lengths']):
+        offset += -offset % _COLUMNAR_ALIGN
+        if fields is None or name in fields:
+            records[name] = x[offset:offset + length]
+        offset += length
+    return records
+
+
+def _serialize_indices(indices):
+    buffers = []
+    header = {'indices': _encode_column(
+        np.asarray(indices, dtype=np.int64), buffers, 0)[0]}
+    return _join_columnar(header, buffers)
+
+
+def _deserialize_indices(x):
+    header, base = _split_columnar(x)
+    return _decode_column(header['indices'], x, base)
+
+
+def compress(x, compression, compression_dict=None):
+    """
+    Compresses serialized item `x` with codec given by `compression` (gzip, zstd, lz4, none). A zstd dictionary can be passed as `compression_dict`.
+    """
+    if compression == 'gzip':
+        # gzip
+        # Slow, but readable by every tool (and the C++ reader).
+        # Fixed mtime, so that the same item always compresses the same.
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6,
+                           mtime=0) as f:
+            f.write(x)
+        compressed = buf.getvalue()
+    elif compression == 'zstd':
+        # zstd
+        # Similar ratio to gzip at a fraction of the decompression time,
+        # better still with a dictionary for small items.
+        compressed = _zstd_context('compressor', compression_dict).compress(x)
+    elif compression == 'lz4':
+        # lz4
+        # Fastest to decompress, at a lower ratio.
+        lz4 = _import_codec('lz4.frame', compression)
+        compressed = lz4.compress(x)
+    elif compression == 'none':
+        compressed = x
+    else:
+        raise RuntimeError('Invalid compression')
+    return compressed
+
+
+def decompress(x, compression, compression_dict=None):
+    """
+    Decompresses item `x` assuming codec given by `compression` (gzip, zstd, lz4, none).
+    """
+    if compression == 'gzip':
+        decompressed = gzip.decompress(x)
+    elif compression == 'zstd':
+        decompressed = _zstd_context('decompressor',
+                                     compression_dict).decompress(x)
+    elif compression == 'lz4':
+        lz4 = _import_codec('lz4.frame', compression)
+        decompressed = lz4.decompress(x)
+    elif compression == 'none':
+        decompressed = x
+    else:
+        raise RuntimeError('Invalid compression')
+    return decompressed
+
+
+# zstd compressors and decompressors of each thread, which must not share them,
+# by dictionary.
+_zstd_contexts = threading.local()
+
+
+def _zstd_context(kind, compression_dict):
+    """
+    Get this thread's zstd 'compressor' or 'decompressor' for `compression_dict`. They are made once, loading a dictionary costs more than compressing a small item.
+    """
+    contexts = getattr(_zstd_contexts, 'contexts', None)
+    if contexts is None:
+        contexts = _zstd_contexts.contexts = {}
+    if compression_dict is not None and \
+            not isinstance(compression_dict, bytes):
+        compression_dict = bytes(compression_dict)
+    key = (kind, compression_dict)
+    if key not in contexts:
+        zstd = _import_codec('zstandard', 'zstd')
+        dict_data = None if compression_dict is None else \
+            zstd.ZstdCompressionDict(compression_dict)
+        if kind == 'compressor':
+            contexts[key] = zstd.ZstdCompressor(dict_data=dict_data)
+        else:
+            contexts[key] = zstd.ZstdDecompressor(dict_data=dict_data)
+    return contexts[key]
+
+
+def train_zstd_dict(samples, dict_size):
+    """
+    Train a zstd dictionary of at most `dict_size` bytes on a list of serialized items. Returns None if there is too little data to train on.
+    """
+    zstd = _import_codec('zstandard', 'zstd')
+    try:
+        return zstd.train_dictionary(dict_size, samples).as_bytes()
+    except zstd.ZstdError as e:
+        logger.warning(f'Unable to train zstd dictionary, not using one: {e}')
+        return None
+
+
+def _import_codec(module, compression):
+    if importlib.util.find_spec(module.split('.')[0]) is None:
+        raise RuntimeError(
+            f'Need to install {module.split(".")[0]} to use {compression} '
+            'compression.')
+    return importlib.import_module(module)
+
+
 def get_file_list(input_path, filetype):
     if filetype == 'lmdb':
         file_list = [input_path]
+    elif filetype == 'sharded-lmdb':
+        file_list = sorted(str(x) for x in Path(input_path).glob('*.lmdb'))
     else:
         file_list = fi.find_files(input_path, fo.patterns[filetype])
     return file_list
 
 
+# File types the command line tools find in a directory and load into LMDBs.
+FILETYPES = ['pdb', 'pdb.gz', 'mmcif', 'silent', 'xyz', 'xyz-gdb']
+
+
 def load_dataset(file_list, filetype, transform=None, include_bonds=False):
     """
     Load files in file_list into corresponding dataset object. All files should be of type filetype.
 
     :param file_list: List containing paths to silent files. Assumes one structure per file.
     :type file_list: list[Union[str, Path]]
-    :param filetype: Type of dataset. Allowable types are 'lmdb', 'pdb', 'silent', 'sdf', 'xyz', 'xyz-gdb'.
+    :param filetype: Type of dataset. Allowable types are 'lmdb', 'sharded-lmdb', 'pdb', 'pdb.gz', 'mmcif', 'silent', 'sdf', 'xyz', 'xyz-gdb'.
     :type filetype: str
     :param transform: transformation function for data augmentation, defaults to None
     :type transform: function, optional
@@ -371,7 +1271,9 @@ def load_dataset(file_list, filetype, transform=None, include_bonds=False):
 
     if filetype == 'lmdb':
         dataset = LMDBDataset(file_list, transform=transform)
-    elif filetype == 'pdb':
+    elif filetype == 'sharded-lmdb':
+        dataset = ShardedLMDBDataset(file_list, transform=transform)
+    elif filetype in ('pdb', 'pdb.gz', 'mmcif'):
         dataset = PDBDataset(file_list, transform=transform)
     elif filetype == 'silent':
         dataset = SilentDataset(file_list, transform=transform)
@@ -389,12 +1291,237 @@ def load_dataset(file_list, filetype, transform=None, include_bonds=False):
     return dataset
 
 
+# Number of entries a zstd dictionary is trained on.
+_ZSTD_DICT_SAMPLES = 1000
+
+# Columns identifying a chain of an ATOM3D dataframe.
+_CHAIN_COLUMNS = ['ensemble', 'subunit', 'structure', 'model', 'chain']
+# Scalars of items left out of the metadata index, they are the same for most
+# items or can be found otherwise.
+_NO_METADATA = {'file_path'}
+
+
+def _num_groups(df, columns):
+    """Count the distinct rows of `df[columns]`, from one integer key per row."""
+    key = np.zeros(len(df), dtype=np.int64)
+    for column in columns:
+        # Missing values get code -1, and count as one value.
+        codes, uniques = pd.factorize(df[column])
+        key = pd.factorize(key * (len(uniques) + 1) + codes + 1)[0]
+    return int(key.max()) + 1 if len(key) else 0
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool, np.generic))
+
+
+def item_metadata(x, metadata_fn=None):
+    """
+    Summarize item `x` as one row of the metadata index of an LMDB dataset:
+    its id, number of atoms, number of chains and elements (comma-separated),
+    its scalar values other than its file path, and the scalar values of its dictionaries (as
+    `<key>.<name>`).
+
+    :param x: item of a dataset
+    :type x: dict
+    :param metadata_fn: function returning additional metadata of an item as dictionary of scalars, defaults to None
+    :type metadata_fn: function, optional
+
+    :return: metadata of `x` by column name
+    :rtype: dict
+    """
+    row = {'id': x['id'], 'num_atoms': 0, 'num_chains': 0}
+    elements = set()
+    for key, value in x.items():
+        if key.startswith('atoms') and isinstance(value, pd.DataFrame):
+            row['num_atoms'] += len(value)
+            if 'element' in value:
+                elements.update(value['element'].unique())
+            if 'chain' in value:
+                row['num_chains'] += _num_groups(
+                    value, [c for c in _CHAIN_COLUMNS if c in value])
+        elif isinstance(value, (dict, pd.Series)):
+            for name, v in value.items():
+                if _is_scalar(v):
+                    row[f'{key}.{name}'] = v
+        elif _is_scalar(value) and key not in row and \
+                key not in _NO_METADATA:
+            row[key] = value
+    row['elements'] = ','.join(sorted(str(e) for e in elements))
+    if metadata_fn is not None:
+        row.update(metadata_fn(x))
+    return row
+
+
+# Arguments of _prepare_lmdb_entry_at, set up in each worker of the pool used
+# by make_lmdb_dataset.
+_lmdb_worker_args = None
+
+
+def _bounded_imap(pool, func, indices, chunksize, window):
+    """
+    Like `pool.imap(func, indices, chunksize)`, but with at most two windows of `window` indices submitted at a time, so that results do not pile up when they are consumed slower than they are made.
+    """
+    pending = collections.deque()
+    for start in range(0, len(indices), window):
+        pending.append(pool.imap(func, indices[start:start + window],
+                                 chunksize))
+        if len(pending) == 2:
+            yield from pending.popleft()
+    while pending:
+        yield from pending.popleft()
+
+
+def _init_lmdb_worker(dataset, filter_fn, serialization_format, metadata_fn,
+                      layout):
+    global _lmdb_worker_args
+    _lmdb_worker_args = (dataset, filter_fn, serialization_format, metadata_fn,
+                         layout)
+
+
+def _compress_record(serialized, layout, compression, compression_dict):
+    """Compress a serialized record, field by field for the 'fields' layout."""
+    if layout == 'fields':
+        return _pack_fields({
+            name: compress(field, compression, compression_dict)
+            for name, field in _unpack_fields(serialized).items()})
+    return compress(serialized, compression, compression_dict)
+
+
+def _prepare_lmdb_entry(x, filter_fn, serialization_format, metadata_fn,
+                        layout, compression, compression_dict):
+    """Get id, serialized (and compressed, if `compression` is given) item `x` and its metadata, or None if it is filtered out."""
+    if filter_fn is not None and filter_fn(x):
+        return None
+    if layout == 'fields':
+        # Every field on its own, to read (and decompress) them separately.
+        serialized = _pack_fields({key: serialize({key: value},
+                                                  serialization_format)
+                                   for key, value in x.items()})
+    else:
+        serialized = serialize(x, serialization_format)
+    if compression is not None:
+        serialized = _compress_record(serialized, layout, compression,
+                                      compression_dict)
+    return x['id'], serialized, item_metadata(x, metadata_fn)
+
+
+def _prepare_lmdb_entry_at(index, compression, compression_dict):
+    dataset, filter_fn, serialization_format, metadata_fn, layout = \
+        _lmdb_worker_args
+    return _prepare_lmdb_entry(dataset[index], filter_fn,
+                               serialization_format, metadata_fn, layout,
+                               compression, compression_dict)
+
+
+# Metadata column with the CRC-32 of each stored record, see make_lmdb_dataset.
+_CHECKSUM_COLUMN = 'record_crc32'
+
+
+def _lmdb_header(num_examples, serialization_format, compression,
+                 compression_dict, layout, id_to_idx, metadata,
+                 tombstones=None):
+    """Get the entries describing an LMDB dataset of `num_examples` entries, `id_to_idx` mapping the ids of the entries that were not deleted (`tombstones`)."""
+    header = {
+        b'num_examples': str(num_examples).encode(),
+        b'serialization_format': serialization_format.encode(),
+        b'id_to_idx': serialize(id_to_idx, serialization_format),
+        b'id_index': _serialize_id_index(id_to_idx),
+        b'compression': compression.encode(),
+        b'layout': layout.encode(),
+    }
+    if metadata is not None:
+        header[b'metadata'] = compress(_serialize_table(metadata),
+                                       compression, compression_dict)
+    if tombstones is not None and len(tombstones) > 0:
+        header[b'tombstones'] = _serialize_indices(np.sort(tombstones))
+    return header
+
+
+def _commit_lmdb_chunk(env, entries, metadata, delete=(), overwrite=False):
+    """
+    Write `entries` (new ones, unless `overwrite`) and (over)write `metadata` in one transaction, deleting the keys `delete`, doubling the LMDB map size until they fit.
+    """
+    while True:
+        try:
+            with env.begin(write=True) as txn:
+                for key, value in entries:
+                    if not txn.put(key, value, overwrite=overwrite):
+                        raise RuntimeError(f'LMDB entry {key.decode()} in '
+                                           f'{env.path()} already exists')
+                for key, value in metadata.items():
+                    txn.put(key, value)
+                for key in delete:
+                    txn.delete(key)
+            return
+        except lmdb.MapFullError:
+            map_size = 2 * env.info()['map_size']
+            logger.info(f'Growing map size of {env.path()} to {map_size}')
+            env.set_mapsize(map_size)
+
+
+def _read_lmdb_progress(env, serialization_format, compression, layout,
+                        resume):
+    """
+    Get progress marker, id to index map, metadata rows and compression dictionary of the unfinished LMDB build in `env` if `resume`, or those of a new build if there is none or not `resume`, in which case the unfinished build is discarded.
+    """
+    with env.begin(write=True) as txn:
+        if txn.get(b'num_examples') is not None:
+            raise RuntimeError(f'LMDB {env.path()} already exists')
+        progress = txn.get(b'progress')
+        if progress is not None and not resume:
+            logger.info(f'Discarding unfinished build of {env.path()}')
+            txn.drop(env.open_db(txn=txn), delete=False)
+            progress = None
+        if progress is None:
+            progress = {'serialization_format': serialization_format,
+                        'compression': compression,
+                        'layout': layout,
+                        'next_index': 0,
+                        'next_key': 0,
+                        'id_keys': [],
+                        'metadata_keys': []}
+            return progress, {}, [], None
+
+        progress = json.loads(progress)
+        progress.setdefault('layout', 'item')
+        if progress['serialization_format'] != serialization_format or \
+                progress['compression'] != compression or \
+                progress['layout'] != layout:
+            raise RuntimeError(
+                f'Cannot resume LMDB {env.path()}, it was started with '
+                f'{progress["serialization_format"]}/{progress["compression"]}'
+                f'/{progress["layout"]}')
+        id_to_idx = {}
+        for key in progress['id_keys']:
+            id_to_idx.update(
+                deserialize(txn.get(key.encode()), serialization_format))
+        rows = []
+        for key in progress.setdefault('metadata_keys', []):
+            rows.extend(_deserialize_table(txn.get(key.encode()))
+                        .to_dict(orient='records'))
+        return progress, id_to_idx, rows, txn.get(b'compression_dict')
+
+
 def make_lmdb_dataset(dataset, output_lmdb,
                       filter_fn=None, serialization_format='json',
-                      include_bonds=False):
+                      include_bonds=False, compression='gzip',
+                      zstd_dict_size=0, num_workers=0, commit_items=1000,
+                      commit_bytes=int(1e9), map_size=int(1e11),
+                      metadata_fn=None, layout='item', checksums=False,
+                      resume=False):
     """
     Make an LMDB dataset from an input dataset.
 
+    Entries are committed in chunks, together with a progress marker. If the
+    output LMDB holds an unfinished build of the same dataset, the build
+    resumes after its last committed entry with `resume`, otherwise it starts
+    over. A finished LMDB is never overwritten.
+
+    Alongside the entries, a metadata index with one row per entry (see
+    :func:`item_metadata`) is stored, available as
+    :attr:`LMDBDataset.metadata`.
+
     :param input_file_list: Path to input files.
     :type input_file_list: torch.utils.data.Dataset
     :param output_lmdb: Path to output LMDB.
@@ -402,80 +1529,442 @@ def make_lmdb_dataset(dataset, output_lmdb,
     :param filter_fn: Filter to decided if removing files.
     :type filter_fn: lambda x -> True/False
     :param serialization_format: How to serialize an entry.
-    :type serialization_format: 'json', 'msgpack', 'pkl'
+    :type serialization_format: 'json', 'msgpack', 'pkl', 'columnar'
     :param include_bonds: Include bond information (only available for SDF yet).
     :type include_bonds: bool
+    :param compression: How to compress an entry.
+    :type compression: 'gzip', 'zstd', 'lz4', 'none'
+    :param zstd_dict_size: Size in bytes of a zstd dictionary to train on the first entries, 0 for no dictionary.
+    :type zstd_dict_size: int
+    :param num_workers: Number of processes loading, filtering, serializing and compressing entries, which are then written in order by the calling process. Workers run at most about `commit_items` entries ahead of writing. 0 to do everything in the calling process. The output is the same either way. Requires a map-style dataset.
+    :type num_workers: int
+    :param commit_items: Commit after this many entries.
+    :type commit_items: int
+    :param commit_bytes: Commit after this many bytes of entries.
+    :type commit_bytes: int
+    :param map_size: Initial LMDB map size in bytes, doubled whenever it is full.
+    :type map_size: int
+    :param metadata_fn: Function returning additional metadata of an entry as dictionary of scalars.
+    :type metadata_fn: lambda x -> dict
+    :param layout: How to store an entry, 'item' as one record, or 'fields' as one sub-record per key of the entry, so that fields can be read on their own (see `fields` of :class:`LMDBDataset`).
+    :type layout: 'item', 'fields'
+    :param checksums: Add the CRC-32 of each stored record to the metadata index, as column `record_crc32`, to detect corrupted records later (see :func:`verify_lmdb_dataset <atom3d.datasets.lmdb_ops.verify_lmdb_dataset>`).
+    :type checksums: bool
+    :param resume: Continue an unfinished build of `output_lmdb` instead of starting over.
+    :type resume: bool
     """
 
     num_examples = len(dataset)
 
     logger.info(f'{num_examples} examples')
 
-    env = lmdb.open(str(output_lmdb), map_size=int(1e11))
+    if num_workers > 0 and isinstance(dataset, IterableDataset):
+        raise RuntimeError('Need map-style dataset to use num_workers')
+
+    with lmdb.open(str(output_lmdb), map_size=map_size) as env:
+        progress, id_to_idx, rows, compression_dict = _read_lmdb_progress(
+            env, serialization_format, compression, layout, resume)
+        start = progress['next_index']
+        if start > 0:
+            logger.info(f'Resuming after {start} examples')
+
+        if num_workers > 0:
+            pool = mp.Pool(num_workers, initializer=_init_lmdb_worker,
+                           initargs=(dataset, filter_fn, serialization_format,
+                                     metadata_fn, layout))
+            chunksize = max(1, min(64, num_examples // (16 * num_workers)))
+
+            # Workers only run this far ahead of the writer.
+            window = max(commit_items, 4 * chunksize * num_workers)
+
+            def _entries(start, stop, *compress_args):
+                return _bounded_imap(
+                    pool, functools.partial(_prepare_lmdb_entry_at,
+                                            compression=compress_args[0],
+                                            compression_dict=compress_args[1]),
+                    range(start, stop), chunksize, window)
+        else:
+            pool = None
+            if isinstance(dataset, IterableDataset):
+                items = itertools.islice(dataset, start, None)
+            else:
+                items = (dataset[index] for index in range(start, num_examples))
+
+            def _entries(start, stop, *compress_args):
+                for x in itertools.islice(items, stop - start):
+                    yield _prepare_lmdb_entry(
+                        x, filter_fn, serialization_format, metadata_fn,
+                        layout, *compress_args)
+
+        try:
+
+            if compression == 'zstd' and zstd_dict_size and start == 0:
+                num_samples = min(_ZSTD_DICT_SAMPLES, num_examples)
+                samples = list(_entries(0, num_samples, None, None))
+                compression_dict = train_zstd_dict(
+                    [x[1] for x in samples if x is not None], zstd_dict_size)
+                if compression_dict is not None:
+                    _commit_lmdb_chunk(
+                        env, [], {b'compression_dict': compression_dict})
+                samples = [
+                    None if x is None else
+                    (x[0], _compress_record(x[1], layout, compression,
+                                            compression_dict), x[2])
+                    for x in samples]
+                entries = itertools.chain(
+                    samples, _entries(num_samples, num_examples, compression,
+                                      compression_dict))
+            else:
+                entries = _entries(start, num_examples, compression,
+                                   compression_dict)
+
+            # Ids may repeat, so the number of records written so far is kept
+            # in the progress marker rather than taken from id_to_idx.
+            i = progress.get('next_key', len(id_to_idx))
+            chunk, chunk_ids, chunk_rows, chunk_bytes = [], {}, [], 0
+            for index, entry in enumerate(
+                    tqdm.tqdm(entries, total=num_examples, initial=start),
+                    start + 1):
+                if entry is not None:
+                    id, compressed, row = entry
+                    if checksums:
+                        row[_CHECKSUM_COLUMN] = zlib.crc32(compressed)
+                    chunk.append((str(i).encode(), compressed))
+                    chunk_ids[id] = i
+                    chunk_rows.append(row)
+                    chunk_bytes += len(compressed)
+                    id_to_idx[id] = i
+                    i += 1
+
+                if len(chunk) >= commit_items or chunk_bytes >= commit_bytes:
+                    # Ids and metadata of the chunk go with it, to rebuild
+                    # id_to_idx and the metadata index when resuming.
+                    id_key = f'progress_ids_{index}'
+                    metadata_key = f'progress_metadata_{index}'
+                    progress['next_index'] = index
+                    progress['next_key'] = i
+                    progress['id_keys'].append(id_key)
+                    progress['metadata_keys'].append(metadata_key)
+                    _commit_lmdb_chunk(env, chunk, {
+                        id_key.encode(): serialize(chunk_ids,
+                                                   serialization_format),
+                        metadata_key.encode(): _serialize_table(
+                            pd.DataFrame(chunk_rows)),
+                        b'progress': json.dumps(progress).encode()})
+                    rows.extend(chunk_rows)
+                    chunk, chunk_ids, chunk_rows, chunk_bytes = [], {}, [], 0
+            rows.extend(chunk_rows)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        metadata = _lmdb_header(i, serialization_format, compression,
+                                compression_dict, layout, id_to_idx,
+                                pd.DataFrame(rows))
+        _commit_lmdb_chunk(env, chunk, metadata, delete=[b'progress'] + [
+            key.encode()
+            for key in progress['id_keys'] + progress['metadata_keys']])
+
+
+
+def export_lmdb_subset(dataset, output_lmdb, indices=None,
+                       commit_items=1000, commit_bytes=int(1e9),
+                       map_size=int(1e9)):
+    """
+    Write the items of an LMDB dataset at `indices` to a new LMDB dataset, numbered in the order of `indices`. The records are copied as they are, without decoding them, so the output has the same serialization format and compression as the input.
 
-    with env.begin(write=True) as txn:
+    :param dataset: Input LMDB dataset, path to it, or subset of it (see :func:`atom3d.splits.splits.split`).
+    :type dataset: Union[LMDBDataset, str, Path, torch.utils.data.Subset]
+    :param output_lmdb: Path to output LMDB.
+    :type output_lmdb: Union[str, Path]
+    :param indices: Indices of the items to export, defaults to all items, or those of the subset.
+    :type indices: list[int]
+    :param commit_items: Commit after this many entries.
+    :type commit_items: int
+    :param commit_bytes: Commit after this many bytes of entries.
+    :type commit_bytes: int
+    :param map_size: Initial LMDB map size in bytes, doubled whenever it is full.
+    :type map_size: int
+    """
+    if isinstance(dataset, Subset):
+        if indices is None:
+            indices = dataset.indices
+        else:
+            indices = [dataset.indices[i] for i in indices]
+        dataset = dataset.dataset
+    elif not isinstance(dataset, LMDBDataset):
+        dataset = LMDBDataset(dataset)
+    if indices is None:
+        indices = range(len(dataset))
+    _copy_lmdb_records([(dataset, indices)], output_lmdb, commit_items,
+                       commit_bytes, map_size)
 
-        id_to_idx = {}
+
+def _copy_lmdb_records(sources, output_lmdb, commit_items=1000,
+                       commit_bytes=int(1e9), map_size=int(1e9)):
+    """
+    Write the records of the items at the indices of each of `sources`, a list of LMDB datasets and indices, to a new LMDB dataset.
+    """
+    first = sources[0][0]
+    encoding = (first._serialization_format, first._compression,
+                first._compression_dict, first._layout)
+    for dataset, _ in sources:
+        if (dataset._serialization_format, dataset._compression,
+                dataset._compression_dict, dataset._layout) != encoding:
+            raise RuntimeError(f'Cannot copy records of {dataset.data_file}, '
+                               f'it is encoded differently than '
+                               f'{first.data_file}')
+
+    with lmdb.open(str(output_lmdb), map_size=map_size) as env:
+        with env.begin() as txn:
+            if txn.get(b'num_examples') is not None:
+                raise RuntimeError(f'LMDB {env.path()} already exists')
+        if encoding[2] is not None:
+            _commit_lmdb_chunk(env, [], {b'compression_dict': encoding[2]})
+
+        id_to_idx, metadata = {}, []
         i = 0
-        for x in tqdm.tqdm(dataset, total=num_examples):
-            if filter_fn is not None and filter_fn(x):
-                continue
-            buf = io.BytesIO()
-            with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6) as f:
-                f.write(serialize(x, serialization_format))
-            compressed = buf.getvalue()
-            result = txn.put(str(i).encode(), compressed, overwrite=False)
-            if not result:
-                raise RuntimeError(f'LMDB entry {i} in {str(output_lmdb)} '
-                                   'already exists')
-
-            id_to_idx[x['id']] = i
-            i += 1
-
-        txn.put(b'num_examples', str(i).encode())
-        txn.put(b'serialization_format', serialization_format.encode())
-        txn.put(b'id_to_idx', serialize(id_to_idx, serialization_format))
-
-        
-def extract_coordinates_as_numpy_arrays(dataset, indices=None):
+        chunk, chunk_bytes = [], 0
+        for dataset, indices in sources:
+            indices = [int(index) for index in indices]
+            ids = dataset.ids()
+            metadata.append(None if dataset.metadata is None
+                            else dataset.metadata.iloc[indices])
+            txn = dataset._get_txn()
+            for start in tqdm.trange(0, len(indices), commit_items):
+                block = indices[start:start + commit_items]
+                keys = [str(dataset._stored_index(index)).encode()
+                        for index in block]
+                # Read each block in key order.
+                with txn.cursor() as cursor:
+                    records = dict(cursor.getmulti(sorted(set(keys))))
+                for index, key in zip(block, keys):
+                    if ids[index] in id_to_idx:
+                        raise RuntimeError(f'{ids[index]} is exported twice')
+                    id_to_idx[ids[index]] = i
+                    chunk.append((str(i).encode(), records[key]))
+                    chunk_bytes += len(records[key])
+                    i += 1
+                    if len(chunk) >= commit_items or \
+                            chunk_bytes >= commit_bytes:
+                        # Leftovers of an interrupted export are overwritten.
+                        _commit_lmdb_chunk(env, chunk, {}, overwrite=True)
+                        chunk, chunk_bytes = [], 0
+
+        if any(x is None for x in metadata):
+            metadata = None
+        else:
+            metadata = pd.concat(metadata, ignore_index=True)
+        _commit_lmdb_chunk(env, chunk, _lmdb_header(
+            i, *encoding, id_to_idx, metadata), overwrite=True)
+
+
+def _shard_path(output_dir, prefix, shard, num_shards):
+    width = max(3, len(str(num_shards - 1)))
+    return Path(output_dir) / f'{prefix}_{shard:0{width}d}.lmdb'
+
+
+def make_sharded_lmdb_dataset(dataset, output_dir, num_shards,
+                              prefix='data', shards=None, **kwargs):
+    """
+    Make a sharded LMDB dataset from an input dataset, i.e. `num_shards` LMDB
+    files `<output_dir>/<prefix>_<shard>.lmdb` of consecutive entries, with
+    the same number of input entries each. Load them with
+    :class:`ShardedLMDBDataset`.
+
+    :param dataset: Input dataset, needs to be map-style.
+    :type dataset: torch.utils.data.Dataset
+    :param output_dir: Directory to write the shards to.
+    :type output_dir: Union[str, Path]
+    :param num_shards: Number of shards.
+    :type num_shards: int
+    :param prefix: Prefix of the file names of the shards.
+    :type prefix: str
+    :param shards: Numbers of the shards to write, e.g. to build shards on several machines, defaults to all.
+    :type shards: list[int]
+    :param kwargs: Other arguments of :func:`make_lmdb_dataset`, applied to each shard.
+
+    :return: Paths to the written shards.
+    :rtype: list[Path]
+    """
+    if isinstance(dataset, IterableDataset):
+        raise RuntimeError('Need map-style dataset to make shards')
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    ranges = np.array_split(np.arange(len(dataset)), num_shards)
+    if shards is None:
+        shards = range(num_shards)
+
+    output_lmdbs = []
+    for shard in shards:
+        output_lmdb = _shard_path(output_dir, prefix, shard, num_shards)
+        logger.info(f'Making shard {output_lmdb} of {len(ranges[shard])} '
+                    'examples')
+        make_lmdb_dataset(Subset(dataset, ranges[shard].tolist()),
+                          output_lmdb, **kwargs)
+        output_lmdbs.append(output_lmdb)
+    return output_lmdbs
+
+
+# Dataset of _apply_at, set up in each worker of the pool used by
+# extract_coordinates_as_numpy_arrays.
+_coordinates_worker_dataset = None
+
+
+def _init_coordinates_worker(dataset):
+    global _coordinates_worker_dataset
+    _coordinates_worker_dataset = dataset
+
+
+def _atomic_numbers(elements):
+    """Map element symbols to atomic numbers, looking up each distinct symbol once."""
+    symbols, inverse = np.unique(np.asarray(elements), return_inverse=True)
+    numbers = np.array([fo.atomic_number[x] for x in symbols],
+                       dtype=np.int64)
+    return numbers[inverse.reshape(-1)]
+
+
+def _item_coordinates(x, dtype):
+    atoms = x['atoms']
+    return (_atomic_numbers(atoms['element']),
+            atoms[['x', 'y', 'z']].to_numpy(dtype=dtype))
+
+
+def _item_num_atoms(x):
+    return len(x['atoms'])
+
+
+def _apply_at(index, func):
+    return func(_coordinates_worker_dataset[index])
+
+
+def _map_items(dataset, indices, func, num_workers):
+    """Apply `func` to the items of `dataset` at `indices`, in `num_workers` processes if > 0, and yield the results in order as they come."""
+    if num_workers > 0:
+        chunksize = max(1, min(64, len(indices) // (16 * num_workers)))
+        with mp.Pool(num_workers, initializer=_init_coordinates_worker,
+                     initargs=(dataset,)) as pool:
+            yield from _bounded_imap(
+                pool, functools.partial(_apply_at, func=func), indices,
+                chunksize, max(1000, 4 * chunksize * num_workers))
+    else:
+        for index in indices:
+            yield func(dataset[index])
+
+
+def _coordinates_array(output_dir, name, shape, dtype):
+    """Allocate a zeroed array, in RAM or as .npy file in `output_dir` mapped to memory."""
+    if output_dir is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(str(Path(output_dir) / f'{name}.npy'),
+                                     mode='w+', dtype=dtype,
+                                     shape=tuple(int(x) for x in shape))
+
+
+def _fill_coordinates(dataset, indices, num_atoms, num_workers, layout,
+                      dtype, output_dir):
+    """
+    Allocate charges and positions for items with `num_atoms` atoms and write the atoms of each item into them as it is read. Returns None if an item does not have the expected number of atoms.
+    """
+    num_items = len(indices)
+    offsets = np.zeros(num_items + 1, dtype=np.int64)
+    np.cumsum(num_atoms, out=offsets[1:])
+    if layout == 'padded':
+        # All charges and position arrays have the same size
+        arr_size = int(np.max(num_atoms)) if num_items else 0
+        charges = _coordinates_array(output_dir, 'charges',
+                                     (num_items, arr_size), dtype)
+        positions = _coordinates_array(output_dir, 'positions',
+                                       (num_items, arr_size, 3), dtype)
+    else:
+        total = int(offsets[-1])
+        charges = _coordinates_array(output_dir, 'charges', (total,), dtype)
+        positions = _coordinates_array(output_dir, 'positions', (total, 3),
+                                       dtype)
+
+    results = _map_items(dataset, indices,
+                         functools.partial(_item_coordinates, dtype=dtype),
+                         num_workers)
+    for j, (z, pos) in enumerate(tqdm.tqdm(results, total=num_items)):
+        if len(z) != num_atoms[j]:
+            results.close()
+            return None
+        if layout == 'padded':
+            charges[j, :len(z)] = z
+            positions[j, :len(z)] = pos
+        else:
+            charges[offsets[j]:offsets[j + 1]] = z
+            positions[offsets[j]:offsets[j + 1]] = pos
+    return charges, positions, offsets
+
+
+def extract_coordinates_as_numpy_arrays(dataset, indices=None, num_workers=0,
+                                        layout='padded', dtype=np.float64,
+                                        output_dir=None):
     """Convert the molecules from a dataset to a dictionary of numpy arrays.
        Labels are not processed; they are handled differently for every dataset.
-       
+
+       In the 'padded' layout, charges and positions of item j are in row j, padded with zeros up to the largest number of atoms. In the 'csr' layout, the atoms of all items are concatenated, those of item j are in rows offsets[j] to offsets[j+1].
+
+       The arrays are sized before reading coordinates, from the number of atoms in the metadata index of the dataset if it has one (see :attr:`LMDBDataset.metadata`), otherwise by counting the atoms of each item first. The coordinates of each item are then written into them as it is read.
+
     :param dataset: LMDB dataset from which to extract coordinates.
     :type dataset: torch.utils.data.Dataset
     :param indices: Indices of the items for which to extract coordinates.
     :type indices: numpy.array
-
-    :return: Dictionary of numpy arrays with number of atoms, charges, and positions
-    :rtype: dict       
+    :param num_workers: Number of processes reading items, 0 to read them in the calling process.
+    :type num_workers: int
+    :param layout: Layout of charges and positions, 'padded' or 'csr'.
+    :type layout: str
+    :param dtype: Data type of charges and positions.
+    :type dtype: numpy.dtype
+    :param output_dir: Directory to write the arrays to as .npy files, which are returned mapped to memory, defaults to None (arrays in RAM).
+    :type output_dir: Union[str, Path], optional
+
+    :return: Dictionary of numpy arrays with index, number of atoms, charges, and positions (and offsets in the 'csr' layout)
+    :rtype: dict
     """
+    if layout not in ('padded', 'csr'):
+        raise RuntimeError(f'Unrecognized layout {layout}')
     # Size of the dataset
     if indices is None:
         indices = np.arange(len(dataset))
     else:
         assert len(dataset) > max(indices)
-    num_items = len(indices)
+    index_list = [int(i) for i in indices]
+
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    filled = None
+    metadata = getattr(dataset, 'metadata', None)
+    if metadata is not None and 'num_atoms' in metadata:
+        num_atoms = metadata['num_atoms'].to_numpy(dtype=int)[index_list]
+        # The index counts the atoms of all dataframes of an item, which are
+        # more than those of 'atoms' if it has others.
+        filled = _fill_coordinates(dataset, index_list, num_atoms,
+                                   num_workers, layout, dtype, output_dir)
+        if filled is None:
+            logger.info('Number of atoms in metadata index does not match, '
+                        'counting atoms')
+    if filled is None:
+        num_atoms = np.fromiter(
+            _map_items(dataset, index_list, _item_num_atoms, num_workers),
+            dtype=int, count=len(index_list))
+        filled = _fill_coordinates(dataset, index_list, num_atoms,
+                                   num_workers, layout, dtype, output_dir)
+    charges, positions, offsets = filled
 
-    # Calculate number of atoms for each molecule
-    num_atoms = np.array([len(dataset[idx]['atoms']) for idx in indices],dtype=int)
-
-    # All charges and position arrays have the same size
-    arr_size  = np.max(num_atoms)
-    charges   = np.zeros([num_items,arr_size])
-    positions = np.zeros([num_items,arr_size,3])
-    # For each molecule and each atom...
-    for j,idx in enumerate(indices):
-        item = dataset[idx]
-        for ia in range(num_atoms[j]):
-            charges[j,ia] = fo.atomic_number[item['atoms']['element'][ia]]
-            positions[j,ia,0] = item['atoms']['x'][ia] 
-            positions[j,ia,1] = item['atoms']['y'][ia]
-            positions[j,ia,2] = item['atoms']['z'][ia]
-            
     # Create a dictionary with all the arrays
-    numpy_dict = {'index':indices, 'num_atoms':num_atoms,
-                  'charges':charges, 'positions':positions}
-    
+    numpy_dict = {'index': np.asarray(indices), 'num_atoms': num_atoms,
+                  'charges': charges, 'positions': positions}
+    if layout == 'csr':
+        numpy_dict['offsets'] = offsets
+    if output_dir is not None:
+        for name in ['index', 'num_atoms', 'offsets']:
+            if name in numpy_dict:
+                np.save(Path(output_dir) / f'{name}.npy', numpy_dict[name])
+        for array in (charges, positions):
+            array.flush()
+
     return numpy_dict
 
 
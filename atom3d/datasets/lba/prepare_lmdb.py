@@ -11,7 +11,6 @@ from torch.utils.data import Dataset
 
 import atom3d.datasets.datasets as da
 import atom3d.protein.sequence as seq
-import atom3d.splits.splits as spl
 import atom3d.util.file as fi
 import atom3d.util.formats as fo
 
@@ -47,7 +46,7 @@ class SequenceReader(object):
         self._protein_dir = protein_dir
 
     def _lookup(self, file_path):
-        return seq.get_chain_sequences(fo.bp_to_df(fo.read_any(file_path)))
+        return seq.get_chain_sequences(fo.read_any_to_df(file_path))
 
     def __call__(self, x, error_if_missing=False):
         x['seq'] = self._lookup(x['file_path'])
@@ -181,10 +180,10 @@ def prepare(input_file_path, output_root, split, train_txt, val_txt, test_txt,
     indices_val = _write_split_indices(val_txt, lmdb_ds, os.path.join(output_root, 'val_indices.txt'))
     indices_test = _write_split_indices(test_txt, lmdb_ds, os.path.join(output_root, 'test_indices.txt'))
 
-    train_dataset, val_dataset, test_dataset = spl.split(lmdb_ds, indices_train, indices_val, indices_test)
-    da.make_lmdb_dataset(train_dataset, os.path.join(output_root, 'train'))
-    da.make_lmdb_dataset(val_dataset, os.path.join(output_root, 'val'))
-    da.make_lmdb_dataset(test_dataset, os.path.join(output_root, 'test'))
+    # Copy the records of each split without decoding them.
+    da.export_lmdb_subset(lmdb_ds, os.path.join(output_root, 'train'), indices_train)
+    da.export_lmdb_subset(lmdb_ds, os.path.join(output_root, 'val'), indices_val)
+    da.export_lmdb_subset(lmdb_ds, os.path.join(output_root, 'test'), indices_test)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,548 @@
+"""Other operations for LMDB datasets."""
+import logging
+from pathlib import Path
+import multiprocessing as mp
+import sys
+import zlib
+
+import click
+import lmdb
+import numpy as np
+import pandas as pd
+import tqdm
+from torch.utils.data import ConcatDataset, Dataset
+
+import atom3d.datasets.datasets as da
+import atom3d.util.file as fi
+import atom3d.util.formats as fo
+
+logger = logging.getLogger(__name__)
+
+
+class _StoredItems(Dataset):
+    """Items of an LMDB dataset as they are stored, without transform or added fields."""
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self._dataset)
+
+    def __getitem__(self, index: int):
+        index = self._dataset._stored_index(index)
+        txn = self._dataset._get_txn()
+        return self._dataset._deserialize(txn.get(str(index).encode()))
+
+
+def convert_lmdb_dataset(input_lmdb, output_lmdb,
+                         serialization_format='columnar', compression='gzip',
+                         zstd_dict_size=0, layout='item'):
+    """
+    Rewrite an LMDB dataset with a different serialization format, compression and/or layout. Items are written unchanged and in the same order.
+
+    :param input_lmdb: Path to input LMDB.
+    :type input_lmdb: Union[str, Path]
+    :param output_lmdb: Path to output LMDB.
+    :type output_lmdb: Union[str, Path]
+    :param serialization_format: How to serialize an entry in the output.
+    :type serialization_format: 'json', 'msgpack', 'pkl', 'columnar'
+    :param compression: How to compress an entry in the output.
+    :type compression: 'gzip', 'zstd', 'lz4', 'none'
+    :param zstd_dict_size: Size in bytes of a zstd dictionary to train on the first entries, 0 for no dictionary.
+    :type zstd_dict_size: int
+    :param layout: How to store an entry in the output, see :func:`make_lmdb_dataset <atom3d.datasets.datasets.make_lmdb_dataset>`.
+    :type layout: 'item', 'fields'
+    """
+    dataset = da.LMDBDataset(input_lmdb)
+    logger.info(f'Converting {input_lmdb} from '
+                f'{dataset._serialization_format}/{dataset._compression}/'
+                f'{dataset._layout} to '
+                f'{serialization_format}/{compression}/{layout}')
+    da.make_lmdb_dataset(_StoredItems(dataset), output_lmdb,
+                         serialization_format=serialization_format,
+                         compression=compression,
+                         zstd_dict_size=zstd_dict_size, layout=layout)
+
+
+def split_lmdb_dataset(input_lmdb, output_dir, num_shards, prefix=None,
+                       serialization_format=None, compression=None):
+    """
+    Split an LMDB dataset into `num_shards` LMDB files with the same number of items each, see :func:`make_sharded_lmdb_dataset <atom3d.datasets.datasets.make_sharded_lmdb_dataset>`. Items are written unchanged and in the same order, records are copied as they are unless the output is encoded differently.
+
+    :param input_lmdb: Path to input LMDB.
+    :type input_lmdb: Union[str, Path]
+    :param output_dir: Directory to write the shards to.
+    :type output_dir: Union[str, Path]
+    :param num_shards: Number of shards.
+    :type num_shards: int
+    :param prefix: Prefix of the file names of the shards, defaults to the name of the input LMDB.
+    :type prefix: str
+    :param serialization_format: How to serialize an entry in the output, defaults to that of the input.
+    :type serialization_format: 'json', 'msgpack', 'pkl', 'columnar'
+    :param compression: How to compress an entry in the output, defaults to that of the input.
+    :type compression: 'gzip', 'zstd', 'lz4', 'none'
+
+    :return: Paths to the written shards.
+    :rtype: list[Path]
+    """
+    dataset = da.LMDBDataset(input_lmdb)
+    if prefix is None:
+        prefix = Path(input_lmdb).stem
+    logger.info(f'Splitting {input_lmdb} into {num_shards} shards')
+    if serialization_format in (None, dataset._serialization_format) and \
+            compression in (None, dataset._compression):
+        # Copy records as they are.
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        output_lmdbs = []
+        for shard, indices in enumerate(
+                np.array_split(np.arange(len(dataset)), num_shards)):
+            output_lmdb = da._shard_path(output_dir, prefix, shard,
+                                         num_shards)
+            da.export_lmdb_subset(dataset, output_lmdb, indices)
+            output_lmdbs.append(output_lmdb)
+        return output_lmdbs
+    return da.make_sharded_lmdb_dataset(
+        _StoredItems(dataset), output_dir, num_shards, prefix=prefix,
+        serialization_format=(serialization_format or
+                              dataset._serialization_format),
+        compression=compression or dataset._compression,
+        layout=dataset._layout)
+
+
+def merge_lmdb_datasets(input_lmdbs, output_lmdb, serialization_format=None,
+                        compression=None):
+    """
+    Merge LMDB datasets, e.g. the shards of a sharded LMDB dataset, into one LMDB dataset. Items are written unchanged and in order of the inputs, records are copied as they are if all inputs and the output are encoded the same way.
+
+    :param input_lmdbs: Paths to input LMDBs.
+    :type input_lmdbs: list[Union[str, Path]]
+    :param output_lmdb: Path to output LMDB.
+    :type output_lmdb: Union[str, Path]
+    :param serialization_format: How to serialize an entry in the output, defaults to that of the first input.
+    :type serialization_format: 'json', 'msgpack', 'pkl', 'columnar'
+    :param compression: How to compress an entry in the output, defaults to that of the first input.
+    :type compression: 'gzip', 'zstd', 'lz4', 'none'
+    """
+    datasets = [da.LMDBDataset(x) for x in input_lmdbs]
+    if len(datasets) == 0:
+        raise RuntimeError('Need at least one LMDB to merge')
+    logger.info(f'Merging {len(datasets)} LMDBs into {output_lmdb}')
+    encodings = set((x._serialization_format, x._compression,
+                     x._compression_dict, x._layout) for x in datasets)
+    if len(encodings) == 1 and \
+            serialization_format in (None, datasets[0]._serialization_format) \
+            and compression in (None, datasets[0]._compression):
+        # Copy records as they are.
+        da._copy_lmdb_records([(x, range(len(x))) for x in datasets],
+                              output_lmdb)
+        return
+    da.make_lmdb_dataset(
+        ConcatDataset([_StoredItems(x) for x in datasets]), output_lmdb,
+        serialization_format=(serialization_format or
+                              datasets[0]._serialization_format),
+        compression=compression or datasets[0]._compression,
+        layout=datasets[0]._layout)
+
+
+def _read_header(env):
+    """Get the description of the LMDB dataset in `env`, as passed to :func:`_lmdb_header <atom3d.datasets.datasets._lmdb_header>`."""
+    with env.begin() as txn:
+        if txn.get(b'num_examples') is None:
+            raise RuntimeError(f'LMDB {env.path()} is not a complete dataset')
+        serialization_format = txn.get(b'serialization_format').decode()
+        compression = txn.get(b'compression', b'gzip').decode()
+        compression_dict = txn.get(b'compression_dict')
+        layout = txn.get(b'layout', b'item').decode()
+        metadata = txn.get(b'metadata')
+        if metadata is not None:
+            metadata = da._deserialize_table(da.decompress(
+                metadata, compression, compression_dict))
+        tombstones = txn.get(b'tombstones')
+        tombstones = [] if tombstones is None else \
+            da._deserialize_indices(tombstones).tolist()
+        return {
+            'num_examples': int(txn.get(b'num_examples')),
+            'serialization_format': serialization_format,
+            'compression': compression,
+            'compression_dict': compression_dict,
+            'layout': layout,
+            'id_to_idx': da.deserialize(txn.get(b'id_to_idx'),
+                                        serialization_format),
+            'metadata': metadata,
+            'tombstones': tombstones,
+        }
+
+
+def append_to_lmdb_dataset(dataset, lmdb_path, filter_fn=None,
+                           metadata_fn=None, commit_items=1000,
+                           commit_bytes=int(1e9)):
+    """
+    Append the items of a dataset to an existing LMDB dataset, with the serialization format and compression of the LMDB. New items get the next free indices, ids need to be new.
+
+    Items are written in chunks, but only become part of the dataset once all of them are written, when the number of items and the indices are updated in one transaction. Datasets opened before need to be opened again to see the new items.
+
+    The id index and the metadata index are read and rewritten whole, so an append costs time in the size of the whole dataset, not only of the new items. Append in few large batches rather than many small ones.
+
+    :param dataset: Dataset with items to append.
+    :type dataset: torch.utils.data.Dataset
+    :param lmdb_path: Path to LMDB to append to.
+    :type lmdb_path: Union[str, Path]
+    :param filter_fn: Filter to decided if removing files.
+    :type filter_fn: lambda x -> True/False
+    :param metadata_fn: Function returning additional metadata of an entry as dictionary of scalars, see :func:`make_lmdb_dataset <atom3d.datasets.datasets.make_lmdb_dataset>`.
+    :type metadata_fn: lambda x -> dict
+    :param commit_items: Commit after this many items.
+    :type commit_items: int
+    :param commit_bytes: Commit after this many bytes of items.
+    :type commit_bytes: int
+
+    :return: Number of appended items.
+    :rtype: int
+    """
+    da._close_lmdb_env(lmdb_path)
+    with lmdb.open(str(lmdb_path)) as env:
+        header = _read_header(env)
+        id_to_idx = header['id_to_idx']
+        checksums = header['metadata'] is not None and \
+            da._CHECKSUM_COLUMN in header['metadata']
+        start = i = header['num_examples']
+        chunk, chunk_bytes, rows = [], 0, []
+        for x in tqdm.tqdm(dataset, total=len(dataset)):
+            entry = da._prepare_lmdb_entry(
+                x, filter_fn, header['serialization_format'], metadata_fn,
+                header['layout'], header['compression'],
+                header['compression_dict'])
+            if entry is None:
+                continue
+            id, compressed, row = entry
+            if checksums:
+                row[da._CHECKSUM_COLUMN] = zlib.crc32(compressed)
+            if id in id_to_idx:
+                raise RuntimeError(f'{id} is already in {lmdb_path}')
+            id_to_idx[id] = i
+            # Keys after the last item are leftovers of interrupted appends,
+            # if any, so they are overwritten.
+            chunk.append((str(i).encode(), compressed))
+            chunk_bytes += len(compressed)
+            rows.append(row)
+            i += 1
+            if len(chunk) >= commit_items or chunk_bytes >= commit_bytes:
+                da._commit_lmdb_chunk(env, chunk, {}, overwrite=True)
+                chunk, chunk_bytes = [], 0
+
+        metadata = header['metadata']
+        if metadata is not None:
+            metadata = pd.concat([metadata, pd.DataFrame(rows)],
+                                 ignore_index=True)
+        elif start > 0:
+            logger.warning(f'{lmdb_path} has no metadata index to extend')
+        da._commit_lmdb_chunk(env, chunk, da._lmdb_header(
+            i, header['serialization_format'], header['compression'],
+            header['compression_dict'], header['layout'], id_to_idx,
+            metadata, header['tombstones']), overwrite=True)
+    logger.info(f'Appended {i - start} items to {lmdb_path}')
+    return i - start
+
+
+def delete_from_lmdb_dataset(lmdb_path, ids):
+    """
+    Delete items from an LMDB dataset by id, in one transaction. Their indices are marked as deleted (tombstones) and not reused, the indices of other items do not change until the LMDB is compacted with :func:`compact_lmdb_dataset`. Datasets opened before need to be opened again to not see the deleted items.
+
+    :param lmdb_path: Path to LMDB to delete from.
+    :type lmdb_path: Union[str, Path]
+    :param ids: Ids of the items to delete.
+    :type ids: list[str]
+    """
+    da._close_lmdb_env(lmdb_path)
+    with lmdb.open(str(lmdb_path)) as env:
+        header = _read_header(env)
+        id_to_idx = header['id_to_idx']
+        for id in ids:
+            if id not in id_to_idx:
+                raise IndexError(id)
+        indices = [id_to_idx.pop(id) for id in set(ids)]
+        da._commit_lmdb_chunk(env, [], da._lmdb_header(
+            header['num_examples'], header['serialization_format'],
+            header['compression'], header['compression_dict'],
+            header['layout'], id_to_idx, header['metadata'],
+            header['tombstones'] + indices),
+            delete=[str(index).encode() for index in indices])
+    logger.info(f'Deleted {len(indices)} items from {lmdb_path}')
+
+
+def compact_lmdb_dataset(input_lmdb, output_lmdb):
+    """
+    Rewrite an LMDB dataset without its deleted items, which numbers the remaining items consecutively. Records are copied as they are.
+
+    :param input_lmdb: Path to input LMDB.
+    :type input_lmdb: Union[str, Path]
+    :param output_lmdb: Path to output LMDB.
+    :type output_lmdb: Union[str, Path]
+    """
+    da.export_lmdb_subset(input_lmdb, output_lmdb)
+
+
+# Dataset of _verify_records, set up in each worker of the pool used by
+# verify_lmdb_dataset.
+_verify_worker_dataset = None
+
+
+def _init_verify_worker(lmdb_path):
+    global _verify_worker_dataset
+    _verify_worker_dataset = da.LMDBDataset(lmdb_path)
+
+
+def _verify_records(task):
+    """Check the records stored as `indices`, against the CRC-32s `crcs` if given. Get the id of each record, or the error reading it."""
+    indices, crcs = task
+    dataset = _verify_worker_dataset
+    txn = dataset._get_txn()
+    results = []
+    for j, index in enumerate(indices):
+        try:
+            compressed = txn.get(str(index).encode())
+            if compressed is None:
+                raise RuntimeError('record is missing')
+            if crcs is not None and zlib.crc32(compressed) != crcs[j]:
+                raise RuntimeError('checksum mismatch')
+            item = dataset._deserialize(compressed)
+            results.append((index, item.get('id', str(index)), None))
+        except Exception as e:
+            results.append((index, None, f'{type(e).__name__}: {e}'))
+    return results
+
+
+def verify_lmdb_dataset(lmdb_path, num_workers=0, chunk_size=1000):
+    """
+    Check every record of an LMDB dataset: that it is there, that it can be decompressed and deserialized and, if the LMDB was made with checksums, that its CRC-32 matches. Also checks that the number of items, the id index and the metadata index agree with the records.
+
+    :param lmdb_path: Path to LMDB to verify.
+    :type lmdb_path: Union[str, Path]
+    :param num_workers: Number of processes checking records, 0 to check them in the calling process.
+    :type num_workers: int
+    :param chunk_size: Number of records per task of a worker.
+    :type chunk_size: int
+
+    :return: Report with the indices of `bad` records (index to error), the `ids` read from good records (id to index), and a list of `errors` of the indices. The LMDB is fine if `ok` is True.
+    :rtype: dict
+    """
+    env = da._open_lmdb_env(Path(lmdb_path).absolute())
+    with env.begin() as txn:
+        if txn.get(b'num_examples') is None and \
+                txn.get(b'progress') is not None:
+            raise RuntimeError(
+                f'{lmdb_path} is an unfinished build, resume it by running '
+                'make_lmdb_dataset again with resume=True')
+    header = _read_header(env)
+    with env.begin() as txn:
+        # Item keys are the stored indices, other keys are not numbers.
+        stored = sorted(int(key) for key in txn.cursor().iternext(
+            values=False) if key.isdigit())
+    num_examples = header['num_examples']
+    tombstones = set(header['tombstones'])
+    indices = [i for i in range(num_examples) if i not in tombstones]
+    errors = []
+    extra = [i for i in stored if i >= num_examples]
+    if extra:
+        errors.append(f'{len(extra)} records after the last item, e.g. of '
+                      'an interrupted append')
+
+    metadata = header['metadata']
+    crcs = None
+    if metadata is None:
+        logger.info(f'{lmdb_path} has no metadata index, not checking '
+                    'checksums')
+    elif len(metadata) != num_examples:
+        errors.append(f'metadata index has {len(metadata)} rows for '
+                      f'{num_examples} items')
+    elif da._CHECKSUM_COLUMN in metadata:
+        crcs = metadata[da._CHECKSUM_COLUMN].to_numpy()
+
+    logger.info(f'Verifying {len(indices)} records of {lmdb_path}')
+    chunks = [indices[i:i + chunk_size]
+              for i in range(0, len(indices), chunk_size)]
+    tasks = [(chunk, None if crcs is None else crcs[chunk].tolist())
+             for chunk in chunks]
+    if num_workers > 0:
+        pool = mp.Pool(num_workers, initializer=_init_verify_worker,
+                       initargs=(str(lmdb_path),))
+        with pool:
+            results = list(tqdm.tqdm(pool.imap(_verify_records, tasks),
+                                     total=len(tasks)))
+    else:
+        _init_verify_worker(str(lmdb_path))
+        results = [_verify_records(task) for task in tqdm.tqdm(tasks)]
+
+    bad, ids = {}, {}
+    for index, id, error in (x for chunk in results for x in chunk):
+        if error is not None:
+            bad[index] = error
+        elif id in ids:
+            bad[index] = f'duplicate of id {id} at {ids[id]}'
+        else:
+            ids[id] = index
+    if header['id_to_idx'] != ids:
+        wrong = set(header['id_to_idx'].items()) ^ set(ids.items())
+        errors.append(f'id index differs from the records in {len(wrong)} '
+                      'entries')
+    if bad:
+        errors.append(f'{len(bad)} bad records')
+    for error in errors:
+        logger.warning(f'{lmdb_path}: {error}')
+    return {'ok': not errors, 'num_examples': num_examples, 'bad': bad,
+            'ids': ids, 'errors': errors}
+
+
+def repair_lmdb_dataset(lmdb_path, report=None, num_workers=0):
+    """
+    Repair an LMDB dataset in place, after :func:`verify_lmdb_dataset`: bad records are deleted (their indices marked as deleted, see :func:`delete_from_lmdb_dataset`), records after the last item are removed, and the id index is rebuilt from the good records. A metadata index that does not match the items is dropped. Use :func:`compact_lmdb_dataset` afterwards to renumber the remaining items.
+
+    :param lmdb_path: Path to LMDB to repair.
+    :type lmdb_path: Union[str, Path]
+    :param report: Report of :func:`verify_lmdb_dataset`, defaults to verifying the LMDB first.
+    :type report: dict
+    :param num_workers: Number of processes verifying records, if there is no `report`.
+    :type num_workers: int
+
+    :return: Indices of the deleted records.
+    :rtype: list[int]
+    """
+    if report is None:
+        report = verify_lmdb_dataset(lmdb_path, num_workers)
+    da._close_lmdb_env(lmdb_path)
+    with lmdb.open(str(lmdb_path)) as env:
+        header = _read_header(env)
+        num_examples = header['num_examples']
+        with env.begin() as txn:
+            extra = [key for key in txn.cursor().iternext(values=False)
+                     if key.isdigit() and int(key) >= num_examples]
+        metadata = header['metadata']
+        if metadata is not None and len(metadata) != num_examples:
+            logger.warning(f'Dropping metadata index of {lmdb_path}')
+            metadata = None
+        bad = sorted(report['bad'])
+        da._commit_lmdb_chunk(env, [], da._lmdb_header(
+            num_examples, header['serialization_format'],
+            header['compression'], header['compression_dict'],
+            header['layout'], report['ids'], metadata,
+            header['tombstones'] + bad),
+            delete=[str(index).encode() for index in bad] + extra)
+    logger.info(f'Deleted {len(bad)} bad records of {lmdb_path}')
+    return bad
+
+
+@click.group(help='Operations on LMDB datasets.')
+def main():
+    logging.basicConfig(stream=sys.stdout,
+                        format='%(asctime)s %(levelname)s %(process)d: ' +
+                        '%(message)s',
+                        level=logging.INFO)
+
+
+@main.command(help='Convert LMDB dataset to another serialization format '
+              'or compression.')
+@click.argument('input_lmdb', type=click.Path(exists=True))
+@click.argument('output_lmdb', type=click.Path(exists=False))
+@click.option('-sf', '--serialization_format',
+              type=click.Choice(['msgpack', 'pkl', 'json', 'columnar']),
+              default='columnar')
+@click.option('-c', '--compression',
+              type=click.Choice(['gzip', 'zstd', 'lz4', 'none']),
+              default='gzip')
+@click.option('--zstd_dict_size', type=int, default=0,
+              help='train zstd dictionary of this many bytes (0: none).')
+@click.option('--layout', type=click.Choice(['item', 'fields']),
+              default='item',
+              help='store each item as one record, or each of its fields.')
+def convert(input_lmdb, output_lmdb, serialization_format, compression,
+            zstd_dict_size, layout):
+    convert_lmdb_dataset(input_lmdb, output_lmdb, serialization_format,
+                         compression, zstd_dict_size, layout)
+
+
+@main.command(help='Split LMDB dataset into shards of equal size.')
+@click.argument('input_lmdb', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path())
+@click.option('-n', '--num_shards', type=int, required=True)
+@click.option('--prefix', help='prefix of shard names (default: input name).')
+@click.option('-sf', '--serialization_format',
+              type=click.Choice(['msgpack', 'pkl', 'json', 'columnar']),
+              help='default: same as input.')
+@click.option('-c', '--compression',
+              type=click.Choice(['gzip', 'zstd', 'lz4', 'none']),
+              help='default: same as input.')
+def split(input_lmdb, output_dir, num_shards, prefix, serialization_format,
+          compression):
+    split_lmdb_dataset(input_lmdb, output_dir, num_shards, prefix,
+                       serialization_format, compression)
+
+
+@main.command(help='Merge LMDB datasets (e.g. shards) into one.')
+@click.argument('input_lmdbs', type=click.Path(exists=True), nargs=-1,
+                required=True)
+@click.argument('output_lmdb', type=click.Path(exists=False))
+@click.option('-sf', '--serialization_format',
+              type=click.Choice(['msgpack', 'pkl', 'json', 'columnar']),
+              help='default: same as first input.')
+@click.option('-c', '--compression',
+              type=click.Choice(['gzip', 'zstd', 'lz4', 'none']),
+              help='default: same as first input.')
+def merge(input_lmdbs, output_lmdb, serialization_format, compression):
+    merge_lmdb_datasets(list(input_lmdbs), output_lmdb, serialization_format,
+                        compression)
+
+
+@main.command(help='Append the structures in INPUT_DIR to LMDB dataset. '
+              'Rewrites the indices of the whole dataset.')
+@click.argument('lmdb_path', type=click.Path(exists=True))
+@click.argument('input_dir', type=click.Path(exists=True))
+@click.option('-f', '--filetype',
+              type=click.Choice(da.FILETYPES),
+              default='pdb')
+def append(lmdb_path, input_dir, filetype):
+    fileext = 'xyz' if filetype == 'xyz-gdb' else filetype
+    file_list = fi.find_files(input_dir, fo.patterns[fileext])
+    file_list.sort()
+    logger.info(f'Found {len(file_list)} files.')
+    append_to_lmdb_dataset(da.load_dataset(file_list, filetype), lmdb_path)
+
+
+@main.command(help='Delete items with the given IDS from LMDB dataset.')
+@click.argument('lmdb_path', type=click.Path(exists=True))
+@click.argument('ids', nargs=-1)
+@click.option('--ids_file', type=click.File(),
+              help='file with one id per line to delete.')
+def delete(lmdb_path, ids, ids_file):
+    ids = list(ids)
+    if ids_file is not None:
+        ids.extend(line.strip() for line in ids_file if line.strip())
+    delete_from_lmdb_dataset(lmdb_path, ids)
+
+
+@main.command(help='Rewrite LMDB dataset without deleted items.')
+@click.argument('input_lmdb', type=click.Path(exists=True))
+@click.argument('output_lmdb', type=click.Path(exists=False))
+def compact(input_lmdb, output_lmdb):
+    compact_lmdb_dataset(input_lmdb, output_lmdb)
+
+
+@main.command(help='Check all records and indices of LMDB dataset.')
+@click.argument('lmdb_path', type=click.Path(exists=True))
+@click.option('--num_workers', type=int, default=0,
+              help='number of processes checking records (0: serial).')
+@click.option('--repair', is_flag=True,
+              help='delete bad records and rebuild the id index.')
+def verify(lmdb_path, num_workers, repair):
+    report = verify_lmdb_dataset(lmdb_path, num_workers)
+    for index, error in sorted(report['bad'].items()):
+        print(f'{index}\t{error}')
+    if report['ok']:
+        logger.info(f'{lmdb_path} is fine')
+    elif repair:
+        repair_lmdb_dataset(lmdb_path, report)
+    else:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Batch samplers for datasets of structures of very different sizes."""
+import logging
+import os
+
+import numpy as np
+import torch
+import tqdm
+from torch.utils.data import Sampler
+
+logger = logging.getLogger(__name__)
+
+
+def _scan_atom_counts(dataset):
+    counts = np.zeros(len(dataset), dtype=np.int64)
+    for i in tqdm.trange(len(dataset)):
+        x = dataset[i]
+        counts[i] = sum(len(value) for key, value in x.items()
+                        if key.startswith('atoms'))
+    return counts
+
+
+def atom_counts(dataset, cache_file=None):
+    """
+    Get the number of atoms of each item of a dataset, counting all atoms
+    dataframes of an item. Counts are taken from the metadata index of LMDB
+    datasets (also when wrapped in a :class:`torch.utils.data.Subset`),
+    otherwise the dataset is scanned once.
+
+    :param dataset: dataset to get atom counts of
+    :type dataset: torch.utils.data.Dataset
+    :param cache_file: .npy file to load the counts from if it exists, or to save scanned counts to, defaults to None
+    :type cache_file: Union[str, Path], optional
+
+    :return: number of atoms of each item
+    :rtype: numpy.ndarray
+    """
+    if isinstance(dataset, torch.utils.data.Subset):
+        metadata = getattr(dataset.dataset, 'metadata', None)
+        if metadata is not None and 'num_atoms' in metadata:
+            return np.asarray(metadata['num_atoms'])[dataset.indices]
+    else:
+        metadata = getattr(dataset, 'metadata', None)
+        if metadata is not None and 'num_atoms' in metadata:
+            return np.asarray(metadata['num_atoms'])
+
+    if cache_file is not None and os.path.exists(cache_file):
+        counts = np.load(cache_file)
+        if len(counts) == len(dataset):
+            return counts
+        logger.warning(f'Ignoring {cache_file}, it has {len(counts)} counts '
+                       f'for {len(dataset)} items')
+
+    logger.info(f'Counting atoms of {len(dataset)} items')
+    counts = _scan_atom_counts(dataset)
+    if cache_file is not None:
+        np.save(cache_file, counts)
+    return counts
+
+
+class SizeBucketSampler(Sampler):
+    """
+    Batch sampler that only combines items of similar size. Items are sorted
+    by their number of atoms and split into buckets of equal count. Batches
+    are formed within each bucket, up to `batch_size` items and/or up to
+    `max_atoms` atoms or `max_edges` edges in total, where an item with n atoms
+    counts as n * (n - 1) edges, as for dense (padded) graphs. An item that
+    alone exceeds a cap forms its own batch.
+
+    Use as `batch_sampler` of a :class:`torch.utils.data.DataLoader`. Call
+    :meth:`set_epoch` at the start of every epoch to shuffle differently.
+
+    :param dataset: dataset to sample from
+    :type dataset: torch.utils.data.Dataset
+    :param batch_size: maximum number of items per batch, defaults to None
+    :type batch_size: int, optional
+    :param max_atoms: maximum total number of atoms per batch, defaults to None
+    :type max_atoms: int, optional
+    :param max_edges: maximum total number of edges per batch, defaults to None
+    :type max_edges: int, optional
+    :param num_buckets: number of size buckets, defaults to 10
+    :type num_buckets: int, optional
+    :param shuffle: shuffle items within buckets and the order of batches, defaults to True
+    :type shuffle: bool, optional
+    :param drop_last: drop the last batch of a bucket if it has less than `batch_size` items, defaults to False
+    :type drop_last: bool, optional
+    :param seed: random seed for shuffling, defaults to 0
+    :type seed: int, optional
+    :param sizes: number of atoms of each item, defaults to None (see :func:`atom_counts`)
+    :type sizes: numpy.ndarray, optional
+    :param cache_file: file to cache atom counts in, see :func:`atom_counts`, defaults to None
+    :type cache_file: Union[str, Path], optional
+    """
+
+    def __init__(self, dataset, batch_size=None, max_atoms=None,
+                 max_edges=None, num_buckets=10, shuffle=True,
+                 drop_last=False, seed=0, sizes=None, cache_file=None):
+        if batch_size is None and max_atoms is None and max_edges is None:
+            raise RuntimeError('Need batch_size, max_atoms or max_edges')
+        if sizes is None:
+            sizes = atom_counts(dataset, cache_file)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        if len(self.sizes) != len(dataset):
+            raise RuntimeError(f'Got {len(self.sizes)} sizes for '
+                               f'{len(dataset)} items')
+        self.batch_size = batch_size
+        self.max_atoms = max_atoms
+        self.max_edges = max_edges
+        self.num_buckets = num_buckets
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        order = np.arange(len(self.sizes))
+        if self.shuffle:
+            # Random order among items of equal size.
+            order = rng.permutation(order)
+        order = order[np.argsort(self.sizes[order], kind='stable')]
+
+        batches = []
+        for bucket in np.array_split(order, min(self.num_buckets,
+                                                max(1, len(order)))):
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            batches.extend(self._fill(bucket))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def _fill(self, bucket):
+        """Split the items of `bucket` into batches, in order."""
+        sizes = self.sizes[bucket]
+        batches = []
+        batch, atoms, edges = [], 0, 0
+        for index, n in zip(bucket.tolist(), sizes.tolist()):
+            if batch and (
+                    (self.batch_size is not None and
+                     len(batch) >= self.batch_size) or
+                    (self.max_atoms is not None and
+                     atoms + n > self.max_atoms) or
+                    (self.max_edges is not None and
+                     edges + n * (n - 1) > self.max_edges)):
+                batches.append(batch)
+                batch, atoms, edges = [], 0, 0
+            batch.append(index)
+            atoms += n
+            edges += n * (n - 1)
+        if batch and not (self.drop_last and self.batch_size is not None and
+                          len(batch) < self.batch_size):
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self) -> int:
+        return len(self._batches())
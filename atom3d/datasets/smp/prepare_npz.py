@@ -21,12 +21,15 @@ label_names = ['A','B','C','mu','alpha','homo','lumo','gap','r2',
                'zpve','u0','u298','h298','g298','cv',
                'u0_atom','u298_atom','h298_atom','g298_atom','cv_atom']
 
-def _write_npz(dataset, filename):
+def _write_npz(dataset, filename, num_workers=0):
     # Get the coordinates
-    save_dict = da.extract_coordinates_as_numpy_arrays(dataset)
-    # Add the label data 
+    save_dict = da.extract_coordinates_as_numpy_arrays(
+        dataset, num_workers=num_workers)
+    # Add the label data, reading the labels of each item once
+    labels = np.array([item['labels'] for item in
+                       da.LMDBDataset(dataset.data_file, fields=['labels'])])
     for il,label in enumerate(label_names):
-        save_dict[label] = np.array([item['labels'][il] for item in dataset])
+        save_dict[label] = labels[:, il]
     # Save the data
     np.savez_compressed(filename,**save_dict)
     
@@ -35,7 +38,9 @@ def _write_npz(dataset, filename):
 @click.argument('input_root', type=click.Path())
 @click.argument('output_file_path', type=click.Path())
 @click.option('--split', '-s', is_flag=True)
-def prepare(input_root, output_file_path, split):
+@click.option('--num_workers', type=int, default=0,
+              help='number of processes reading coordinates (0: serial).')
+def prepare(input_root, output_file_path, split, num_workers):
     # Logger
     logging.basicConfig(stream=sys.stdout,
                         format='%(asctime)s %(levelname)s %(process)d: ' +
@@ -45,17 +50,21 @@ def prepare(input_root, output_file_path, split):
         logger.info(f'Processing datasets from {input_root:}.')
         logger.info(f'Processing training dataset...')
         dataset = da.LMDBDataset(os.path.join(input_root, 'train'))
-        _write_npz(dataset, os.path.join(output_file_path,'train.npz'))
+        _write_npz(dataset, os.path.join(output_file_path,'train.npz'),
+                   num_workers)
         logger.info(f'Processing validation dataset...')
         dataset = da.LMDBDataset(os.path.join(input_root, 'val'))
-        _write_npz(dataset, os.path.join(output_file_path,'valid.npz'))
+        _write_npz(dataset, os.path.join(output_file_path,'valid.npz'),
+                   num_workers)
         logger.info(f'Processing test dataset from...')
         dataset = da.LMDBDataset(os.path.join(input_root, 'test'))
-        _write_npz(dataset, os.path.join(output_file_path,'test.npz'))
+        _write_npz(dataset, os.path.join(output_file_path,'test.npz'),
+                   num_workers)
     else:
         logger.info(f'Processing full dataset from {input_root:}...')
         dataset = da.LMDBDataset(os.path.join(input_root, 'all'))
-        _write_npz(dataset, os.path.join(output_file_path,'all.npz'))
+        _write_npz(dataset, os.path.join(output_file_path,'all.npz'),
+                   num_workers)
 
 
 if __name__ == "__main__":
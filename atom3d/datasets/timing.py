@@ -0,0 +1,168 @@
+"""
+Opt-in timing of the stages of getting dataset items, e.g. reading a record,
+decompressing and deserializing it, building dataframes and transforms.
+
+Timing is off by default, then each timed stage costs two function calls.
+Once enabled with :func:`enable`, every process records the number of calls,
+wall time and bytes of each stage. Processes started afterwards (e.g.
+DataLoader workers) record on their own and, if a dump directory was given,
+write their totals there when they exit, see :func:`load`.
+"""
+import json
+import multiprocessing.util
+import os
+from pathlib import Path
+import time
+
+import pandas as pd
+
+_ENABLED_VAR = 'ATOM3D_TIMING'
+_DUMP_DIR_VAR = 'ATOM3D_TIMING_DIR'
+
+# Set from the environment, so that spawned processes time too.
+enabled = os.environ.get(_ENABLED_VAR, '0') != '0'
+_dump_dir = os.environ.get(_DUMP_DIR_VAR)
+_hooks = []
+# Calls, seconds and bytes of each stage in process _pid.
+_stats = {}
+_pid = None
+
+
+def enable(dump_dir=None):
+    """
+    Start timing in this process and the processes it starts from now on.
+
+    :param dump_dir: directory each process writes its totals to when it exits, defaults to None
+    :type dump_dir: Union[str, Path], optional
+    """
+    global enabled, _dump_dir
+    enabled = True
+    os.environ[_ENABLED_VAR] = '1'
+    if dump_dir is not None:
+        Path(dump_dir).mkdir(parents=True, exist_ok=True)
+        _dump_dir = str(Path(dump_dir).absolute())
+        os.environ[_DUMP_DIR_VAR] = _dump_dir
+
+
+def disable():
+    """Stop timing in this process and the processes it starts from now on."""
+    global enabled, _dump_dir
+    enabled = False
+    _dump_dir = None
+    os.environ.pop(_ENABLED_VAR, None)
+    os.environ.pop(_DUMP_DIR_VAR, None)
+
+
+def add_hook(hook):
+    """
+    Call `hook` with stage name, seconds and bytes whenever a stage ends.
+
+    :param hook: function to call
+    :type hook: lambda stage, seconds, nbytes -> None
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def start():
+    """Get the start time of a stage, or None if timing is off."""
+    if not enabled:
+        return None
+    return time.perf_counter()
+
+
+def stop(started, stage, nbytes=0):
+    """
+    End the stage `stage` that started at `started` (see :func:`start`), which processed `nbytes` bytes.
+
+    :return: end time, to pass as start of the next stage, or None if timing is off
+    :rtype: float
+    """
+    if started is None:
+        return None
+    now = time.perf_counter()
+    record(stage, now - started, nbytes)
+    return now
+
+
+def record(stage, seconds, nbytes=0):
+    """Add a call of `stage` that took `seconds` and processed `nbytes` bytes."""
+    global _pid
+    pid = os.getpid()
+    if _pid != pid:
+        # First record of this process, forked processes start afresh.
+        _pid = pid
+        _stats.clear()
+        if _dump_dir is not None:
+            multiprocessing.util.Finalize(None, dump, args=(_dump_dir,),
+                                          exitpriority=0)
+    stats = _stats.setdefault(stage, [0, 0.0, 0])
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] += nbytes
+    for hook in _hooks:
+        hook(stage, seconds, nbytes)
+
+
+def reset():
+    """Forget the times recorded in this process."""
+    _stats.clear()
+
+
+def summary():
+    """
+    Get the totals of each stage recorded in this process.
+
+    :return: calls, seconds, bytes, mean milliseconds per call and MB per second of each stage
+    :rtype: pandas.DataFrame
+    """
+    return _summarize(pd.DataFrame(
+        [{'pid': os.getpid(), 'stage': stage, 'calls': calls,
+          'seconds': seconds, 'bytes': nbytes}
+         for stage, (calls, seconds, nbytes) in _stats.items()],
+        columns=['pid', 'stage', 'calls', 'seconds', 'bytes']))
+
+
+def _summarize(df):
+    df['mean_ms'] = 1000 * df['seconds'] / df['calls']
+    df['mb_per_sec'] = df['bytes'] / 1e6 / df['seconds']
+    return df
+
+
+def dump(dump_dir):
+    """Write the totals of this process to `dump_dir`, see :func:`load`."""
+    if not _stats:
+        return
+    path = Path(dump_dir) / f'timing_{os.getpid()}.json'
+    with open(path, 'w') as f:
+        json.dump({stage: stats for stage, stats in _stats.items()}, f)
+
+
+def load(dump_dir, per_process=True):
+    """
+    Get the totals that processes wrote to `dump_dir`.
+
+    :param dump_dir: directory passed to :func:`enable`
+    :type dump_dir: Union[str, Path]
+    :param per_process: one row per process and stage, or one per stage summed over processes, defaults to True
+    :type per_process: bool, optional
+
+    :return: totals, see :func:`summary`
+    :rtype: pandas.DataFrame
+    """
+    rows = []
+    for path in sorted(Path(dump_dir).glob('timing_*.json')):
+        pid = int(path.stem.split('_')[1])
+        with open(path) as f:
+            for stage, (calls, seconds, nbytes) in json.load(f).items():
+                rows.append({'pid': pid, 'stage': stage, 'calls': calls,
+                             'seconds': seconds, 'bytes': nbytes})
+    df = pd.DataFrame(rows, columns=['pid', 'stage', 'calls', 'seconds',
+                                     'bytes'])
+    if not per_process:
+        df = df.groupby('stage', as_index=False, sort=False)[
+            ['calls', 'seconds', 'bytes']].sum()
+    return _summarize(df)
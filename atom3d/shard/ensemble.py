@@ -35,14 +35,14 @@ ensemblers = {
 
 def parse_ensemble(name, ensemble):
     if ensemble is None:
-        df = dt.bp_to_df(dt.read_any(name))
+        df = dt.read_any_to_df(name)
     else:
         df = []
         for subunit, f in ensemble.items():
             if isinstance(f, pd.DataFrame):
                 curr = f
             else:
-                curr = dt.bp_to_df(dt.read_any(f))
+                curr = dt.read_any_to_df(f)
 
             curr['subunit'] = subunit
             df.append(curr)
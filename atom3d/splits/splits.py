@@ -2,6 +2,7 @@
 from functools import partial
 
 import numpy as np
+import pandas as pd
 import torch
 
 import atom3d.util.log as log
@@ -101,13 +102,29 @@ def split_randomly(dataset, train_split=None, val_split=0.1, test_split=0.1, ran
 # split by group
 ####################################
 
+def _get_values(dataset, value_fn):
+    """Get the value of each data element, see :func:`split_by_group`."""
+    if not isinstance(value_fn, str):
+        return [value_fn(x) for x in dataset]
+    metadata = getattr(dataset, 'metadata', None)
+    if metadata is None or value_fn not in metadata:
+        return [x[value_fn] for x in dataset]
+    column = pd.Series(metadata[value_fn])
+    values = column.tolist()
+    # Values missing from the index (not scalar, or not in every element) are
+    # taken from the elements themselves.
+    for i in np.flatnonzero(column.isna().to_numpy()):
+        values[i] = dataset[int(i)][value_fn]
+    return values
+
+
 def split_by_group(dataset, value_fn, train_values, val_values, test_values):
     """Splits data into train, validation, and test dataset using a value function that maps each data element to a value (or group identifier). These are then used to assign elements to the appropriate splits based on pre-defined lists of values to include in each split.
 
     :param dataset: Dataset to split.
     :type dataset: Dataset
-    :param value_fn: Arbitrary function mapping each data element to a value or group identifier.
-    :type value_fn: function
+    :param value_fn: Arbitrary function mapping each data element to a value or group identifier, or the name of the value. Named values are read from the metadata index of the dataset if it has one (see :attr:`atom3d.datasets.LMDBDataset.metadata`), without loading the data elements.
+    :type value_fn: Union[function, str]
     :param train_values: List of values to include in training set.
     :type train_values: List
     :param val_values: List of values to include in validation set.
@@ -118,7 +135,7 @@ def split_by_group(dataset, value_fn, train_values, val_values, test_values):
     :rtype: Tuple[Dataset]
     """    
 
-    values = [value_fn(x) for x in dataset]
+    values = _get_values(dataset, value_fn)
 
     # Determine the indices of each split
     indices_train = [i for i,x in enumerate(values) if x in train_values]
@@ -139,8 +156,8 @@ def split_by_group_size(dataset, value_fn, val_split=0.1, test_split=0.1):
 
     :param dataset: Dataset to split.
     :type dataset: Dataset
-    :param value_fn: Arbitrary function mapping each data element to a value or group identifier.
-    :type value_fn: function
+    :param value_fn: Arbitrary function mapping each data element to a value or group identifier, or the name of the value. Named values are read from the metadata index of the dataset if it has one (see :attr:`atom3d.datasets.LMDBDataset.metadata`), without loading the data elements.
+    :type value_fn: Union[function, str]
     :param val_split: Proportion of data used for validation, defaults to 0.1
     :type val_split: float, optional
     :param test_split: Proportion of data used for testing, defaults to 0.1
@@ -149,7 +166,7 @@ def split_by_group_size(dataset, value_fn, val_split=0.1, test_split=0.1):
     :rtype: Tuple[Dataset]
     """    
 
-    values = [value_fn(x) for x in dataset]
+    values = _get_values(dataset, value_fn)
 
     logger.info(f'Splitting dataset with {len(values):} entries.')
 
@@ -203,6 +220,6 @@ def split_by_group_size(dataset, value_fn, val_split=0.1, test_split=0.1):
 # frequently used specific splits
 ####################################
 
-split_by_year = partial(split_by_group, value_fn=lambda x: x['year'])
+split_by_year = partial(split_by_group, value_fn='year')
 
-split_by_scaffold = partial(split_by_group_size, value_fn=lambda x: x['scaffold'])
+split_by_scaffold = partial(split_by_group_size, value_fn='scaffold')
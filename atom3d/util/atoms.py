@@ -0,0 +1,169 @@
+"""Lightweight columnar container for atoms."""
+import numpy as np
+import pandas as pd
+
+
+class AtomArray(object):
+    """
+    Atoms in ATOM3D dataframe format, stored as one NumPy array per column.
+
+    Supports the parts of the pandas.DataFrame interface that data loading
+    and transforms rely on (column access, boolean masks, groupby), and only
+    builds an actual dataframe when :meth:`to_dataframe` is called.
+
+    :param columns: Arrays of equal length, by column name.
+    :type columns: dict[str, numpy.ndarray]
+    :param index: Row labels, defaults to None (0 to n-1)
+    :type index: Union[numpy.ndarray, pandas.Index], optional
+    """
+
+    def __init__(self, columns, index=None):
+        self._columns = {name: np.asarray(values)
+                         for name, values in columns.items()}
+        lengths = set(len(values) for values in self._columns.values())
+        if len(lengths) > 1:
+            raise ValueError('All columns need to have the same length')
+        if lengths:
+            self._length = lengths.pop()
+        else:
+            self._length = 0 if index is None else len(index)
+        self._index = index
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Create from ATOM3D dataframe `df`."""
+        return cls({name: df[name].to_numpy() for name in df.columns},
+                   df.index)
+
+    @classmethod
+    def from_split(cls, data, columns, index=None):
+        """
+        Create from a dataframe as stored in an LMDB dataset, i.e. the keyword arguments of pandas.DataFrame. `data` is either a list of rows or arrays by column name.
+        """
+        if isinstance(data, dict):
+            return cls({name: data[name] for name in columns}, index)
+        if len(data) == 0:
+            return cls({name: np.array([]) for name in columns}, index)
+        arrays = {}
+        for name, values in zip(columns, zip(*data)):
+            values = np.array(values)
+            if values.dtype.kind == 'U':
+                # Strings are objects in dataframes too.
+                values = values.astype(object)
+            arrays[name] = values
+        return cls(arrays, index)
+
+    def to_dataframe(self):
+        """Convert to ATOM3D dataframe.
+
+        :return: Atoms in ATOM3D dataframe format.
+        :rtype: pandas.DataFrame
+        """
+        return pd.DataFrame(self._columns, index=self._index)
+
+    def to_numpy(self, dtype=None):
+        """Stack all columns into a 2D array with one row per atom."""
+        if not self._columns:
+            return np.empty((self._length, 0), dtype=dtype)
+        values = np.stack(list(self._columns.values()), axis=1)
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    @property
+    def values(self):
+        return self.to_numpy()
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    @property
+    def index(self):
+        if self._index is None:
+            return np.arange(self._length)
+        return self._index
+
+    @property
+    def shape(self):
+        return (self._length, len(self._columns))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getattr__(self, name):
+        # Column access as attribute, like a dataframe.
+        if not name.startswith('_') and name in self._columns:
+            return self._columns[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        """Get a column by name, an AtomArray of a list of columns, or an AtomArray of the rows selected by a boolean mask, integer indices or slice."""
+        if isinstance(key, str):
+            return self._columns[key]
+        if isinstance(key, list) and key and \
+                all(isinstance(x, str) for x in key):
+            return AtomArray({name: self._columns[name] for name in key},
+                             self._index)
+        return self.take(key)
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if values.ndim == 0:
+            values = np.full(self._length, values)
+        if len(values) != self._length:
+            raise ValueError(f'Column {name} needs {self._length} values')
+        self._columns[name] = values
+
+    def take(self, rows):
+        """Get AtomArray of the rows selected by a boolean mask, integer indices or slice."""
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+        return AtomArray({name: values[rows]
+                          for name, values in self._columns.items()},
+                         np.asarray(self.index)[rows])
+
+    def groupby(self, by):
+        """
+        Split atoms into groups of equal values in the key column(s) `by`, like pandas.DataFrame.groupby. Groups are in order of their keys.
+
+        :param by: Column name or list of column names to group on.
+        :type by: Union[str, list[str]]
+
+        :return: List of tuples containing key and AtomArray of each group. Keys are tuples when grouping on a list of columns.
+        :rtype: list[tuple]
+        """
+        if self._length == 0:
+            return []
+        keys = [by] if isinstance(by, str) else list(by)
+        codes = np.zeros(self._length, dtype=np.int64)
+        for name in keys:
+            uniques, inverse = np.unique(self._columns[name],
+                                         return_inverse=True)
+            codes = codes * len(uniques) + inverse.reshape(-1)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(
+            np.concatenate([[True], sorted_codes[1:] != sorted_codes[:-1]]))
+        stops = np.append(starts[1:], self._length)
+
+        groups = []
+        for start, stop in zip(starts, stops):
+            rows = order[start:stop]
+            key = tuple(self._columns[name][rows[0]] for name in keys)
+            if isinstance(by, str):
+                key = key[0]
+            groups.append((key, self.take(rows)))
+        return groups
+
+    def copy(self):
+        index = None if self._index is None else self._index.copy()
+        return AtomArray({name: values.copy()
+                          for name, values in self._columns.items()}, index)
+
+    def __repr__(self):
+        return f'AtomArray({self._length} atoms, columns={self.columns})'
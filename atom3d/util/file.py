@@ -1,14 +1,14 @@
 """File-related utilities."""
 import os
 from pathlib import Path
-import subprocess
+import re
 
 
 def find_files(path, suffix, relative=None):
     """
     Find all files in path with given suffix. =
 
-    :param path: Directory in which to find files.
+    :param path: Directory in which to find files, or a single file.
     :type path: Union[str, Path]
     :param suffix: Suffix determining file type to search for.
     :type suffix: str
@@ -17,16 +17,20 @@ def find_files(path, suffix, relative=None):
     :return: list of paths to all files with suffix.
     :rtype: list[Path]
     """
-    if not relative:
-        find_cmd = r"find {:} -regex '.*\.{:}'".format(path, suffix)
-    else:
-        find_cmd = r"cd {:}; find . -regex '.*\.{:}' | cut -d '/' -f 2-" \
-            .format(path, suffix)
-    out = subprocess.Popen(
-        find_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        cwd=os.getcwd(), shell=True)
-    (stdout, stderr) = out.communicate()
-    name_list = stdout.decode().split()
+    # Whole paths are matched, like find -regex, but with Python regular
+    # expressions so that patterns such as (mm)?cif$ work.
+    regex = re.compile(r'.*\.' + suffix)
+    name_list = []
+    if os.path.isfile(path):
+        # A single file is matched itself, as find does.
+        f = str(path)
+        if regex.fullmatch(f):
+            name_list.append(os.path.basename(f) if relative else f)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            f = os.path.join(root, name)
+            if regex.fullmatch(f):
+                name_list.append(os.path.relpath(f, path) if relative else f)
     name_list.sort()
     return [Path(x) for x in name_list]
 
@@ -1,9 +1,13 @@
 """Methods to convert between different file formats."""
 import collections as col
 import gzip
+import logging
 import os
+from pathlib import Path
 import re
+import tarfile
 
+from Bio.Data import IUPACData
 import Bio.PDB.Atom
 import Bio.PDB.Chain
 import Bio.PDB.Model
@@ -12,6 +16,9 @@ import Bio.PDB.Structure
 import numpy as np
 import pandas as pd
 
+import atom3d.util.file as fi
+
+logger = logging.getLogger(__name__)
 
 # -- MANIPULATING DATAFRAMES --
 
@@ -93,7 +100,7 @@ def df_to_bp(df_in):
 
 
 def df_to_bps(df_in):
-    """Convert ATOM3D dataframe representation containing multiple structures to list of Biopython structures. Assumes different structures are specified by `ensemble` and `structure` columns of dataframe.
+    """Convert ATOM3D dataframe representation containing multiple structures to list of Biopython structures. Assumes different structures are specified by `ensemble` and `structure` columns of dataframe. Structures, models, chains and residues are in sorted order of their keys, atoms in dataframe order within residues.
 
     :param df_in: Molecular structures in ATOM3D dataframe format.
     :type df_in: pandas.DataFrame
@@ -101,36 +108,56 @@ def df_to_bps(df_in):
     :return : List of molecular structures in BioPython format.
     :rtype: list[Bio.PDB.Structure]
     """
-    df = df_in.copy()
+    # Keys of the levels of the hierarchy. As with groupby, groups are in
+    # sorted order and atoms with missing keys are left out.
+    keys = ['ensemble', 'structure', 'model', 'chain', 'hetero', 'residue',
+            'insertion_code']
+    codes = [pd.factorize(df_in[key], sort=True)[0] for key in keys]
+    index = np.flatnonzero(np.all([c >= 0 for c in codes], axis=0))
+    # Stable, so that atoms keep their order within residues.
+    order = index[np.lexsort([c[index] for c in reversed(codes)])]
+    codes = np.stack([c[order] for c in codes])
+    changed = np.ones(codes.shape, dtype=bool)
+    changed[:, 1:] = codes[:, 1:] != codes[:, :-1]
+    # A group starts wherever a key of its level or of a level above changes.
+    changed = np.logical_or.accumulate(changed, axis=0)
+    starts = np.flatnonzero(changed[-1])
+    ends = np.append(starts[1:], len(order))
+
+    columns = {k: df_in[k].to_numpy()[order].tolist() for k in [
+        'structure', 'model', 'chain', 'hetero', 'residue', 'insertion_code',
+        'resname', 'segid', 'name', 'bfactor', 'occupancy', 'altloc',
+        'fullname', 'serial_number', 'element']}
+    coords = df_in[['x', 'y', 'z']].to_numpy()[order]
+
     all_structures = []
-    for (structure, s_atoms) in split_df(df_in, ['ensemble', 'structure']):
-        new_structure = Bio.PDB.Structure.Structure(structure[1])
-        for (model, m_atoms) in df.groupby(['model']):
-            new_model = Bio.PDB.Model.Model(model)
-            for (chain, c_atoms) in m_atoms.groupby(['chain']):
-                new_chain = Bio.PDB.Chain.Chain(chain)
-                for (residue, r_atoms) in c_atoms.groupby(
-                        ['hetero', 'residue', 'insertion_code']):
-                    # Take first atom as representative for residue values.
-                    rep = r_atoms.iloc[0]
-                    new_residue = Bio.PDB.Residue.Residue(
-                        (rep['hetero'], rep['residue'], rep['insertion_code']),
-                        rep['resname'], rep['segid'])
-                    for row, atom in r_atoms.iterrows():
-                        new_atom = Bio.PDB.Atom.Atom(
-                            atom['name'],
-                            [atom['x'], atom['y'], atom['z']],
-                            atom['bfactor'],
-                            atom['occupancy'],
-                            atom['altloc'],
-                            atom['fullname'],
-                            atom['serial_number'],
-                            atom['element'])
-                        new_residue.add(new_atom)
-                    new_chain.add(new_residue)
-                new_model.add(new_chain)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if changed[1, start]:
+            new_structure = Bio.PDB.Structure.Structure(
+                columns['structure'][start])
+            all_structures.append(new_structure)
+        if changed[2, start]:
+            new_model = Bio.PDB.Model.Model(columns['model'][start])
             new_structure.add(new_model)
-        all_structures.append(new_structure)
+        if changed[3, start]:
+            new_chain = Bio.PDB.Chain.Chain(columns['chain'][start])
+            new_model.add(new_chain)
+        # Take first atom as representative for residue values.
+        new_residue = Bio.PDB.Residue.Residue(
+            (columns['hetero'][start], columns['residue'][start],
+             columns['insertion_code'][start]),
+            columns['resname'][start], columns['segid'][start])
+        for i in range(start, end):
+            new_residue.add(Bio.PDB.Atom.Atom(
+                columns['name'][i],
+                coords[i],
+                columns['bfactor'][i],
+                columns['occupancy'][i],
+                columns['altloc'][i],
+                columns['fullname'][i],
+                columns['serial_number'][i],
+                columns['element'][i]))
+        new_chain.add(new_residue)
     return all_structures
 
 
@@ -253,6 +280,485 @@ def read_pdb_gz(pdb_gz_file, name=None):
     return bp
 
 
+# Columns of an ATOM3D dataframe, as made by bp_to_df.
+_DF_COLUMNS = ['ensemble', 'subunit', 'structure', 'model', 'chain', 'hetero',
+               'insertion_code', 'residue', 'segid', 'resname', 'altloc',
+               'occupancy', 'bfactor', 'x', 'y', 'z', 'element', 'name',
+               'fullname', 'serial_number']
+
+
+def read_pdb_to_df(pdb_file, name=None):
+    """Read pdb or pdb.gz file into ATOM3D dataframe, without building a Biopython structure. The result is the same as that of `bp_to_df(read_any(pdb_file))`: ATOM and HETATM records are parsed column-wise, and files that need more of Biopython's rules (alternate locations, duplicate atoms or residues, missing fields) are read with Biopython instead.
+
+    :param pdb_file: file path
+    :type pdb_file: Union[str, Path]
+    :param name: optional name or identifier for structure. If None (default), use file basename.
+    :type name: str
+
+    :return: Molecular structure in ATOM3D dataframe format.
+    :rtype: pandas.DataFrame
+    """
+    if name is None:
+        name = os.path.basename(pdb_file)
+    if is_pdb_gz(pdb_file):
+        with gzip.open(pdb_file, mode='rb') as f:
+            data = f.read()
+    else:
+        with open(pdb_file, mode='rb') as f:
+            data = f.read()
+    df = _parse_pdb_atoms(data, name)
+    if df is None:
+        logger.debug(f'Reading {pdb_file} with Biopython')
+        return bp_to_df(read_any(pdb_file, name))
+    return df
+
+
+def read_any_to_df(f, name=None):
+    """Read any ATOM3D file type into ATOM3D dataframe, see :func:`read_any`. PDB files are read with :func:`read_pdb_to_df`, mmCIF files with :func:`read_mmcif_to_df` and XYZ files with :func:`read_xyz_atoms`.
+
+    :param f: file path
+    :type f: Union[str, Path]
+    :param name: optional name or identifier for structure. If None (default), use file basename.
+    :type name: str
+
+    :return: Molecular structure in ATOM3D dataframe format.
+    :rtype: pandas.DataFrame
+    """
+    if is_pdb(f) or is_pdb_gz(f):
+        return read_pdb_to_df(f, name)
+    if is_mmcif(f):
+        return read_mmcif_to_df(f, name)
+    if is_xyz(f):
+        return read_xyz_atoms(f)
+    return bp_to_df(read_any(f, name))
+
+
+def _pdb_strings(table, lengths, start, stop):
+    """
+    Get characters `start` to `stop` of the lines in `table` (padded to 80 characters) as codes into the distinct strings among them. Strings are cut like slices of the original lines of `lengths` characters.
+
+    :return: distinct strings and the code of each line
+    :rtype: tuple[list[str], numpy.ndarray]
+    """
+    column = np.ascontiguousarray(table[:, start:stop]).view(
+        f'S{stop - start}')[:, 0]
+    uniques, codes = np.unique(column, return_inverse=True)
+    codes = codes.reshape(-1)
+    values = [x.decode('latin1').ljust(stop - start) for x in uniques]
+    for i in np.flatnonzero(lengths < stop):
+        # Lines that end within the columns.
+        values.append(values[codes[i]][:max(0, lengths[i] - start)])
+        codes[i] = len(values) - 1
+    return values, codes
+
+
+def _atoms_column(values, codes):
+    """Get an object array of strings from distinct `values` and `codes` into them."""
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column[codes]
+
+
+def _pdb_numbers(table, start, stop, dtype):
+    """Parse characters `start` to `stop` of each line in `table` as numbers, or get None if one does not parse."""
+    column = np.ascontiguousarray(table[:, start:stop]).view(
+        f'S{stop - start}')[:, 0]
+    try:
+        return column.astype(dtype)
+    except ValueError:
+        return None
+
+
+def _pdb_atom_name(fullname):
+    """Atom name as Biopython strips it, unless it has inner spaces."""
+    split_list = fullname.split()
+    return split_list[0] if len(split_list) == 1 else fullname
+
+
+def _atom_element(element, name, fullname):
+    """Element of an atom, guessed from its name if `element` is not one, as Biopython does."""
+    if element and element.capitalize() in IUPACData.atom_weights:
+        return element
+    if fullname[0].isalpha() and not fullname[2:].isdigit():
+        putative_element = name.strip()
+    elif name[0].isdigit():
+        putative_element = name[1]
+    else:
+        putative_element = name[0]
+    if putative_element.capitalize() in IUPACData.atom_weights:
+        return putative_element
+    return 'X'
+
+
+def _num_distinct(*codes):
+    """Number of distinct rows of integer `codes`."""
+    return len(np.unique(np.stack(codes, axis=1), axis=0))
+
+
+def _parse_pdb_atoms(data, name):
+    """Parse the ATOM and HETATM records of a PDB file in bytes `data` into an ATOM3D dataframe like Biopython's PDBParser and bp_to_df, or get None if the file needs Biopython."""
+    if not data:
+        return None
+    lines = []
+    models = []
+    serial_nums = []
+    model_id, model_open, started = 0, False, False
+    # Lines are split like a file read in text mode.
+    for line in data.splitlines():
+        record_type = line[0:6]
+        if not started:
+            # Coordinates start with the first of these records.
+            if record_type not in (b'ATOM  ', b'HETATM', b'MODEL '):
+                continue
+            started = True
+        if record_type == b'ATOM  ' or record_type == b'HETATM':
+            if not model_open:
+                serial_nums.append(model_id)
+                model_id += 1
+                model_open = True
+            lines.append(line)
+            models.append(model_id - 1)
+        elif record_type == b'MODEL ':
+            try:
+                serial_nums.append(int(line[10:14]))
+            except ValueError:
+                serial_nums.append(0)
+            model_id += 1
+            model_open = True
+        elif record_type == b'ENDMDL':
+            model_open = False
+        elif record_type == b'END   ' or record_type == b'CONECT':
+            break
+    if not lines:
+        return pd.DataFrame()
+    models = np.array(models, dtype=np.int64)
+    lengths = np.array([len(x) for x in lines])
+    table = np.frombuffer(b''.join(x.ljust(80)[:80] for x in lines),
+                          dtype='S1').reshape(-1, 80)
+
+    if (table[:, 16] != b' ').any() or (lengths < 66).any():
+        # Alternate locations, or missing occupancies.
+        return None
+    x = _pdb_numbers(table, 30, 38, np.float64)
+    y = _pdb_numbers(table, 38, 46, np.float64)
+    z = _pdb_numbers(table, 46, 54, np.float64)
+    occupancy = _pdb_numbers(table, 54, 60, np.float64)
+    bfactor = _pdb_numbers(table, 60, 66, np.float64)
+    residue = _pdb_numbers(table, 22, 26, np.int64)
+    if any(v is None for v in (x, y, z, occupancy, bfactor, residue)):
+        return None
+    serial_number = _pdb_numbers(table, 6, 11, np.int64)
+    if serial_number is None:
+        # E.g. hybrid-36 serial numbers, which Biopython reads as 0.
+        values, codes = _pdb_strings(table, lengths, 6, 11)
+        serial_number = np.array(
+            [int(v) if v.strip().isdigit() else 0 for v in values],
+            dtype=np.int64)[codes]
+
+    fullnames, fullname_codes = _pdb_strings(table, lengths, 12, 16)
+    names, name_codes = np.unique([_pdb_atom_name(v) for v in fullnames],
+                                  return_inverse=True)
+    resnames, resname_codes = _pdb_strings(table, lengths, 17, 20)
+    elements, element_codes = _pdb_strings(table, lengths, 76, 78)
+    return _atoms_to_df(
+        name, models, np.array(serial_nums, dtype=np.int64)[models],
+        table[:, 0] == b'H', _pdb_strings(table, lengths, 21, 22), residue,
+        _pdb_strings(table, lengths, 26, 27),
+        ([v.strip() for v in resnames], resname_codes),
+        _pdb_strings(table, lengths, 72, 76), (fullnames, fullname_codes),
+        (list(names), name_codes.reshape(-1)[fullname_codes]),
+        ([v.strip().upper() for v in elements], element_codes),
+        x, y, z, occupancy, bfactor, serial_number)
+
+
+def _atoms_to_df(name, models, model_serials, hetatm, chains, residue,
+                 icodes, resnames, segids, fullnames, names, elements, x, y,
+                 z, occupancy, bfactor, serial_number, columns=None):
+    """
+    Make an ATOM3D dataframe from the atom records of a file, in file order, the way Biopython's structure builder and bp_to_df would, or get None if the atoms need Biopython. Strings are given as distinct values and the code of each atom, `names` must be distinct.
+
+    :param models: index of the model of each atom
+    :type models: numpy.ndarray
+    :param hetatm: whether each atom is a HETATM record
+    :type hetatm: numpy.ndarray
+    :param columns: columns to return, defaults to all
+    :type columns: list[str], optional
+
+    :rtype: pandas.DataFrame
+    """
+    num_atoms = len(models)
+    chains, chain_codes = chains
+    icodes, icode_codes = icodes
+    resnames, resname_codes = resnames
+    segids, segid_codes = segids
+    fullnames, fullname_codes = fullnames
+    names, name_codes = names
+    elements, element_codes = elements
+
+    # Biopython starts a new residue whenever its id or name changes, and
+    # adds atoms of a residue that was seen before to it. Leave such files,
+    # and duplicate atoms, to Biopython.
+    residue_key = (models, chain_codes, hetatm, residue, icode_codes,
+                   resname_codes)
+    changed = np.ones(num_atoms, dtype=bool)
+    changed[1:] = np.any([k[1:] != k[:-1] for k in residue_key], axis=0)
+    starts = np.flatnonzero(changed)
+    runs = np.cumsum(changed) - 1
+    # Residues that are not hetero are identified without their name, and
+    # all waters as one hetero residue type.
+    water = np.isin(resnames, ['HOH', 'WAT'])[resname_codes]
+    id_codes = np.where(hetatm & ~water, resname_codes, -1)
+    if _num_distinct(*(k[starts] for k in residue_key)) != len(starts) or \
+            _num_distinct(*(k[starts] for k in residue_key[:-1]),
+                          id_codes[starts]) != len(starts) or \
+            _num_distinct(runs, name_codes) != num_atoms:
+        return None
+
+    # Atoms are grouped by model, then by chain in order of appearance.
+    chain_key = models * len(chains) + chain_codes
+    _, first, chain_rank = np.unique(chain_key, return_index=True,
+                                     return_inverse=True)
+    order = np.argsort(first.argsort().argsort()[chain_rank.reshape(-1)],
+                       kind='stable')
+    if not (np.diff(order) != 1).any():
+        order = None
+
+    if columns is None:
+        columns = _DF_COLUMNS
+    df = {}
+    for column in columns:
+        if column in ('ensemble', 'structure'):
+            values = np.full(num_atoms, name, dtype=object)
+        elif column == 'subunit':
+            values = np.zeros(num_atoms, dtype=np.int64)
+        elif column == 'model':
+            values = model_serials
+        elif column == 'chain':
+            values = _atoms_column(chains, chain_codes)
+        elif column == 'hetero':
+            values = np.where(hetatm, np.where(water, 'W', None),
+                              ' ').astype(object)
+            for i in np.flatnonzero(hetatm & ~water):
+                values[i] = 'H_' + resnames[resname_codes[i]]
+        elif column == 'insertion_code':
+            values = _atoms_column(icodes, icode_codes)
+        elif column == 'residue':
+            values = residue
+        elif column == 'segid':
+            # Residues keep the segment id of their first atom.
+            values = _atoms_column(segids, segid_codes[starts][runs])
+        elif column == 'resname':
+            values = _atoms_column(resnames, resname_codes)
+        elif column == 'altloc':
+            values = np.full(num_atoms, ' ', dtype=object)
+        elif column in ('occupancy', 'bfactor', 'serial_number'):
+            values = {'occupancy': occupancy, 'bfactor': bfactor,
+                      'serial_number': serial_number}[column]
+        elif column in ('x', 'y', 'z'):
+            values = {'x': x, 'y': y, 'z': z}[column].astype(np.float32)
+        elif column == 'element':
+            keys, first, codes = np.unique(
+                np.stack([element_codes, fullname_codes], axis=1), axis=0,
+                return_index=True, return_inverse=True)
+            values = _atoms_column(
+                [_atom_element(elements[e], names[name_codes[i]],
+                               fullnames[f])
+                 for (e, f), i in zip(keys, first)], codes.reshape(-1))
+        elif column == 'name':
+            values = _atoms_column(names, name_codes)
+        elif column == 'fullname':
+            values = _atoms_column(fullnames, fullname_codes)
+        else:
+            raise RuntimeError(f'Unrecognized column {column}')
+        df[column] = values if order is None else values[order]
+    return pd.DataFrame(df, columns=columns)
+
+
+def read_mmcif_to_df(mmcif_file, name=None, columns=None, chunk_size=100000):
+    """Read mmCIF file into ATOM3D dataframe, without building a Biopython structure. The result is the same as that of `bp_to_df(read_mmcif(mmcif_file))`: the `_atom_site` loop is read line by line and converted to columns in chunks, so that memory stays proportional to the result also for very large assemblies. Files that need more of Biopython's rules (alternate locations, duplicate atoms or residues, missing or unparsable fields) are read with Biopython instead.
+
+    :param mmcif_file: file path
+    :type mmcif_file: Union[str, Path]
+    :param name: optional name or identifier for structure. If None (default), use file basename.
+    :type name: str
+    :param columns: columns of the ATOM3D dataframe to return, defaults to all
+    :type columns: list[str], optional
+    :param chunk_size: number of atoms to convert to columns at a time, defaults to 100000
+    :type chunk_size: int, optional
+
+    :return: Molecular structure in ATOM3D dataframe format.
+    :rtype: pandas.DataFrame
+    """
+    if name is None:
+        name = os.path.basename(mmcif_file)
+    with open(mmcif_file, mode='r') as f:
+        df = _parse_mmcif_atoms(f, name, columns, chunk_size)
+    if df is None:
+        logger.debug(f'Reading {mmcif_file} with Biopython')
+        df = bp_to_df(read_mmcif(mmcif_file, name))
+        if columns is not None:
+            df = df[columns]
+    return df
+
+
+# Characters that need the full tokenizer of mmCIF lines.
+_MMCIF_SPECIAL = re.compile(r'[\'"#]')
+# Quotes only end a value when followed by whitespace.
+_MMCIF_TOKEN = re.compile(
+    r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(#.*)|(\S+)""")
+
+
+def _mmcif_tokens(line):
+    """Split a line of an mmCIF file into values, without quotes and comments."""
+    if _MMCIF_SPECIAL.search(line) is None:
+        return line.split()
+    tokens = []
+    for match in _MMCIF_TOKEN.finditer(line):
+        single, double, comment, plain = match.groups()
+        if comment is not None:
+            break
+        tokens.append(single if single is not None else
+                      double if double is not None else plain)
+    return tokens
+
+
+def _mmcif_atom_site(f, chunk_size):
+    """
+    Read the `_atom_site` loop of the first data block of mmCIF file `f`.
+
+    :return: names of the loop's columns, then lists of the values of up to `chunk_size` rows each, row after row
+    :rtype: Iterator[list[str]]
+    """
+    lines = iter(f)
+    header = []
+    after_loop, num_blocks = False, 0
+    line = next(lines, None)
+    while line is not None:
+        if after_loop and line.startswith('_atom_site.'):
+            header.append(line.split()[0][len('_atom_site.'):])
+        elif header:
+            break
+        elif line.startswith('data_'):
+            num_blocks += 1
+            if num_blocks > 1:
+                return
+        elif line.strip():
+            after_loop = line.startswith('loop_')
+        line = next(lines, None)
+    if not header:
+        return
+    yield header
+
+    values = []
+    while line is not None:
+        if line.startswith(('_', 'loop_', 'data_', 'save_')):
+            break
+        if line.startswith(';'):
+            # Multi-line value, up to a line that starts with a semicolon.
+            text = [line[1:]]
+            line = next(lines, None)
+            while line is not None and not line.startswith(';'):
+                text.append(line)
+                line = next(lines, None)
+            if line is None:
+                break
+            values.append(''.join(text).rstrip('\n'))
+            line = line[1:]
+        values.extend(_mmcif_tokens(line))
+        if len(values) >= chunk_size * len(header):
+            num_values = len(values) - len(values) % len(header)
+            yield values[:num_values]
+            values = values[num_values:]
+        line = next(lines, None)
+    if values:
+        yield values
+
+
+def _parse_mmcif_atoms(f, name, columns=None, chunk_size=100000):
+    """Parse the `_atom_site` loop of mmCIF file `f` into an ATOM3D dataframe like Biopython's MMCIFParser and bp_to_df, or get None if the file needs Biopython."""
+    loop = _mmcif_atom_site(f, chunk_size)
+    header = next(loop, None)
+    if header is None:
+        return None
+    seq_id = 'auth_seq_id' if 'auth_seq_id' in header else 'label_seq_id'
+    strings = ['group_PDB', 'label_atom_id', 'label_alt_id', 'label_comp_id',
+               'auth_asym_id', seq_id, 'pdbx_PDB_ins_code']
+    numbers = {'pdbx_PDB_model_num': np.int64}
+    if columns is None or 'element' in columns:
+        strings.append('type_symbol')
+    for column, field, dtype in [
+            ('x', 'Cartn_x', np.float64), ('y', 'Cartn_y', np.float64),
+            ('z', 'Cartn_z', np.float64),
+            ('occupancy', 'occupancy', np.float64),
+            ('bfactor', 'B_iso_or_equiv', np.float64),
+            ('serial_number', 'id', np.int64)]:
+        if columns is None or column in columns:
+            numbers[field] = dtype
+    if any(x not in header for x in strings + list(numbers)
+           if x != 'type_symbol'):
+        return None
+
+    chunks = col.defaultdict(list)
+    num_fields = len(header)
+    for values in loop:
+        if len(values) % num_fields != 0:
+            return None
+        resseq = np.array(values[header.index(seq_id)::num_fields])
+        # Atoms of non-existing residues are skipped.
+        keep = None if '.' not in resseq else resseq != '.'
+        for field in strings + list(numbers):
+            if field not in header:
+                continue
+            column = np.array(values[header.index(field)::num_fields])
+            if keep is not None:
+                column = column[keep]
+            if field in numbers:
+                try:
+                    column = column.astype(numbers[field])
+                except ValueError:
+                    return None
+            chunks[field].append(column)
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    fields = {k: np.concatenate(v) for k, v in chunks.items()}
+    num_atoms = len(fields[seq_id])
+    if num_atoms == 0:
+        return pd.DataFrame(columns=columns)
+
+    if not np.isin(fields['label_alt_id'], ['.', '?']).all():
+        # Alternate locations.
+        return None
+    try:
+        residue = fields[seq_id].astype(np.int64)
+    except ValueError:
+        return None
+    model_serials = fields['pdbx_PDB_model_num']
+    changed = np.ones(num_atoms, dtype=bool)
+    changed[1:] = model_serials[1:] != model_serials[:-1]
+    models = np.cumsum(changed) - 1
+
+    def strings_of(field):
+        values, codes = np.unique(fields[field], return_inverse=True)
+        return values.tolist(), codes.reshape(-1)
+
+    icodes, icode_codes = strings_of('pdbx_PDB_ins_code')
+    icodes = [' ' if x in ('.', '?') else x for x in icodes]
+    fullnames = strings_of('label_atom_id')
+    if 'type_symbol' in fields:
+        elements, element_codes = strings_of('type_symbol')
+        elements = [x.upper() for x in elements]
+    else:
+        elements, element_codes = [''], np.zeros(num_atoms, dtype=np.int64)
+    return _atoms_to_df(
+        name, models, model_serials, fields['group_PDB'] == 'HETATM',
+        strings_of('auth_asym_id'), residue, (icodes, icode_codes),
+        strings_of('label_comp_id'),
+        ([' '], np.zeros(num_atoms, dtype=np.int64)), fullnames, fullnames,
+        (elements, element_codes), fields.get('Cartn_x'),
+        fields.get('Cartn_y'), fields.get('Cartn_z'), fields.get('occupancy'),
+        fields.get('B_iso_or_equiv'), fields.get('id'), columns)
+
+
 def read_mmcif(mmcif_file, name=None):
     """Read mmCIF file into Biopython structure.
 
@@ -265,7 +771,7 @@ def read_mmcif(mmcif_file, name=None):
     :rtype: Bio.PDB.Structure
     """
     if name is None:
-        os.path.basename(mmcif_file)
+        name = os.path.basename(mmcif_file)
     parser = Bio.PDB.MMCIFParser(QUIET=True)
     return parser.get_structure(name, mmcif_file)
 
@@ -397,44 +903,156 @@ def read_xyz(xyz_file, name=None, gdb=False):
         \t- smiles (str): SMILES string from GDB-17 and from B3LYP relaxation.\n
         \t- inchi (str): InChI string for Corina and B3LYP geometries.
     """
-    # Load the xyz file into a dataframe
     if gdb:
-        df, data, freq, smiles, inchi = read_xyz_to_df(xyz_file, gdb_data=True)
-    else:
-        df = read_xyz_to_df(xyz_file)
-    if name is not None: df.index.name = name
-    # Make up atom names
-    elements = df['element'].unique()
-    el_count = {}
-    for e in elements:
-        el_count[e] = 0
-    new_name = []
-    for el in df['element']:
-        el_count[el] += 1
-        new_name.append('%s%i'%(el,el_count[el]))
-    # Fill additional fields
-    df['ensemble'] = [df.name.replace(' ','_')]*len(df)
-    df['subunit'] = [0]*len(df)
-    df['structure'] = [df.name.replace(' ','_')]*len(df)
-    df['model'] = [0]*len(df)
-    df['chain'] = ['L']*len(df)
-    df['hetero'] = ['']*len(df)
-    df['insertion_code'] = ['']*len(df)
-    df['residue'] = [1]*len(df)
-    df['segid'] = ['LIG']*len(df)
-    df['resname'] = ['LIG']*len(df)
-    df['altloc'] = ['']*len(df)
-    df['occupancy'] = [1.]*len(df)
-    df['bfactor'] = [0.]*len(df)
-    df['name'] = new_name
-    df['fullname'] = new_name
-    df['serial_number'] = range(len(df))
-    # Convert to biopython representation
-    bp = df_to_bp(df)
+        df, data, freq, smiles, inchi = read_xyz_atoms(xyz_file, gdb=True)
+        return df_to_bp(df), data, freq, smiles, inchi
+    return df_to_bp(read_xyz_atoms(xyz_file))
+
+
+def read_xyz_atoms(xyz_file, gdb=False):
+    """Read an XYZ file into ATOM3D dataframe (optionally with GDB9-specific data) in one pass, without a round trip through Biopython. The result is the same as that of `bp_to_df(read_xyz(xyz_file))`: atoms form one residue LIG of chain L and are named by element and count, e.g. C1, C2, H1.
+
+    :param xyz_file: Path to input file in XYZ format.
+    :type xyz_file: Union[str, Path]
+    :param gdb: Specifies whether to process and return GDB9-specific data.
+    :type gdb: bool
+
+    :return: If `gdb=False`, returns ATOM3D dataframe. If `gdb=True`, returns tuple of ATOM3D dataframe, data, freq, smiles and inchi, see :func:`read_xyz`.
+    """
+    with open(xyz_file) as f:
+        molecule = _parse_xyz(f.read(), gdb)
+    df = _xyz_atoms_df([molecule])
     if gdb:
-        return bp, data, freq, smiles, inchi
+        return (df, molecule['data'], molecule['freq'], molecule['smiles'],
+                molecule['inchi'])
+    return df
+
+
+def read_xyz_bulk(path, gdb=False):
+    """Read all XYZ files in a directory, or in a (compressed) tar archive such as the QM9 download, into one ATOM3D dataframe. Molecules are in order of file name, with atoms as read by :func:`read_xyz_atoms`.
+
+    :param path: directory or tar archive of XYZ files
+    :type path: Union[str, Path]
+    :param gdb: Specifies whether to process and return GDB9-specific data.
+    :type gdb: bool
+
+    :return: Tuple containing \n
+        \t- atoms (pandas.DataFrame): atoms of all molecules in ATOM3D dataframe format.\n
+        \t- molecules (pandas.DataFrame): one row per molecule with its `id`, `file_path`, `num_atoms` and the `offset` of its first atom in `atoms`, plus `data`, `freq`, `smiles` and `inchi` if `gdb=True`.
+    """
+    path = Path(path)
+    texts = []
+    if path.is_dir():
+        for f in fi.find_files(path, patterns['xyz']):
+            with open(f) as h:
+                texts.append((str(f), h.read()))
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as tar:
+            for member in tar:
+                if member.isfile() and _regexes['xyz'].search(member.name):
+                    texts.append((member.name,
+                                  tar.extractfile(member).read().decode()))
+        texts.sort()
     else:
-        return bp
+        raise RuntimeError(f'{path} is neither a directory nor a tar archive')
+
+    molecules = [_parse_xyz(text, gdb) for _, text in texts]
+    atoms = _xyz_atoms_df(molecules)
+    num_atoms = np.array([len(m['element']) for m in molecules],
+                         dtype=np.int64)
+    info = pd.DataFrame({
+        'id': [m['name'].replace(' ', '_') for m in molecules],
+        'file_path': [f for f, _ in texts],
+        'num_atoms': num_atoms,
+        'offset': np.cumsum(num_atoms) - num_atoms,
+    })
+    if gdb:
+        for key in ['data', 'freq', 'smiles', 'inchi']:
+            info[key] = [m[key] for m in molecules]
+    return atoms, info
+
+
+def _parse_xyz(text, gdb):
+    """Parse the text of an XYZ file into its name, elements and coordinates (and GDB9-specific data)."""
+    lines = text.splitlines()
+    num_atoms = int(lines[0].strip())
+    line_labels = lines[1].strip().split('\t')
+    # GDB9 files write some exponents as *^.
+    atoms = [x.split() for x in
+             '\n'.join(lines[2:2 + num_atoms]).replace('*^', 'e').split('\n')
+             if x.strip()]
+    molecule = {
+        'name': line_labels[0],
+        'element': [x[0] for x in atoms],
+        'xyz': np.array([x[1:4] for x in atoms],
+                        dtype=np.float64).reshape(-1, 3),
+    }
+    if gdb:
+        rest = lines[2 + num_atoms:]
+        molecule['charge'] = np.array([x[4] for x in atoms],
+                                      dtype=np.float64)
+        molecule['data'] = [float(ll) for ll in line_labels[1:]]
+        molecule['freq'] = [float(ll) for ll in rest[0].strip().split('\t')]
+        molecule['smiles'] = rest[1].strip().split('\t')[0]
+        molecule['inchi'] = rest[2].strip().split('\t')[0]
+    return molecule
+
+
+def _xyz_atoms_df(molecules):
+    """Make one ATOM3D dataframe of the atoms of parsed XYZ `molecules`."""
+    counts = [len(m['element']) for m in molecules]
+    num_atoms = sum(counts)
+    names = np.empty(len(molecules), dtype=object)
+    names[:] = [m['name'].replace(' ', '_') for m in molecules]
+    names = np.repeat(names, counts)
+    molecule_index = np.repeat(np.arange(len(molecules)), counts)
+    elements = [e for m in molecules for e in m['element']]
+    uniques, codes = np.unique(np.array(elements, dtype=str),
+                               return_inverse=True)
+    # Make up atom names, counting each element within its molecule.
+    key = molecule_index * len(uniques) + codes.reshape(-1)
+    order = np.argsort(key, kind='stable')
+    starts = np.ones(num_atoms, dtype=bool)
+    starts[1:] = key[order][1:] != key[order][:-1]
+    start_index = np.flatnonzero(starts)
+    rank = np.empty(num_atoms, dtype=np.int64)
+    rank[order] = np.arange(num_atoms) - np.repeat(
+        start_index, np.diff(np.append(start_index, num_atoms)))
+    atom_names = np.empty(num_atoms, dtype=object)
+    atom_names[:] = [e + str(r + 1) for e, r in zip(elements, rank.tolist())]
+    element = np.empty(num_atoms, dtype=object)
+    element[:] = elements
+    for i in np.flatnonzero(~np.isin(
+            [e.capitalize() for e in uniques.tolist()],
+            list(IUPACData.atom_weights))[codes.reshape(-1)]):
+        element[i] = _atom_element(element[i], atom_names[i], atom_names[i])
+    xyz = np.concatenate([m['xyz'] for m in molecules]) if molecules else \
+        np.zeros((0, 3))
+    df = {
+        'ensemble': names,
+        'subunit': 0,
+        'structure': names,
+        'model': 0,
+        'chain': 'L',
+        'hetero': '',
+        'insertion_code': '',
+        'residue': 1,
+        'segid': 'LIG',
+        'resname': 'LIG',
+        'altloc': '',
+        'occupancy': 1.,
+        'bfactor': 0.,
+        'x': xyz[:, 0],
+        'y': xyz[:, 1],
+        'z': xyz[:, 2],
+        'element': element,
+        'name': atom_names,
+        'fullname': atom_names,
+        'serial_number': np.arange(num_atoms) -
+        np.repeat(np.cumsum(counts) - counts, counts).astype(np.int64),
+    }
+    return pd.DataFrame(df, index=pd.RangeIndex(num_atoms),
+                        columns=_DF_COLUMNS)
 
 
 def read_xyz_to_df(inputfile, gdb_data=False):
@@ -453,33 +1071,19 @@ def read_xyz_to_df(inputfile, gdb_data=False):
         \t- inchi (str): InChI string for Corina and B3LYP geometries. Returned only when `gdb=True`.\n
     """
     with open(inputfile) as f:
-        # Reading number of atoms in the molecule
-        num_atoms = int(f.readline().strip())
-        # Loading GDB ID and label data
-        line_labels = f.readline().strip().split('\t')
-        name = line_labels[0]
-        if gdb_data: data = [float(ll) for ll in line_labels[1:]]
-        # Skip atom data (will be read using pandas below)
-        for n in range(num_atoms): f.readline()
-        # Harmonic vibrational frequencies
-        if gdb_data:
-            freq = [float(ll) for ll in f.readline().strip().split('\t')]
-        # SMILES and InChI
-        if gdb_data: smiles = f.readline().strip().split('\t')[0]
-        if gdb_data: inchi  = f.readline().strip().split('\t')[0]
+        parsed = _parse_xyz(f.read(), gdb_data)
     # Define columns: element, x, y, z, Mulliken charges (GDB only)
-    columns = ['element','x', 'y', 'z']
-    if gdb_data: columns += ['charge']
-    # Load atom information
-    molecule = pd.read_table(inputfile, names=columns,
-                             skiprows=2, nrows=num_atoms,
-                             delim_whitespace=True)
+    columns = {'element': parsed['element'], 'x': parsed['xyz'][:, 0],
+               'y': parsed['xyz'][:, 1], 'z': parsed['xyz'][:, 2]}
+    if gdb_data: columns['charge'] = parsed['charge']
+    molecule = pd.DataFrame(columns)
     # Name the dataframe
-    molecule.name = name
-    molecule.index.name = name
+    molecule.name = parsed['name']
+    molecule.index.name = parsed['name']
     # return molecule info
     if gdb_data:
-        return molecule, data, freq, smiles, inchi
+        return (molecule, parsed['data'], parsed['freq'], parsed['smiles'],
+                parsed['inchi'])
     else:
         return molecule
 
@@ -96,7 +96,7 @@ def get_grid(df, center, config, rot_mat=np.eye(3, 3)):
 
     # Select valid atoms.
     at = df[['x', 'y', 'z']].values.astype(np.float32)
-    elements = df['element'].values
+    elements = np.asarray(df['element'])
 
     # Center atoms.
     at = at - center
@@ -140,7 +140,7 @@ def get_voxels(df, center, config, rot_mat=np.eye(3, 3)):
 
     # Select valid atoms.
     at = df[['x', 'y', 'z']].values.astype(np.float32)
-    elements = df['element'].values
+    elements = np.asarray(df['element'])
 
     # Center atoms.
     at = at - center
@@ -14,6 +14,7 @@ setup(
         'atom3d.splits',
         'atom3d.filters',
         'atom3d.data',
+        'atom3d.bench',
     ]),
     version='0.1.2',
     description='ATOM3D: Tasks On Molecules in 3 Dimensions',
@@ -0,0 +1,9 @@
+import atom3d.bench.parse as bp
+
+
+def test_benchmark_parse():
+    results = bp.benchmark_parse('tests/test_data/pdb', repeats=1)
+    assert results['reader'].tolist() == ['biopython', 'direct']
+    assert (results['num_files'] == 4).all()
+    assert results['num_atoms'].nunique() == 1
+    assert results['speedup'].iloc[0] == 1
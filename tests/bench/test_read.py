@@ -0,0 +1,29 @@
+import atom3d.bench.read as br
+
+
+def test_benchmark_read(tmp_path):
+    results = br.benchmark_read('tests/test_data/lmdb', num_workers=[0, 1],
+                                num_items=3,
+                                serialization_formats=['columnar'],
+                                compressions=['none', 'gzip'],
+                                work_dir=tmp_path)
+    assert len(results) == 6
+    assert (results['num_items'] == 3).all()
+    assert results['serialization_format'].tolist() == \
+        ['json'] * 2 + ['columnar'] * 4
+    assert results['compression'].tolist()[2:] == ['none'] * 2 + ['gzip'] * 2
+    assert (results['items_per_sec'] > 0).all()
+    # Uncompressed records are larger on disk than gzipped ones.
+    none, gzip = results.iloc[2], results.iloc[4]
+    assert none['read_mb_per_sec'] / none['items_per_sec'] > \
+        gzip['read_mb_per_sec'] / gzip['items_per_sec']
+    assert (results['p99_ms'] >= results['p50_ms']).all()
+    assert (tmp_path / 'columnar_gzip.lmdb').exists()
+
+
+def test_benchmark_read_files():
+    results = br.benchmark_read('tests/test_data/pdb', 'pdb')
+    assert results['num_items'].tolist() == [4]
+    assert results['serialization_format'].isna().all()
+    assert results['read_mb_per_sec'].isna().all()
+    assert (results['decoded_mb_per_sec'] > 0).all()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import torch
+
+import atom3d.datasets as da
+import atom3d.datasets.cache as ca
+
+
+def test_item_cache():
+    cache = ca.ItemCache(max_bytes=2000)
+    for key in range(3):
+        cache.put(key, {'x': np.zeros(100)})
+    # 800 bytes per item, the first one was evicted.
+    assert cache.get(0) is None
+    item = cache.get(1)
+    item['x'][:] = 1
+    assert (cache.get(1)['x'] == 0).all()
+    cache.put(3, {'x': np.zeros(100)})
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    cache.put(4, {'x': np.zeros(1000)})
+    assert cache.get(4) is None
+    assert cache.info() == {'hits': 3, 'misses': 3, 'items': 2, 'bytes': 1600}
+
+
+def test_item_nbytes():
+    df = pd.DataFrame({'x': np.zeros(100), 'name': ['CA'] * 100})
+    # Strings count with their objects, not only the pointers to them.
+    assert ca.item_nbytes({'atoms': df}) == \
+        df.memory_usage(index=True, deep=True).sum()
+    assert ca.item_nbytes(np.array(['CA'] * 100, dtype=object)) > 800
+
+
+def test_lmdb_item_cache():
+    dataset = da.LMDBDataset('tests/test_data/lmdb', cache_bytes=int(1e8),
+                             transform=lambda x: dict(x, atoms=x['atoms'][:1]))
+    first = [dataset[i] for i in range(len(dataset))]
+    second = dataset.get_many(range(len(dataset)))
+    for x, y in zip(first, second):
+        assert x['atoms'].equals(y['atoms'])
+        assert len(y['atoms']) == 1
+    info = dataset.cache_info()
+    assert info['hits'] == len(dataset)
+    assert info['misses'] == len(dataset)
+    assert info['items'] == len(dataset)
+    assert da.LMDBDataset('tests/test_data/lmdb').cache_info() is None
+
+
+def test_lmdb_shared_cache():
+    dataset = da.LMDBDataset('tests/test_data/lmdb', cache_bytes=int(1e8),
+                             shared_cache=True)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=1, num_workers=2, collate_fn=lambda x: x,
+        multiprocessing_context='fork')
+    ids = [batch[0]['id'] for batch in loader]
+    # The workers filled the cache of this process.
+    assert dataset.cache_info()['items'] == len(dataset)
+    assert [x['id'] for x in dataset] == ids
+    assert dataset.cache_info()['hits'] == len(dataset)
+    assert dataset.cache_info()['misses'] == 0
@@ -1,8 +1,14 @@
 import pytest
 import os
 import importlib
+import multiprocessing as mp
+
+import numpy as np
+import torch
 
 import atom3d.datasets as da
+import atom3d.datasets.datasets as dd
+import atom3d.util.formats as fo
 
 
 # -- Dataset Loaders
@@ -18,6 +24,162 @@ def test_load_dataset_lmdb():
         assert df['atoms'].z.dtype == 'float'
 
 
+def test_load_dataset_lmdb_workers():
+    dataset = da.LMDBDataset('tests/test_data/lmdb')
+    # Environment is shared with other datasets of the same process.
+    other = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    assert dataset[0]['id'] == other[0]['id']
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=None, num_workers=2,
+        multiprocessing_context='fork')
+    ids = [x['id'] for x in loader]
+    assert sorted(ids) == sorted(dataset.ids())
+
+
+def test_close_lmdb_env():
+    dataset = da.LMDBDataset('tests/test_data/lmdb')
+    assert dataset[0]['id']
+    # Relative and absolute paths name the same environment.
+    da._close_lmdb_env('tests/test_data/lmdb')
+    assert da._lmdb_env_key('tests/test_data/lmdb') not in da._lmdb_envs
+    # Reopened on next use.
+    assert dataset[0]['id']
+
+
+def test_lmdb_get_many():
+    dataset = da.LMDBDataset('tests/test_data/lmdb', num_threads=2)
+    indices = [3, 0, 2, 0]
+    items = dataset.get_many(indices)
+    assert [x['id'] for x in items] == [dataset[i]['id'] for i in indices]
+    assert items[1]['atoms'].equals(dataset[0]['atoms'])
+    with pytest.raises(IndexError):
+        dataset.get_many([0, len(dataset)])
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=2, collate_fn=lambda x: x)
+    assert sum(len(batch) for batch in loader) == len(dataset)
+
+
+def test_lmdb_id_index(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    da.make_lmdb_dataset(dataset, tmp_path / 'out')
+    # Old LMDBs without id index and new ones resolve ids the same way.
+    for path in ['tests/test_data/lmdb', tmp_path / 'out']:
+        new_dataset = da.load_dataset(path, 'lmdb')
+        ids = [x['id'] for x in new_dataset]
+        assert new_dataset.ids() == ids
+        assert new_dataset.ids_to_indices(ids[::-1]) == [3, 2, 1, 0]
+        assert new_dataset.get(ids[2])['id'] == ids[2]
+        for missing in ['', ids[0][:-1], ids[0] + 'x', 'x' * 100]:
+            with pytest.raises(IndexError):
+                new_dataset.id_to_idx(missing)
+
+
+def test_lmdb_buffers(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    output_lmdb = str(tmp_path / 'columnar')
+    da.make_lmdb_dataset(dataset, output_lmdb,
+                         serialization_format='columnar', compression='none')
+    viewed = da.LMDBDataset(output_lmdb, atom_arrays=True, buffers=True)
+    copied = da.LMDBDataset(output_lmdb)
+    for item, expected in zip(viewed.get_many([0, 1]), [copied[0], copied[1]]):
+        assert item['atoms'].to_dataframe().equals(expected['atoms'])
+        x = item['atoms']['x']
+        assert not x.flags.writeable
+        assert not x.flags.owndata
+        owned = dd.copy_item(item)
+        assert owned['atoms']['x'].flags.writeable
+    # Views stay mapped when the environment is closed, e.g. to write to it.
+    x = viewed[2]['atoms']['x']
+    expected = copied[2]['atoms']['x'].to_numpy()
+    dd._close_lmdb_env(output_lmdb)
+    assert viewed[3]['id'] == copied[3]['id']
+    assert np.array_equal(x, expected)
+    # Dataframes are not built in place.
+    framed = da.LMDBDataset(output_lmdb, buffers=True)[0]
+    assert framed['atoms']['x'].to_numpy().flags.writeable
+    # Non-columnar records are copied out before decoding.
+    item = da.LMDBDataset('tests/test_data/lmdb', buffers=True)[0]
+    assert item['atoms'].equals(dataset[0]['atoms'])
+
+
+def test_lmdb_fields(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    keys = [key for key in dataset[0] if key != 'atoms']
+    for serialization_format in ['json', 'columnar']:
+        for compression in ['gzip', 'none']:
+            output_lmdb = str(tmp_path / f'{serialization_format}_{compression}')
+            da.make_lmdb_dataset(dataset, output_lmdb, layout='fields',
+                                 serialization_format=serialization_format,
+                                 compression=compression)
+            item_lmdb = output_lmdb + '_item'
+            da.make_lmdb_dataset(dataset, item_lmdb,
+                                 serialization_format=serialization_format,
+                                 compression=compression)
+            item = da.LMDBDataset(output_lmdb)[1]
+            expected = da.LMDBDataset(item_lmdb)[1]
+            assert set(item) == set(expected)
+            assert item['atoms'].equals(expected['atoms'])
+            projected = da.LMDBDataset(output_lmdb, fields=keys)
+            assert set(projected[1]) == set(keys)
+            assert projected[1]['id'] == dataset[1]['id']
+            atoms_only = da.LMDBDataset(output_lmdb, fields=['atoms'])
+            assert set(atoms_only[1]) == {'atoms', 'id', 'file_path'}
+            assert atoms_only[1]['id'] == dataset[1]['id']
+            shared = da.LMDBDataset(output_lmdb, fields=['id'],
+                                    cache_bytes=int(1e6), shared_cache=True)
+            for _ in range(2):
+                assert shared[1]['id'] == dataset[1]['id']
+                assert 'atoms' not in shared[1]
+    # Other LMDBs are read whole and then projected.
+    projected = da.LMDBDataset('tests/test_data/lmdb', fields=['id'])
+    assert projected[0]['id'] == dataset[0]['id']
+    assert 'atoms' not in projected[0]
+
+
+def test_extract_coordinates_as_numpy_arrays(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    indices = np.array([2, 0])
+    padded = dd.extract_coordinates_as_numpy_arrays(dataset, indices)
+    for j, idx in enumerate(indices):
+        atoms = dataset[idx]['atoms']
+        n = padded['num_atoms'][j]
+        assert n == len(atoms)
+        assert np.array_equal(padded['charges'][j, :n],
+                              [fo.atomic_number[e] for e in atoms['element']])
+        assert np.array_equal(padded['positions'][j, :n],
+                              atoms[['x', 'y', 'z']].to_numpy())
+        assert not padded['charges'][j, n:].any()
+    csr = dd.extract_coordinates_as_numpy_arrays(
+        dataset, indices, num_workers=2, layout='csr', dtype=np.float32,
+        output_dir=tmp_path)
+    assert np.array_equal(csr['num_atoms'], padded['num_atoms'])
+    offsets = np.load(tmp_path / 'offsets.npy')
+    positions = np.load(tmp_path / 'positions.npy', mmap_mode='r')
+    assert positions.dtype == np.float32
+    for j in range(len(indices)):
+        n = padded['num_atoms'][j]
+        assert np.allclose(positions[offsets[j]:offsets[j + 1]],
+                           padded['positions'][j, :n])
+    # Sized from the metadata index, or by counting if it does not match.
+    da.make_lmdb_dataset(dataset, tmp_path / 'with_metadata')
+    indexed = da.load_dataset(tmp_path / 'with_metadata', 'lmdb')
+
+    class _Miscounted(torch.utils.data.Dataset):
+        metadata = indexed.metadata.assign(
+            num_atoms=indexed.metadata['num_atoms'] + 1)
+
+        def __len__(self):
+            return len(indexed)
+
+        def __getitem__(self, index):
+            return indexed[index]
+
+    for source in [indexed, _Miscounted()]:
+        arrays = dd.extract_coordinates_as_numpy_arrays(source, indices)
+        for name in ['num_atoms', 'charges', 'positions']:
+            assert np.array_equal(arrays[name], padded[name])
+
+
 #def test_load_dataset_sharded():
 #    dataset = da.load_dataset('tests/test_data/sharded', 'sharded')
 #    assert len(dataset) == 4
@@ -96,3 +258,164 @@ def test_make_lmdb_dataset():
     os.remove('tests/test_data/_output_lmdb/lock.mdb')
     os.rmdir('tests/test_data/_output_lmdb')
 
+
+
+@pytest.mark.skipif(not importlib.util.find_spec("zstandard") is not None,
+                    reason="zstd compression requires zstandard!")
+def test_compress_zstd_dict():
+    samples = [dd.serialize({'id': str(i), 'labels': list(range(i % 50))},
+                            'msgpack') for i in range(500)]
+    compression_dict = dd.train_zstd_dict(samples, 1024)
+    assert compression_dict is not None
+    for x in samples[:10]:
+        compressed = dd.compress(x, 'zstd', compression_dict)
+        assert dd.decompress(compressed, 'zstd', compression_dict) == x
+    # The dictionary is loaded once per thread.
+    assert dd._zstd_context('decompressor', compression_dict) is \
+        dd._zstd_context('decompressor', memoryview(compression_dict))
+
+
+def test_bounded_imap():
+    with mp.Pool(2) as pool:
+        assert list(dd._bounded_imap(pool, abs, range(-10, 0), 2, 3)) == \
+            list(range(10, 0, -1))
+
+
+def test_make_lmdb_dataset_num_workers(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    filter_fn = lambda x: x['id'] == '11as.pdb'
+    for num_workers in [0, 2]:
+        da.make_lmdb_dataset(dataset, tmp_path / str(num_workers),
+                             filter_fn=filter_fn, serialization_format='json',
+                             num_workers=num_workers)
+    with open(tmp_path / '0' / 'data.mdb', 'rb') as f:
+        serial = f.read()
+    with open(tmp_path / '2' / 'data.mdb', 'rb') as f:
+        parallel = f.read()
+    assert serial == parallel
+    new_dataset = da.load_dataset(tmp_path / '2', 'lmdb')
+    assert len(new_dataset) == 3
+    assert '11as.pdb' not in new_dataset.ids()
+
+
+class _FailingDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset, fail_at):
+        self._dataset = dataset
+        self._fail_at = fail_at
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, index):
+        if index == self._fail_at:
+            raise RuntimeError('interrupted')
+        return self._dataset[index]
+
+
+def test_make_lmdb_dataset_resume(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    with pytest.raises(RuntimeError, match='interrupted'):
+        da.make_lmdb_dataset(_FailingDataset(dataset, 3), tmp_path / 'out',
+                             commit_items=2, map_size=2**16)
+    # Resume with the remaining examples only.
+    da.make_lmdb_dataset(_FailingDataset(dataset, 0), tmp_path / 'out',
+                         commit_items=2, map_size=2**16, resume=True)
+    with pytest.raises(RuntimeError, match='already exists'):
+        da.make_lmdb_dataset(dataset, tmp_path / 'out')
+    new_dataset = da.load_dataset(tmp_path / 'out', 'lmdb')
+    assert len(new_dataset) == 4
+    for i, x in enumerate(dataset):
+        assert new_dataset.id_to_idx(x['id']) == i
+    assert new_dataset.metadata['id'].tolist() == [x['id'] for x in dataset]
+
+    # Repeated ids.
+    items = [dataset[i] for i in [0, 1, 2, 3, 1, 2]]
+    with pytest.raises(RuntimeError, match='interrupted'):
+        da.make_lmdb_dataset(_FailingDataset(items, 4), tmp_path / 'dup',
+                             commit_items=2, map_size=2**16)
+    da.make_lmdb_dataset(_FailingDataset(items, 0), tmp_path / 'dup',
+                         commit_items=2, map_size=2**16, resume=True)
+    new_dataset = da.load_dataset(tmp_path / 'dup', 'lmdb')
+    assert len(new_dataset) == 6
+    assert [x['id'] for x in new_dataset] == [x['id'] for x in items]
+    assert new_dataset.metadata['id'].tolist() == [x['id'] for x in items]
+
+    # Without resume, an unfinished build starts over.
+    with pytest.raises(RuntimeError, match='interrupted'):
+        da.make_lmdb_dataset(_FailingDataset(dataset, 3), tmp_path / 'new',
+                             commit_items=2, map_size=2**16)
+    da.make_lmdb_dataset(dataset, tmp_path / 'new', commit_items=2,
+                         map_size=2**16)
+    new_dataset = da.load_dataset(tmp_path / 'new', 'lmdb')
+    assert new_dataset.ids() == [x['id'] for x in dataset]
+
+
+def test_lmdb_metadata(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    da.make_lmdb_dataset(dataset, tmp_path / 'out',
+                         metadata_fn=lambda x: {'year': 2000})
+    metadata = da.load_dataset(tmp_path / 'out', 'lmdb').metadata
+    assert len(metadata) == len(dataset)
+    for row, x in zip(metadata.itertuples(), dataset):
+        assert row.id == x['id']
+        assert row.num_atoms == len(x['atoms'])
+        assert row.num_chains == x['atoms']['chain'].nunique()
+        assert row.num_chains == len(x['atoms'][dd._CHAIN_COLUMNS]
+                                     .drop_duplicates())
+        assert row.elements.split(',') == sorted(x['atoms']['element'].unique())
+        assert row.year == 2000
+    assert 'file_path' not in metadata
+    assert da.load_dataset('tests/test_data/lmdb', 'lmdb').metadata is None
+
+
+def test_sharded_lmdb_dataset(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    shards = da.make_sharded_lmdb_dataset(dataset, tmp_path, 3,
+                                          prefix='train')
+    da.make_lmdb_dataset(dataset, tmp_path / 'single')
+    dataset = da.load_dataset(tmp_path / 'single', 'lmdb')
+    assert [p.name for p in shards] == \
+        ['train_000.lmdb', 'train_001.lmdb', 'train_002.lmdb']
+    sharded = da.load_dataset(tmp_path, 'sharded-lmdb')
+    assert [len(x) for x in sharded.shards] == [2, 1, 1]
+    assert len(sharded) == len(dataset)
+    ids = [x['id'] for x in dataset]
+    assert sharded.ids() == ids
+    assert sharded.metadata['id'].tolist() == ids
+    for i, x in enumerate(dataset):
+        assert sharded[i]['atoms'].equals(x['atoms'])
+        assert sharded.id_to_idx(x['id']) == i
+        assert sharded.get(x['id'])['id'] == x['id']
+    assert [x['id'] for x in sharded.get_many([3, 0, 2])] == \
+        [ids[3], ids[0], ids[2]]
+    with pytest.raises(IndexError):
+        sharded[len(dataset)]
+    with pytest.raises(IndexError):
+        sharded.get('missing')
+
+
+def test_lmdb_iterable_dataset(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    ids = dataset.ids()
+    # Keys 0, 1, 10, 11, 2, ... of a larger LMDB.
+    da.make_lmdb_dataset(torch.utils.data.ConcatDataset([dataset] * 3),
+                         tmp_path / 'out')
+    iterable = da.LMDBIterableDataset(tmp_path / 'out', block_size=5)
+    assert [x['id'] for x in iterable] == \
+        [ids[i % 4] for i in [0, 1, 10, 11, 2, 3, 4, 5, 6, 7, 8, 9]]
+    shuffled = da.LMDBIterableDataset(tmp_path / 'out', shuffle=True,
+                                      block_size=2, buffer_size=3)
+    first = [x['id'] for x in shuffled]
+    assert sorted(first) == sorted(ids * 3)
+    assert [x['id'] for x in shuffled] == first
+    shuffled.set_epoch(1)
+    assert [x['id'] for x in shuffled] != first
+    # Blocks are split among ranks and workers.
+    items = []
+    for rank in range(2):
+        loader = torch.utils.data.DataLoader(
+            da.LMDBIterableDataset(tmp_path / 'out', block_size=2,
+                                   num_replicas=2, rank=rank),
+            batch_size=None, num_workers=2)
+        items.extend(x['id'] for x in loader)
+    assert sorted(items) == sorted(ids * 3)
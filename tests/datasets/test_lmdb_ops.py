@@ -0,0 +1,140 @@
+import importlib
+
+import lmdb
+import pandas as pd
+import pytest
+import torch
+
+import atom3d.datasets as da
+import atom3d.datasets.datasets as dd
+import atom3d.datasets.lmdb_ops as lo
+
+
+def test_convert_lmdb_dataset(tmp_path):
+    output_lmdb = tmp_path / 'columnar'
+    lo.convert_lmdb_dataset('tests/test_data/lmdb', output_lmdb, 'columnar')
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    converted = da.load_dataset(output_lmdb, 'lmdb')
+    assert converted._serialization_format == 'columnar'
+    assert converted.ids() == dataset.ids()
+    for i in range(len(dataset)):
+        df, new_df = dataset[i]['atoms'], converted[i]['atoms']
+        assert new_df.x.dtype == 'float32'
+        pd.testing.assert_frame_equal(new_df, df, check_dtype=False,
+                                      check_index_type=False)
+
+
+@pytest.mark.parametrize('compression,module', [
+    ('gzip', 'gzip'), ('zstd', 'zstandard'), ('lz4', 'lz4'), ('none', 'io')])
+def test_convert_lmdb_dataset_compression(tmp_path, compression, module):
+    if importlib.util.find_spec(module) is None:
+        pytest.skip(f'{compression} compression requires {module}!')
+    output_lmdb = tmp_path / compression
+    lo.convert_lmdb_dataset('tests/test_data/lmdb', output_lmdb, 'msgpack',
+                            compression)
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    converted = da.load_dataset(output_lmdb, 'lmdb')
+    assert converted._compression == compression
+    for i in range(len(dataset)):
+        assert converted[i]['atoms'].equals(dataset[i]['atoms'])
+
+
+def test_split_merge_lmdb_dataset(tmp_path):
+    shards = lo.split_lmdb_dataset('tests/test_data/lmdb', tmp_path / 'shards',
+                                   2)
+    assert [p.name for p in shards] == ['lmdb_000.lmdb', 'lmdb_001.lmdb']
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    sharded = da.load_dataset(tmp_path / 'shards', 'sharded-lmdb')
+    assert sharded.ids() == dataset.ids()
+    lo.merge_lmdb_datasets(shards, tmp_path / 'merged')
+    merged = da.load_dataset(tmp_path / 'merged', 'lmdb')
+    assert merged.ids() == dataset.ids()
+    assert merged._serialization_format == dataset._serialization_format
+    for i in range(len(dataset)):
+        assert merged[i]['atoms'].equals(dataset[i]['atoms'])
+
+
+def test_append_delete_compact(tmp_path):
+    dataset = da.load_dataset('tests/test_data/pdb', 'pdb')
+    ids = [x['id'] for x in dataset]
+    output_lmdb = tmp_path / 'out'
+    da.make_lmdb_dataset(torch.utils.data.Subset(dataset, [0, 1]), output_lmdb,
+                         map_size=2**16)
+    old = da.load_dataset(output_lmdb, 'lmdb')
+    assert lo.append_to_lmdb_dataset(
+        torch.utils.data.Subset(dataset, [2, 3]), output_lmdb) == 2
+    with pytest.raises(RuntimeError, match='already'):
+        lo.append_to_lmdb_dataset(torch.utils.data.Subset(dataset, [1]),
+                                  output_lmdb)
+    # Datasets opened before still read the old items.
+    assert len(old) == 2 and old[1]['id'] == ids[1]
+
+    appended = da.load_dataset(output_lmdb, 'lmdb')
+    assert appended.ids() == ids
+    assert appended.metadata['id'].tolist() == ids
+
+    with pytest.raises(IndexError):
+        lo.delete_from_lmdb_dataset(output_lmdb, [ids[1], 'missing'])
+    lo.delete_from_lmdb_dataset(output_lmdb, [ids[1]])
+    remaining = [ids[0], ids[2], ids[3]]
+    deleted = da.load_dataset(output_lmdb, 'lmdb')
+    assert len(deleted) == 3
+    assert [x['id'] for x in deleted] == remaining
+    assert deleted.ids() == remaining
+    assert deleted.id_to_idx(ids[3]) == 2
+    assert deleted.metadata['id'].tolist() == remaining
+    with pytest.raises(IndexError):
+        deleted.get(ids[1])
+    assert sorted(x['id'] for x in da.LMDBIterableDataset(output_lmdb)) == \
+        sorted(remaining)
+
+    lo.compact_lmdb_dataset(output_lmdb, tmp_path / 'compact')
+    compact = da.load_dataset(tmp_path / 'compact', 'lmdb')
+    assert compact._live is None
+    assert compact.ids() == remaining
+    for x, y in zip(compact, deleted):
+        assert x['atoms'].equals(y['atoms'])
+
+
+def test_export_lmdb_subset(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    ids = dataset.ids()
+    da.export_lmdb_subset(dataset, tmp_path / 'subset', [3, 1])
+    subset = da.load_dataset(tmp_path / 'subset', 'lmdb')
+    assert subset.ids() == [ids[3], ids[1]]
+    assert subset.id_to_idx(ids[1]) == 1
+    assert subset[0]['atoms'].equals(dataset[3]['atoms'])
+    with pytest.raises(RuntimeError, match='twice'):
+        da.export_lmdb_subset(dataset, tmp_path / 'twice', [0, 0])
+    # Subsets as returned by splits.
+    da.export_lmdb_subset(torch.utils.data.Subset(subset, [1]),
+                          tmp_path / 'subsubset')
+    subsubset = da.load_dataset(tmp_path / 'subsubset', 'lmdb')
+    assert subsubset.ids() == [ids[1]]
+    assert subsubset[0]['atoms'].equals(dataset[1]['atoms'])
+
+
+def test_verify_repair(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    ids = dataset.ids()
+    output_lmdb = tmp_path / 'out'
+    da.make_lmdb_dataset(dataset, output_lmdb, compression='none',
+                         checksums=True)
+    assert lo.verify_lmdb_dataset(output_lmdb)['ok']
+    assert lo.verify_lmdb_dataset(output_lmdb, num_workers=2)['ok']
+
+    dd._close_lmdb_env(output_lmdb)
+    with lmdb.open(str(output_lmdb)) as env:
+        with env.begin(write=True) as txn:
+            txn.put(b'1', b'garbage')
+            # Still valid JSON, only the checksum tells.
+            txn.put(b'2', bytes(txn.get(b'2')).replace(b'"C"', b'"N"', 1))
+    report = lo.verify_lmdb_dataset(output_lmdb, num_workers=2)
+    assert not report['ok']
+    assert sorted(report['bad']) == [1, 2]
+    assert 'checksum' in report['bad'][2]
+
+    assert lo.repair_lmdb_dataset(output_lmdb, report) == [1, 2]
+    assert lo.verify_lmdb_dataset(output_lmdb)['ok']
+    repaired = da.load_dataset(output_lmdb, 'lmdb')
+    assert repaired.ids() == [ids[0], ids[3]]
@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+
+import atom3d.datasets as da
+
+
+def test_atom_counts(tmp_path):
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    expected = [len(x['atoms']) for x in dataset]
+    cache_file = tmp_path / 'counts.npy'
+    assert da.atom_counts(dataset, cache_file).tolist() == expected
+    assert np.load(cache_file).tolist() == expected
+    # Counts of datasets with a metadata index come from there.
+    da.make_lmdb_dataset(dataset, tmp_path / 'out')
+    new_dataset = da.load_dataset(tmp_path / 'out', 'lmdb')
+    assert da.atom_counts(new_dataset).tolist() == expected
+    subset = torch.utils.data.Subset(new_dataset, [3, 1])
+    assert da.atom_counts(subset).tolist() == [expected[3], expected[1]]
+
+
+def test_size_bucket_sampler():
+    sizes = np.random.default_rng(0).integers(1, 1000, 200)
+    dataset = list(range(200))
+    sampler = da.SizeBucketSampler(dataset, batch_size=8, max_atoms=2000,
+                                   num_buckets=5, sizes=sizes)
+    batches = list(sampler)
+    assert sorted(i for batch in batches for i in batch) == dataset
+    for batch in batches:
+        assert len(batch) <= 8
+        assert len(batch) == 1 or sizes[batch].sum() <= 2000
+    # Batches stay within one bucket of sizes.
+    order = np.argsort(sizes, kind='stable')
+    bucket = np.empty(200, dtype=int)
+    for b, indices in enumerate(np.array_split(order, 5)):
+        bucket[indices] = b
+    assert all(len(set(bucket[batch])) == 1 for batch in batches)
+    assert len(sampler) == len(batches)
+    assert list(sampler) == batches
+    sampler.set_epoch(1)
+    assert list(sampler) != batches
+
+
+def test_size_bucket_sampler_loader():
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    sampler = da.SizeBucketSampler(dataset, batch_size=2, num_buckets=2)
+    loader = torch.utils.data.DataLoader(dataset, batch_sampler=sampler,
+                                         collate_fn=lambda x: x)
+    sizes = sorted(len(x['atoms']) for x in dataset)
+    for batch in loader:
+        assert sorted(len(x['atoms']) for x in batch) in \
+            [sizes[:2], sizes[2:]]
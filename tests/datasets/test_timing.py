@@ -0,0 +1,45 @@
+import torch
+
+import atom3d.datasets as da
+import atom3d.datasets.timing as ti
+
+
+def test_timing_disabled():
+    ti.reset()
+    dataset = da.load_dataset('tests/test_data/lmdb', 'lmdb')
+    dataset[0]
+    assert len(ti.summary()) == 0
+
+
+def test_timing(tmp_path):
+    calls = []
+
+    def hook(stage, seconds, nbytes):
+        calls.append(stage)
+
+    ti.reset()
+    ti.enable(tmp_path)
+    ti.add_hook(hook)
+    try:
+        dataset = da.LMDBDataset('tests/test_data/lmdb',
+                                 transform=lambda x: x)
+        dataset[0]
+        dataset.get_many([1, 2])
+        summary = ti.summary().set_index('stage')
+        assert summary.loc['get', 'calls'] == 2
+        assert summary.loc['get', 'bytes'] > 0
+        for stage in ['decompress', 'deserialize', 'dataframe', 'transform']:
+            assert summary.loc[stage, 'calls'] == 3
+        assert calls.count('transform') == 3
+
+        loader = torch.utils.data.DataLoader(dataset, batch_size=None,
+                                             num_workers=2)
+        assert len(list(loader)) == len(dataset)
+        del loader
+    finally:
+        ti.remove_hook(hook)
+        ti.disable()
+    workers = ti.load(tmp_path)
+    assert workers['pid'].nunique() == 2
+    total = ti.load(tmp_path, per_process=False).set_index('stage')
+    assert total.loc['deserialize', 'calls'] == len(dataset)
@@ -86,3 +86,55 @@ def test_split_by_group_size():
     assert sum( np.sort([i['scaffold'] for i in val_dataset]) == [3,3,4,4,5,5] ) == 6
     assert sum( np.sort([i['scaffold'] for i in test_dataset]) == [6,7,8,9,10,11] ) == 6
 
+
+
+def test_split_by_group_metadata():
+    # Values are taken from the metadata index instead of the elements
+    class MetadataDataset(MockDataset):
+        @property
+        def metadata(self):
+            return {'year': self.year}
+        def __getitem__(self, idx):
+            item = super().__getitem__(idx)
+            del item['year']
+            return item
+    s = spl.split_by_year(MetadataDataset(np.arange(30), years, scaffold),
+                          train_values=range(1900,2011),
+                          val_values=range(2011,2016),
+                          test_values=range(2016,2021))
+    train_dataset, val_dataset, test_dataset = s
+    assert [i['data'] for i in train_dataset] == list(range(10,30))
+    assert [i['data'] for i in test_dataset] == list(range(0,5))
+
+
+def test_split_by_group_metadata_missing():
+    # Missing values in the metadata index are taken from the elements
+    class PartialMetadataDataset(MockDataset):
+        @property
+        def metadata(self):
+            return {'year': np.where(np.arange(30) < 5, np.nan, self.year),
+                    'scaffold': [-1] * 30}
+    partial = PartialMetadataDataset(np.arange(30), years, scaffold)
+    s = spl.split_by_year(partial,
+                          train_values=range(1900,2011),
+                          val_values=range(2011,2016),
+                          test_values=range(2016,2021))
+    train_dataset, val_dataset, test_dataset = s
+    assert [i['data'] for i in test_dataset] == list(range(0,5))
+    # ... and raise as before if the elements do not have them either
+    class MissingDataset(PartialMetadataDataset):
+        def __getitem__(self, idx):
+            item = super().__getitem__(idx)
+            del item['year']
+            return item
+    with pytest.raises(KeyError):
+        spl.split_by_year(MissingDataset(np.arange(30), years, scaffold),
+                          train_values=range(1900,2011),
+                          val_values=range(2011,2016),
+                          test_values=range(2016,2021))
+    # Functions always read the elements
+    s = spl.split_by_group_size(partial,
+                                value_fn=lambda x: x['scaffold'],
+                                val_split=0.2, test_split=0.2)
+    train_dataset, val_dataset, test_dataset = s
+    assert sum( np.sort([i['scaffold'] for i in train_dataset]) == [0]*10 + [1]*5 + [2]*3 ) == 18
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import atom3d.datasets as da
+import atom3d.util.atoms as at
+import atom3d.util.formats as fo
+
+
+df = fo.bp_to_df(fo.read_any('tests/test_data/pdb/103l.pdb'))
+
+
+def test_from_dataframe():
+    atoms = at.AtomArray.from_dataframe(df)
+    assert len(atoms) == len(df)
+    assert atoms.columns == df.columns.tolist()
+    assert np.array_equal(atoms.x, df.x.to_numpy())
+    assert np.array_equal(atoms['element'], df['element'].to_numpy())
+    assert atoms[['x', 'y', 'z']].to_numpy().shape == (len(df), 3)
+    pd.testing.assert_frame_equal(atoms.to_dataframe(), df)
+
+
+def test_from_split():
+    split = df.to_dict(orient='split')
+    atoms = at.AtomArray.from_split(**split)
+    pd.testing.assert_frame_equal(atoms.to_dataframe(),
+                                  pd.DataFrame(**split))
+
+
+def test_mask():
+    atoms = at.AtomArray.from_dataframe(df)
+    selected = atoms[atoms.element == 'C']
+    pd.testing.assert_frame_equal(selected.to_dataframe(),
+                                  df[df.element == 'C'])
+
+
+def test_groupby():
+    atoms = at.AtomArray.from_dataframe(df)
+    groups = atoms.groupby(['chain', 'residue'])
+    expected = list(df.groupby(['chain', 'residue']))
+    assert len(groups) == len(expected)
+    for (key, group), (expected_key, expected_group) in zip(groups, expected):
+        assert key == expected_key
+        pd.testing.assert_frame_equal(group.to_dataframe(), expected_group)
+    assert [key for key, _ in atoms.groupby('chain')] == \
+        [key for key, _ in df.groupby('chain')]
+
+
+def test_load_dataset_lmdb_atom_arrays():
+    dataset = da.LMDBDataset('tests/test_data/lmdb', atom_arrays=True)
+    reference = da.LMDBDataset('tests/test_data/lmdb')
+    for i in range(len(dataset)):
+        atoms = dataset[i]['atoms']
+        assert isinstance(atoms, at.AtomArray)
+        pd.testing.assert_frame_equal(atoms.to_dataframe(),
+                                      reference[i]['atoms'])
@@ -17,6 +17,11 @@ def test_find_files():
     assert file_list == [Path(x) for x in test_file_list]
 
 
+def test_find_files_single_file():
+    assert fi.find_files(test_file_list[0], 'pdb') == [Path(test_file_list[0])]
+    assert fi.find_files(test_file_list[0], 'cif') == []
+
+
 def test_get_pdb_code():
     codes = []
     for path in test_file_list:
@@ -1,5 +1,8 @@
 import pytest
 import importlib
+import tarfile
+
+import pandas as pd
 
 import atom3d.util.formats as fo
 
@@ -27,6 +30,47 @@ def test_read_any_mmcif():
         assert nr==numres[c]
 
 
+def test_read_pdb_to_df():
+    for c in numres.keys():
+        for f in ['tests/test_data/pdb/'+c+'.pdb',
+                  'tests/test_data/pdbgz/'+c+'.pdb.gz']:
+            df = fo.read_pdb_to_df(f)
+            pd.testing.assert_frame_equal(df, fo.bp_to_df(fo.read_any(f)))
+            residues = ['chain', 'hetero', 'residue', 'insertion_code']
+            assert df.groupby(residues).ngroups == numres[c]
+
+
+def test_read_pdb_to_df_fallback(tmp_path):
+    # Alternate locations are left to Biopython.
+    with open('tests/test_data/pdb/103l.pdb') as f:
+        lines = [x for x in f if x.startswith('ATOM')][:10]
+    lines[3] = lines[3][:16] + 'A' + lines[3][17:]
+    lines.append(lines[3][:16] + 'B' + lines[3][17:])
+    f = tmp_path / 'altloc.pdb'
+    f.write_text(''.join(lines))
+    assert fo._parse_pdb_atoms(f.read_bytes(), 'altloc.pdb') is None
+    pd.testing.assert_frame_equal(fo.read_any_to_df(f),
+                                  fo.bp_to_df(fo.read_any(f)))
+
+
+def test_read_mmcif_to_df():
+    for c in numres.keys():
+        f = 'tests/test_data/mmcif/'+c+'.cif'
+        df = fo.read_mmcif_to_df(f)
+        pd.testing.assert_frame_equal(df, fo.bp_to_df(fo.read_any(f)))
+        # Small chunks and a selection of columns.
+        columns = ['model', 'chain', 'residue', 'x', 'element']
+        pd.testing.assert_frame_equal(
+            fo.read_mmcif_to_df(f, columns=columns, chunk_size=100),
+            df[columns])
+
+
+def test_mmcif_tokens():
+    line = 'ATOM 1 "O5\'" \'it\'s\' . ? 1.0 # comment'
+    assert fo._mmcif_tokens(line) == \
+        ['ATOM', '1', "O5'", "it's", '.', '?', '1.0']
+
+
 # -- Reading SDF format --
 
 numat_sdf = {'1j01':18,'2yme':23,'4tjz':12,'6b4n':46}
@@ -103,3 +147,46 @@ def test_merge_and_split_dfs():
 
 
 
+
+def test_df_to_bps():
+    df_list = [fo.read_any_to_df('tests/test_data/pdb/'+c+'.pdb')
+               for c in numres.keys()]
+    bps = fo.df_to_bps(fo.merge_dfs(df_list))
+    assert [bp.id for bp in bps] == sorted(c+'.pdb' for c in numres.keys())
+    keys = ['model', 'chain', 'hetero', 'residue', 'insertion_code']
+    for bp in bps:
+        df = df_list[list(numres.keys()).index(bp.id[:-4])]
+        assert [m.id for m in bp] == [0]
+        assert len(list(bp.get_residues())) == numres[bp.id[:-4]]
+        # Residues come out sorted by their keys.
+        pd.testing.assert_frame_equal(
+            fo.bp_to_df(bp),
+            df.sort_values(keys, kind='stable').reset_index(drop=True))
+
+
+def test_read_xyz_atoms():
+    for c in numat_gdb.keys():
+        f = 'tests/test_data/xyz-gdb/dsgdb9nsd_'+c+'.xyz'
+        df, data, freq, smiles, inchi = fo.read_xyz_atoms(f, gdb=True)
+        bp, *labels = fo.read_xyz(f, gdb=True)
+        assert labels == [data, freq, smiles, inchi]
+        assert inchi_gdb[c] == inchi
+        pd.testing.assert_frame_equal(df, fo.bp_to_df(bp))
+        assert df['name'].is_unique
+
+
+def test_read_xyz_bulk(tmp_path):
+    with tarfile.open(tmp_path / 'gdb.tar.bz2', 'w:bz2') as tar:
+        tar.add('tests/test_data/xyz-gdb', arcname='xyz-gdb')
+    for path in ['tests/test_data/xyz-gdb', tmp_path / 'gdb.tar.bz2']:
+        atoms, molecules = fo.read_xyz_bulk(path, gdb=True)
+        assert molecules['num_atoms'].tolist() == \
+            [numat_gdb[c] for c in sorted(numat_gdb.keys())]
+        assert molecules['inchi'].tolist() == \
+            [inchi_gdb[c] for c in sorted(numat_gdb.keys())]
+        for (_, m), c in zip(molecules.iterrows(), sorted(numat_gdb.keys())):
+            df = fo.read_xyz_atoms(
+                'tests/test_data/xyz-gdb/dsgdb9nsd_'+c+'.xyz')
+            pd.testing.assert_frame_equal(
+                atoms[m['offset']:m['offset'] + m['num_atoms']]
+                .reset_index(drop=True), df)